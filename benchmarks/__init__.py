@@ -0,0 +1 @@
+"""Offline benchmarks for the street-view-green-view pipeline stages."""
@@ -0,0 +1,66 @@
+"""Benchmark the vectorized point sampler against the per-line sampler."""
+
+import time
+
+import geopandas as gpd
+from loguru import logger
+import numpy as np
+import shapely
+import typer
+
+try:
+    from typing import Annotated
+except ImportError:
+    # For Python <3.9
+    from typing_extensions import Annotated
+
+from benchmarks.synthetic import synthetic_roads
+from src.create_points import (
+    DEFAULT_MINI_DIST,
+    interpolate_along_line,
+    interpolate_along_lines,
+)
+
+app = typer.Typer()
+
+
+def sample_per_line(lines: gpd.GeoSeries, mini_dist: float) -> gpd.GeoSeries:
+    """Per-line sampling as done by create_points before vectorization."""
+    return lines.apply(interpolate_along_line, args=(mini_dist,)).explode(
+        ignore_index=True, index_parts=False
+    )
+
+
+@app.command()
+def main(
+    n_segments: Annotated[
+        int, typer.Option(help="Number of synthetic road segments.")
+    ] = 1_000_000,
+    mini_dist: Annotated[
+        float, typer.Option(help="Distance in meters between interpolated points.")
+    ] = DEFAULT_MINI_DIST,
+    seed: Annotated[int, typer.Option(help="Random seed.")] = 0,
+):
+    """Time per-line and vectorized point sampling on a synthetic road network."""
+    logger.info("Generating {} synthetic road segments", n_segments)
+    lines = synthetic_roads(n_segments, seed=seed).geometry.to_crs("EPSG:3857")
+
+    start = time.perf_counter()
+    expected = sample_per_line(lines, mini_dist)
+    per_line = time.perf_counter() - start
+    logger.info("Per-line sampler: {:.2f} s ({} points)", per_line, len(expected))
+    # Only keep the coordinates so both sets of Points are not in memory at once
+    expected = expected.get_coordinates().to_numpy()
+
+    start = time.perf_counter()
+    _, points = interpolate_along_lines(lines.to_numpy(), mini_dist)
+    vectorized = time.perf_counter() - start
+    logger.info("Vectorized sampler: {:.2f} s ({} points)", vectorized, len(points))
+
+    if not np.array_equal(expected, shapely.get_coordinates(points)):
+        raise RuntimeError("Vectorized sampler does not match per-line sampler")
+    logger.success("Speedup: {:.1f}x", per_line / vectorized)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,70 @@
+"""Benchmark GVI scoring throughput with an increasing number of worker processes."""
+
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import time
+from typing import List, Optional
+
+from loguru import logger
+import numpy as np
+import typer
+
+try:
+    from typing import Annotated
+except ImportError:
+    # For Python <3.9
+    from typing_extensions import Annotated
+
+from benchmarks.synthetic import write_geotagged_jpeg
+from src.assign_gvi_to_points import DEFAULT_CHUNK_SIZE, score_images
+
+app = typer.Typer()
+
+
+def write_panoramas(images_path: Path, n: int, width: int, height: int) -> List[str]:
+    """Writes n synthetic panoramas with random amounts of green, returning their
+    paths."""
+    rng = np.random.default_rng(0)
+    paths = []
+    for i, green_fraction in enumerate(rng.uniform(0, 0.6, n)):
+        path = Path(images_path, f"{i:06d}.jpeg")
+        write_geotagged_jpeg(path, 0, 0, green_fraction, width, height, seed=i)
+        paths.append(str(path))
+    return paths
+
+
+@app.command()
+def main(
+    n_images: Annotated[int, typer.Option(help="Number of images.")] = 200,
+    width: Annotated[int, typer.Option(help="Image width in pixels.")] = 4096,
+    height: Annotated[int, typer.Option(help="Image height in pixels.")] = 2048,
+    workers: Annotated[
+        Optional[List[int]],
+        typer.Option(help="Worker counts to measure, powers of 2 up to the CPUs."),
+    ] = None,
+    chunk_size: Annotated[
+        int, typer.Option(help="Number of images sent to a worker at a time.")
+    ] = DEFAULT_CHUNK_SIZE,
+):
+    """Measure images/sec of GVI scoring on synthetic panoramas from 1 to N worker
+    processes, checking that scores do not depend on the number of workers."""
+    if not workers:
+        workers = [2**i for i in range(int(np.log2(os.cpu_count())) + 1)]
+    with TemporaryDirectory() as images_path:
+        logger.info("Writing {} synthetic {}x{} panoramas", n_images, width, height)
+        paths = write_panoramas(Path(images_path), n_images, width, height)
+        expected = None
+        for level in workers:
+            start = time.perf_counter()
+            scores = list(score_images(paths, workers=level, chunk_size=chunk_size))
+            images_per_second = n_images / (time.perf_counter() - start)
+            if expected is None:
+                expected = scores
+            elif scores != expected:
+                raise RuntimeError(f"Scores with {level} workers do not match")
+            typer.echo(f"workers {level:>3}: {images_per_second:8.1f} images/sec")
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,65 @@
+"""Benchmark the integer GVI kernel against the floating point implementation."""
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import time
+import tracemalloc
+
+import cv2
+from loguru import logger
+import typer
+
+try:
+    from typing import Annotated
+except ImportError:
+    # For Python <3.9
+    from typing_extensions import Annotated
+
+from benchmarks.synthetic import synthetic_panorama
+from src.assign_gvi_to_points import get_gvi_score, get_gvi_score_float
+
+app = typer.Typer()
+
+
+def measure(score, image_path: str, repeat: int):
+    """Returns the score, the mean seconds per image, and the peak MB allocated
+    while scoring an image."""
+    tracemalloc.start()
+    result = score(image_path)
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        score(image_path)
+    return result, (time.perf_counter() - start) / repeat, peak
+
+
+@app.command()
+def main(
+    width: Annotated[int, typer.Option(help="Image width in pixels.")] = 8192,
+    height: Annotated[int, typer.Option(help="Image height in pixels.")] = 4096,
+    green_fraction: Annotated[
+        float, typer.Option(help="Fraction of green pixels.")
+    ] = 0.3,
+    repeat: Annotated[int, typer.Option(help="Number of timed runs.")] = 5,
+):
+    """Measure per-image latency and peak memory of GVI scoring on a synthetic
+    panorama, with the integer and the floating point implementations."""
+    with TemporaryDirectory() as images_path:
+        image_path = str(Path(images_path, "panorama.jpeg"))
+        logger.info("Writing a synthetic {}x{} panorama", width, height)
+        cv2.imwrite(image_path, synthetic_panorama(green_fraction, width, height))
+
+        results = {}
+        for name, score in (("float", get_gvi_score_float), ("integer", get_gvi_score)):
+            results[name], seconds, peak = measure(score, image_path, repeat)
+            typer.echo(
+                f"{name:>8}: {seconds * 1000:8.1f} ms/image {peak:8.1f} MB peak "
+                f"GVI {results[name]:.4f}"
+            )
+    logger.info("Score difference: {:.4f}", abs(results["integer"] - results["float"]))
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,85 @@
+"""Report GVI accuracy and speed of reduced-resolution decoding at each scale."""
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import time
+from typing import List, Optional
+
+from loguru import logger
+import numpy as np
+import typer
+
+try:
+    from typing import Annotated
+except ImportError:
+    # For Python <3.9
+    from typing_extensions import Annotated
+
+from benchmarks.synthetic import write_geotagged_jpeg
+from src.assign_gvi_to_points import DECODE_FLAGS, get_gvi_score
+
+app = typer.Typer()
+
+
+def score_all(image_paths: List[str], scale: int):
+    """Returns the GVI score of each image at a scale, and the images per second."""
+    start = time.perf_counter()
+    scores = np.array(
+        [get_gvi_score(image_path, scale=scale) for image_path in image_paths]
+    )
+    return scores, len(image_paths) / (time.perf_counter() - start)
+
+
+def report(image_paths: List[str]):
+    """Prints the speed and the error against full resolution at each scale."""
+    expected = None
+    for scale in DECODE_FLAGS:
+        scores, images_per_second = score_all(image_paths, scale)
+        if expected is None:
+            expected = scores
+        errors = np.abs(scores - expected)
+        typer.echo(
+            f"scale 1/{scale}: {images_per_second:8.1f} images/sec, GVI error "
+            f"mean {errors.mean():.3f} p95 {np.percentile(errors, 95):.3f} "
+            f"max {errors.max():.3f}"
+        )
+
+
+@app.command()
+def main(
+    image_directory: Annotated[
+        Optional[Path],
+        typer.Option(help="Directory of sample .jpeg images, synthetic if not set."),
+    ] = None,
+    n_images: Annotated[
+        int, typer.Option(help="Number of images to sample or generate.")
+    ] = 50,
+    width: Annotated[int, typer.Option(help="Synthetic image width.")] = 4096,
+    height: Annotated[int, typer.Option(help="Synthetic image height.")] = 2048,
+):
+    """Measure images/sec and GVI error against full-resolution decoding for each
+    --scale of assign_gvi_to_points, on sample or synthetic panoramas."""
+    if image_directory is not None:
+        image_paths = sorted(str(path) for path in image_directory.glob("*.jpeg"))
+        rng = np.random.default_rng(0)
+        if len(image_paths) > n_images:
+            image_paths = sorted(rng.choice(image_paths, n_images, replace=False))
+        logger.info("Scoring {} images from {}", len(image_paths), image_directory)
+        report(image_paths)
+        return
+
+    with TemporaryDirectory() as images_path:
+        logger.info("Writing {} synthetic {}x{} panoramas", n_images, width, height)
+        rng = np.random.default_rng(0)
+        image_paths = []
+        for i, green_fraction in enumerate(rng.uniform(0, 0.6, n_images)):
+            image_path = str(Path(images_path, f"{i:06d}.jpeg"))
+            write_geotagged_jpeg(
+                image_path, 0, 0, green_fraction, width, height, seed=i, canopy=True
+            )
+            image_paths.append(image_path)
+        report(image_paths)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,104 @@
+"""Benchmark Mapillary image assignment throughput against a local stand-in server."""
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import time
+from typing import List
+
+from loguru import logger
+import numpy as np
+import typer
+
+try:
+    from typing import Annotated
+except ImportError:
+    # For Python <3.9
+    from typing_extensions import Annotated
+
+from benchmarks.mock_mapillary import MockMapillaryServer
+from benchmarks.synthetic import DEFAULT_CENTER
+from src.assign_gvi_to_points import score_results
+from src.images.mapillary import Mapillary
+
+app = typer.Typer()
+
+
+def grid_locations(n: int, spacing: float = 30.0, center=DEFAULT_CENTER):
+    """Returns latitudes and longitudes of n locations on a square grid."""
+    side = int(np.ceil(np.sqrt(n)))
+    rows, columns = np.divmod(np.arange(n), side)
+    latitudes = center[0] + rows * spacing / 111_111
+    longitudes = center[1] + columns * spacing / (
+        111_111 * np.cos(np.radians(center[0]))
+    )
+    return latitudes, longitudes
+
+
+def run(
+    server: MockMapillaryServer,
+    points,
+    concurrency: int,
+    prefetch: bool,
+    score_workers: int = 0,
+):
+    """Assigns images to the points, and scores them from memory as they are
+    downloaded if score_workers is set, returning points per second."""
+    with TemporaryDirectory() as images_path:
+        source = Mapillary(
+            "token",
+            Path(images_path),
+            10,
+            url=server.images_url,
+            concurrency=concurrency,
+            keep_images=score_workers == 0,
+            with_content=score_workers > 0,
+        )
+        start = time.perf_counter()
+        if prefetch:
+            source.prefetch(*points)
+        results = source.get_images_from_coordinates(zip(*points))
+        if score_workers > 0:
+            results = score_results(results, workers=score_workers)
+        for _ in results:
+            pass
+        return len(points[0]) / (time.perf_counter() - start)
+
+
+@app.command()
+def main(
+    n_points: Annotated[int, typer.Option(help="Number of points.")] = 500,
+    latency: Annotated[
+        float, typer.Option(help="Server latency per request, in seconds.")
+    ] = 0.02,
+    concurrency: Annotated[
+        List[int], typer.Option(help="Concurrency levels to measure.")
+    ] = [1, 8, 32],
+    prefetch: Annotated[
+        bool, typer.Option(help="Prefetch image metadata for the points.")
+    ] = False,
+    score_workers: Annotated[
+        int,
+        typer.Option(
+            help="Processes scoring images as they are downloaded, 0 not to score."
+        ),
+    ] = 0,
+):
+    """Measure points/sec of Mapillary image assignment at several concurrency levels,
+    with one image near each point."""
+    logger.remove()
+    latitudes, longitudes = grid_locations(n_points)
+    server = MockMapillaryServer(
+        [str(i) for i in range(n_points)], latitudes, longitudes, latency=latency
+    )
+    # Render thumbnails ahead of time so that only request handling is measured
+    for image_id in server.ids:
+        server.thumbnail(image_id)
+    points = (latitudes + 2 / 111_111, longitudes)
+    with server:
+        for level in concurrency:
+            points_per_second = run(server, points, level, prefetch, score_workers)
+            typer.echo(f"concurrency {level:>3}: {points_per_second:8.1f} points/sec")
+
+
+if __name__ == "__main__":
+    app()
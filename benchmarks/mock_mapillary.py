@@ -0,0 +1,244 @@
+"""Local stand-in for the Mapillary Graph API images endpoint and thumbnail URLs."""
+
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlencode, urlparse
+import zlib
+
+import numpy as np
+from PIL import Image
+
+from benchmarks.synthetic import synthetic_panorama
+
+# Largest page size accepted by the Graph API
+MAX_LIMIT = 2000
+
+
+class MockMapillaryServer:
+    """HTTP server answering `images?bbox=` searches and thumbnail downloads for a
+    fixed set of synthetic images, on a random local port in a background thread.
+
+    Search responses are paged: when more images match than the requested `limit`,
+    the response includes a `paging.next` URL for the following page, unless paging
+    is off, as the Graph API does past some number of results.
+
+    Example:
+        >>> with MockMapillaryServer(ids, latitudes, longitudes) as server:
+        ...     source = Mapillary("token", images_path, 10, url=server.images_url)
+    """
+
+    def __init__(
+        self,
+        ids,
+        latitudes,
+        longitudes,
+        is_pano=None,
+        green_fractions=None,
+        latency: float = 0.0,
+        image_size: tuple = (256, 128),
+        rate_limit: tuple = None,
+        retry_after: bool = True,
+        paging: bool = True,
+    ):
+        """
+        Args:
+            ids: image IDs
+            latitudes: image latitudes in decimal degrees
+            longitudes: image longitudes in decimal degrees
+            is_pano: whether each image is a panorama, all True if not set
+            green_fractions: fraction of green pixels of each thumbnail, 0.3 if not
+                set
+            latency (float): seconds to wait before answering each request
+            image_size (tuple): (width, height) of the thumbnails
+            rate_limit (tuple): (requests, seconds) allowed of searches and of
+                thumbnails each, in any window of that many seconds. Requests
+                beyond are answered with 429 Too Many Requests
+            retry_after (bool): tell throttled clients when to retry, with a
+                Retry-After header
+            paging (bool): answer searches with more matches than `limit` with
+                more pages, or else only with the first one
+        """
+        self.ids = np.asarray(ids, dtype=str)
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.is_pano = (
+            np.ones(len(self.ids), dtype=bool)
+            if is_pano is None
+            else np.asarray(is_pano, dtype=bool)
+        )
+        self.green_fractions = dict(
+            zip(
+                self.ids.tolist(),
+                np.full(len(self.ids), 0.3)
+                if green_fractions is None
+                else green_fractions,
+            )
+        )
+        self.latency = latency
+        self.image_size = image_size
+        self.metadata_requests = 0
+        self.image_requests = 0
+        # IDs of images whose thumbnails are cut short, as by a broken connection
+        self.truncated = set()
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.paging = paging
+        self.throttled_requests = 0
+        self._windows = {"search": deque(), "thumbnail": deque()}
+        self._lock = threading.Lock()
+        self._thumbnails = {}
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def images_url(self) -> str:
+        return f"{self.url}/images"
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, args=(0.05,), daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_counts(self):
+        with self._lock:
+            self.metadata_requests = 0
+            self.image_requests = 0
+
+    def throttle(self, kind: str):
+        """Counts a request of a kind, search or thumbnail, and returns None if it
+        is within the rate limit, or else the seconds until it would be."""
+        if self.rate_limit is None:
+            return None
+        requests, seconds = self.rate_limit
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows[kind]
+            while window and window[0] <= now - seconds:
+                window.popleft()
+            if len(window) < requests:
+                window.append(now)
+                return None
+            self.throttled_requests += 1
+            return window[0] + seconds - now
+
+    def search(self, params: dict) -> dict:
+        """Returns the JSON body of an `images` search for the query parameters."""
+        left, bottom, right, top = (float(v) for v in params["bbox"].split(","))
+        mask = (
+            (self.longitudes >= left)
+            & (self.longitudes <= right)
+            & (self.latitudes >= bottom)
+            & (self.latitudes <= top)
+        )
+        if params.get("is_pano") == "true":
+            mask &= self.is_pano
+        matches = np.flatnonzero(mask)
+        limit = min(int(params.get("limit", MAX_LIMIT)), MAX_LIMIT)
+        after = int(params.get("after", 0))
+        page = matches[after : after + limit]
+        body = {
+            "data": [
+                {
+                    "id": self.ids[i],
+                    "thumb_original_url": f"{self.url}/thumbnails/{self.ids[i]}.jpg",
+                    "geometry": {
+                        "type": "Point",
+                        "coordinates": [self.longitudes[i], self.latitudes[i]],
+                    },
+                }
+                for i in page
+            ]
+        }
+        if self.paging and after + limit < len(matches):
+            next_params = dict(params, after=str(after + limit))
+            body["paging"] = {"next": f"{self.images_url}?{urlencode(next_params)}"}
+        return body
+
+    def thumbnail(self, image_id: str) -> bytes:
+        """Returns the JPEG bytes of the thumbnail of an image."""
+        with self._lock:
+            if image_id not in self._thumbnails:
+                image = Image.fromarray(
+                    synthetic_panorama(
+                        self.green_fractions[image_id],
+                        *self.image_size,
+                        seed=zlib.crc32(image_id.encode()),
+                    )[:, :, ::-1]
+                )
+                buffer = BytesIO()
+                image.save(buffer, format="JPEG", quality=90)
+                self._thumbnails[image_id] = buffer.getvalue()
+            return self._thumbnails[image_id]
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if server.latency:
+                    time.sleep(server.latency)
+                parsed = urlparse(self.path)
+                kind = "search" if parsed.path == "/images" else "thumbnail"
+                wait = server.throttle(kind)
+                if wait is not None:
+                    self._send(429, "text/plain", b"Too Many Requests", wait)
+                elif parsed.path == "/images":
+                    with server._lock:
+                        server.metadata_requests += 1
+                    params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                    body = json.dumps(server.search(params)).encode()
+                    self._send(200, "application/json", body)
+                elif parsed.path.startswith("/thumbnails/"):
+                    with server._lock:
+                        server.image_requests += 1
+                    image_id = parsed.path[len("/thumbnails/") :].rsplit(".", 1)[0]
+                    if image_id not in server.green_fractions:
+                        self._send(404, "text/plain", b"Not Found")
+                    else:
+                        thumbnail = server.thumbnail(image_id)
+                        if image_id in server.truncated:
+                            thumbnail = thumbnail[: len(thumbnail) // 2]
+                        self._send(200, "image/jpeg", thumbnail)
+                else:
+                    self._send(404, "text/plain", b"Not Found")
+
+            def _send(self, status, content_type, body, retry_after=None):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                if retry_after is not None and server.retry_after:
+                    self.send_header("Retry-After", f"{retry_after:.3f}")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
@@ -0,0 +1,303 @@
+"""Time every pipeline stage end to end on synthetic data, offline, and compare the
+results of two runs, for example of two commits."""
+
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
+import json
+import os
+from pathlib import Path
+import platform
+import subprocess
+from tempfile import TemporaryDirectory
+import time
+from typing import Dict, List, Optional
+
+import geopandas as gpd
+from loguru import logger
+import numpy as np
+import typer
+
+try:
+    from typing import Annotated
+except ImportError:
+    # For Python <3.9
+    from typing_extensions import Annotated
+
+from benchmarks.mock_mapillary import MockMapillaryServer
+from benchmarks.synthetic import synthetic_roads, write_geotagged_jpeg
+from src import assign_gvi_to_points, assign_images, create_points
+from src.images.image_source import ImageSourceSelector
+
+app = typer.Typer()
+
+# Version of the format of the results file
+RESULTS_VERSION = 1
+
+
+def environment() -> dict:
+    """Returns the commit, interpreter and machine the suite runs on."""
+
+    def git(*args) -> Optional[str]:
+        try:
+            return subprocess.run(
+                ["git", *args], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+@contextmanager
+def quiet():
+    """Silences the logs and progress bars of the pipeline stages."""
+    logger.remove()
+    with open(os.devnull, "w") as devnull:
+        try:
+            with redirect_stdout(devnull), redirect_stderr(devnull):
+                yield
+        finally:
+            logger.remove()
+
+
+def timed(stage: str, scale: int, items: int, repeat: int, function) -> dict:
+    """Runs a stage repeat times, and returns the best of its times."""
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with quiet():
+            function()
+        seconds.append(time.perf_counter() - start)
+    typer.echo(
+        f"{stage:<24} scale {scale:>7}: {min(seconds):8.3f}s "
+        f"{items / min(seconds):10.1f} items/sec"
+    )
+    return {
+        "stage": stage,
+        "scale": scale,
+        "items": items,
+        "seconds": min(seconds),
+        "seconds_all": seconds,
+        "items_per_second": items / min(seconds),
+    }
+
+
+def write_images(
+    images_path: Path, points: gpd.GeoDataFrame, width: int, height: int
+) -> np.ndarray:
+    """Writes a geotagged panorama 2 meters from each point, with a random known
+    fraction of green pixels, and returns the green fractions."""
+    rng = np.random.default_rng(0)
+    green_fractions = rng.uniform(0, 0.6, len(points))
+    for i, (point, green_fraction) in enumerate(zip(points.geometry, green_fractions)):
+        write_geotagged_jpeg(
+            Path(images_path, f"{i}.jpeg"),
+            point.y + 2 / 111_111,
+            point.x,
+            green_fraction,
+            width,
+            height,
+            seed=i,
+        )
+    return green_fractions
+
+
+def run_scale(
+    work_path: Path,
+    n_segments: int,
+    repeat: int,
+    width: int,
+    height: int,
+    latency: float,
+    workers: int,
+) -> List[dict]:
+    """Times each stage on a synthetic road network of n_segments roads."""
+    results = []
+    roads_file = Path(work_path, "roads.gpkg")
+    points_file = Path(work_path, "points.gpkg")
+    # Roads are as dense as in a town, whatever their number
+    synthetic_roads(n_segments, extent=0.002 * np.sqrt(n_segments)).to_file(roads_file)
+    results.append(
+        timed(
+            "create_points",
+            n_segments,
+            n_segments,
+            repeat,
+            lambda: create_points.main(roads_file, points_file),
+        )
+    )
+
+    points = gpd.read_file(points_file)
+    local_path = Path(work_path, "local")
+    local_path.mkdir()
+    green_fractions = write_images(local_path, points, width, height)
+    results.append(
+        timed(
+            "assign_images_local",
+            n_segments,
+            len(points),
+            repeat,
+            lambda: assign_images.main(
+                points_file, ImageSourceSelector.local, local_path, rebuild_index=True
+            ),
+        )
+    )
+    images_file = Path(work_path, "points_images.gpkg")
+    output_file = Path(work_path, "gvi.gpkg")
+    results.append(
+        timed(
+            "assign_gvi_to_points",
+            n_segments,
+            len(points),
+            repeat,
+            lambda: assign_gvi_to_points.main(
+                local_path,
+                images_file,
+                output_file,
+                workers=workers,
+                score_cache=False,
+            ),
+        )
+    )
+
+    mapillary_path = Path(work_path, "mapillary")
+    server = MockMapillaryServer(
+        [str(i) for i in range(len(points))],
+        points.geometry.y + 2 / 111_111,
+        points.geometry.x,
+        green_fractions=green_fractions,
+        latency=latency,
+        image_size=(width, height),
+    )
+    # Render thumbnails ahead of time so that only the client is measured
+    for image_id in server.ids:
+        server.thumbnail(image_id)
+
+    def assign_mapillary():
+        for path in mapillary_path.glob("*"):
+            path.unlink()
+        assign_images.main(
+            points_file,
+            ImageSourceSelector.mapillary,
+            mapillary_path,
+            prefetch=True,
+            cache=False,
+        )
+
+    environ = dict(os.environ)
+    os.environ["MAPILLARY_CLIENT_TOKEN"] = "token"
+    os.environ["MAPILLARY_API_URL"] = server.images_url
+    try:
+        with server:
+            results.append(
+                timed(
+                    "assign_images_mapillary",
+                    n_segments,
+                    len(points),
+                    repeat,
+                    assign_mapillary,
+                )
+            )
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+    return results
+
+
+@app.command()
+def run(
+    output_file: Annotated[
+        Path, typer.Argument(help="JSON file to write the results to.")
+    ],
+    scales: Annotated[
+        Optional[List[int]],
+        typer.Option("--scale", help="Numbers of road segments to measure."),
+    ] = None,
+    repeat: Annotated[
+        int, typer.Option(min=1, help="Runs of each stage, the best is kept.")
+    ] = 3,
+    width: Annotated[int, typer.Option(help="Synthetic image width.")] = 512,
+    height: Annotated[int, typer.Option(help="Synthetic image height.")] = 256,
+    latency: Annotated[
+        float, typer.Option(help="Mock Mapillary latency per request, in seconds.")
+    ] = 0.01,
+    workers: Annotated[int, typer.Option(min=1, help="Processes scoring images.")] = 1,
+):
+    """Time create_points, assign_images with LOCAL and MAPILLARY images, and
+    assign_gvi_to_points on synthetic roads and images, at each scale, and write
+    the results to a JSON file."""
+    if not scales:
+        scales = [10, 100]
+    results = []
+    for n_segments in scales:
+        with TemporaryDirectory() as work_path:
+            results.extend(
+                run_scale(
+                    Path(work_path), n_segments, repeat, width, height, latency, workers
+                )
+            )
+    output_file.write_text(
+        json.dumps(
+            {
+                "version": RESULTS_VERSION,
+                "environment": environment(),
+                "parameters": {
+                    "repeat": repeat,
+                    "width": width,
+                    "height": height,
+                    "latency": latency,
+                    "workers": workers,
+                },
+                "results": results,
+            },
+            indent=2,
+        )
+    )
+    typer.echo(f"Results written to {output_file}")
+
+
+def load_results(results_file: Path) -> Dict[tuple, dict]:
+    """Returns the results of a results file, keyed by stage and scale."""
+    return {
+        (result["stage"], result["scale"]): result
+        for result in json.loads(results_file.read_text())["results"]
+    }
+
+
+@app.command()
+def compare(
+    base_file: Annotated[Path, typer.Argument(help="Results to compare against.")],
+    new_file: Annotated[Path, typer.Argument(help="Results to compare.")],
+    threshold: Annotated[
+        float,
+        typer.Option(help="Slowdown, as a fraction, reported as a regression."),
+    ] = 0.1,
+):
+    """Compare the times of two runs of the suite, stage by stage, and exit with an
+    error if a stage is slower by more than the threshold."""
+    base = load_results(base_file)
+    new = load_results(new_file)
+    regressions = 0
+    typer.echo(f"{'stage':<24}{'scale':>8}{'base':>10}{'new':>10}{'change':>9}")
+    for key in sorted(base.keys() & new.keys()):
+        change = new[key]["seconds"] / base[key]["seconds"] - 1
+        regression = change > threshold
+        regressions += regression
+        typer.echo(
+            f"{key[0]:<24}{key[1]:>8}{base[key]['seconds']:>9.3f}s"
+            f"{new[key]['seconds']:>9.3f}s{change:>+8.1%}"
+            + ("  REGRESSION" if regression else "")
+        )
+    if regressions > 0:
+        typer.echo(f"{regressions} stages slower by more than {threshold:.0%}")
+        raise typer.Exit(code=1)
+
+
+if __name__ == "__main__":
+    app()
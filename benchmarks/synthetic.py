@@ -0,0 +1,172 @@
+"""Generators for synthetic input data used by the benchmarks."""
+
+import geopandas as gpd
+import numpy as np
+from PIL import Image
+from PIL.ExifTags import GPS, IFD
+import shapely
+
+from src.create_points import DEFAULT_HIGHWAY_VALUES_TO_KEEP
+
+# Three Rivers, Michigan, USA
+DEFAULT_CENTER = (41.9437, -85.6325)  # latitude, longitude
+
+
+def synthetic_roads(
+    n_segments: int,
+    center: tuple = DEFAULT_CENTER,
+    extent: float = 0.2,
+    min_length: float = 10.0,
+    max_length: float = 400.0,
+    max_vertices: int = 5,
+    seed: int = 0,
+) -> gpd.GeoDataFrame:
+    """Returns a GeoDataFrame of random OpenStreetMap-like road LineStrings in WGS84.
+
+    Args:
+        n_segments (int): number of LineString features to generate
+        center (tuple): (latitude, longitude) around which roads are placed
+        extent (float): width and height in degrees of the area covered by the roads
+        min_length (float): approximate minimum length in meters of a road segment
+        max_length (float): approximate maximum length in meters of a road segment
+        max_vertices (int): maximum number of vertices in a road segment (at least 2)
+        seed (int): random seed
+
+    Returns:
+        geopandas.GeoDataFrame: roads with 'osm_id', 'highway' and geometry columns
+    """
+    rng = np.random.default_rng(seed)
+    n_vertices = rng.integers(2, max_vertices + 1, size=n_segments)
+    total = n_vertices.sum()
+    line_index = np.repeat(np.arange(n_segments), n_vertices)
+
+    # Each road is a random walk from its start point, with the segment length split
+    # evenly between its edges
+    starts = np.column_stack(
+        [
+            center[1] + rng.uniform(-extent / 2, extent / 2, size=n_segments),
+            center[0] + rng.uniform(-extent / 2, extent / 2, size=n_segments),
+        ]
+    )
+    lengths = rng.uniform(min_length, max_length, size=n_segments) / 111_111
+    step = np.repeat(lengths / (n_vertices - 1), n_vertices)
+    angle = rng.uniform(0, 2 * np.pi, size=total)
+    offsets = np.column_stack([np.cos(angle), np.sin(angle)]) * step[:, None]
+    # The first vertex of each road sits on its start point
+    first = np.cumsum(n_vertices) - n_vertices
+    offsets[first] = 0.0
+    offsets = np.cumsum(offsets, axis=0)
+    offsets -= np.repeat(offsets[first], n_vertices, axis=0)
+    coords = starts[line_index] + offsets
+
+    geometry = shapely.linestrings(coords, indices=line_index)
+    return gpd.GeoDataFrame(
+        {
+            "osm_id": np.arange(1, n_segments + 1).astype(str),
+            "highway": rng.choice(DEFAULT_HIGHWAY_VALUES_TO_KEEP, size=n_segments),
+        },
+        geometry=geometry,
+        crs="EPSG:4326",
+    )
+
+
+def decimal_to_dms(decimal: float) -> tuple:
+    """Converts decimal degrees to unsigned EXIF (degrees, minutes, seconds)."""
+    decimal = abs(decimal)
+    degrees = int(decimal)
+    minutes = int((decimal - degrees) * 60)
+    seconds = round((decimal - degrees - minutes / 60) * 3600, 4)
+    return (float(degrees), float(minutes), seconds)
+
+
+def synthetic_panorama(
+    green_fraction: float, width: int = 256, height: int = 128, seed: int = 0
+) -> np.ndarray:
+    """Returns a BGR image array where `green_fraction` of the pixels are vegetation
+    green and the others are grey or sky blue, with a little noise.
+
+    Args:
+        green_fraction (float): fraction of pixels that are green, between 0 and 1
+        width (int): image width in pixels
+        height (int): image height in pixels
+        seed (int): random seed
+
+    Returns:
+        numpy.ndarray: uint8 array of shape (height, width, 3) in BGR order
+    """
+    rng = np.random.default_rng(seed)
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[: height // 2] = (235, 206, 135)  # sky
+    image[height // 2 :] = (128, 128, 128)  # road
+    green = rng.permutation(height * width)[
+        : int(round(green_fraction * height * width))
+    ]
+    image.reshape(-1, 3)[green] = (34, 139, 34)
+    noise = rng.integers(-8, 9, size=image.shape)
+    return np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def synthetic_canopy_panorama(
+    green_fraction: float, width: int = 256, height: int = 128, seed: int = 0
+) -> np.ndarray:
+    """Returns a BGR image array like `synthetic_panorama`, but where the green
+    pixels form elliptical tree crowns instead of being scattered, as in real
+    street-level imagery. Crowns are added until about `green_fraction` of the
+    pixels are green.
+
+    Args:
+        green_fraction (float): fraction of pixels that are green, between 0 and 1
+        width (int): image width in pixels
+        height (int): image height in pixels
+        seed (int): random seed
+
+    Returns:
+        numpy.ndarray: uint8 array of shape (height, width, 3) in BGR order
+    """
+    rng = np.random.default_rng(seed)
+    image = synthetic_panorama(0, width, height, seed)
+    rows, columns = np.ogrid[:height, :width]
+    green = np.zeros((height, width), dtype=bool)
+    while green.mean() < green_fraction:
+        center_row, center_column = rng.uniform(0, height), rng.uniform(0, width)
+        radius = rng.uniform(0.05, 0.15) * height
+        green |= ((rows - center_row) / radius) ** 2 + (
+            (columns - center_column) / (1.5 * radius)
+        ) ** 2 <= 1
+    noise = rng.integers(-8, 9, size=(int(green.sum()), 3))
+    image[green] = np.clip(np.array((34, 139, 34)) + noise, 0, 255)
+    return image
+
+
+def write_geotagged_jpeg(
+    path,
+    latitude: float,
+    longitude: float,
+    green_fraction: float = 0.3,
+    width: int = 256,
+    height: int = 128,
+    seed: int = 0,
+    canopy: bool = False,
+):
+    """Writes a synthetic panorama JPEG with EXIF GPS coordinates.
+
+    Args:
+        path: file path to write the JPEG to
+        latitude (float): latitude of the image in decimal degrees
+        longitude (float): longitude of the image in decimal degrees
+        green_fraction (float): fraction of pixels that are green, between 0 and 1
+        width (int): image width in pixels
+        height (int): image height in pixels
+        seed (int): random seed
+        canopy (bool): whether green pixels form tree crowns, see
+            `synthetic_canopy_panorama`, instead of being scattered
+    """
+    panorama = synthetic_canopy_panorama if canopy else synthetic_panorama
+    image = Image.fromarray(panorama(green_fraction, width, height, seed)[:, :, ::-1])
+    exif = Image.Exif()
+    gps = exif.get_ifd(IFD.GPSInfo)
+    gps[GPS.GPSLatitudeRef] = "N" if latitude >= 0 else "S"
+    gps[GPS.GPSLatitude] = decimal_to_dms(latitude)
+    gps[GPS.GPSLongitudeRef] = "E" if longitude >= 0 else "W"
+    gps[GPS.GPSLongitude] = decimal_to_dms(longitude)
+    image.save(path, exif=exif, quality=90)
@@ -1,15 +1,31 @@
 """Assign Green View score to point features"""
 
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import os
 from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 import cv2
 import geopandas as gpd
+from loguru import logger
 import numpy as np
 import pandas as pd
 from skimage.filters import threshold_otsu
 import tqdm
 import typer
+from typer_config import use_toml_config
+
+from src import metrics
+from src.concurrency import bounded_map
+from src.images.image_store import PackedImageStore, open_store
+from src.score_cache import (
+    DEFAULT_MAX_SIZE_MB,
+    ScoreCache,
+    content_digest,
+    file_digest,
+)
+from src.score_journal import ScoreJournal
 
 try:
     from typing import Annotated
@@ -20,11 +36,182 @@ except ImportError:
 
 app = typer.Typer()
 
+# Number of images scored by a worker process per task
+DEFAULT_CHUNK_SIZE = 16
+# Number of scores written to the journal per transaction
+DEFAULT_BATCH_SIZE = 256
+# Number of pixels converted to ExG at a time
+STRIP_PIXELS = 1 << 20
+# Number of bins of the Otsu histogram, as in skimage.filters.threshold_otsu
+OTSU_BINS = 256
+# Name and version of the scoring method, to bump whenever get_gvi_score changes
+# its results, so that cached scores are not reused
+GVI_METHOD = "exg-otsu"
+GVI_VERSION = 2
+# cv2.imread flags decoding JPEG images at a reduced scale, in the DCT domain
+DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def _exg_tables():
+    """
+    Build the lookup tables of exg_histogram.
+
+    get_gvi_score_float calculates ExG as (2 * g - r) - b on float32 channels
+    divided by 255. Pixels with the same integer 2 * G - R - B can get float32
+    ExG values a few ulps apart, which matters when Otsu bin edges fall on
+    them, so each distinct float32 value is counted on its own: the first table
+    maps G * 256 + R to the index of 2 * g - r, and the second maps that index
+    * 256 + B to the index of the ExG value.
+
+    Returns:
+        tuple: The table of 2 * g - r indices, the table of ExG indices, and
+            the sorted float32 ExG values.
+    """
+    channel = np.arange(256, dtype=np.float32) / np.float32(255)
+    partial_values, partial_index = np.unique(
+        2 * channel[:, None] - channel[None, :], return_inverse=True
+    )
+    exg_values, exg_index = np.unique(
+        partial_values[:, None] - channel[None, :], return_inverse=True
+    )
+    return (
+        partial_index.reshape(-1).astype(np.uint16),
+        exg_index.reshape(-1).astype(np.uint16),
+        exg_values,
+    )
+
+
+PARTIAL_INDEX, EXG_INDEX, EXG_VALUES = _exg_tables()
+
 
-def get_gvi_score(image_path):
+def exg_histogram(image):
+    """
+    Count the pixels of an image at each value of Excess Green (ExG).
+
+    ExG values are looked up from the integer channels, a strip of rows at a
+    time, so that no floating point copy of the image is made. The values are
+    the float32 values of get_gvi_score_float, bit for bit.
+
+    Args:
+        image (numpy.ndarray): uint8 BGR image, as read by cv2.imread.
+
+    Returns:
+        numpy.ndarray: Number of pixels with each ExG value of EXG_VALUES.
+    """
+    histogram = np.zeros(len(EXG_VALUES), dtype=np.int64)
+    strip_rows = max(1, STRIP_PIXELS // image.shape[1])
+    for start in range(0, image.shape[0], strip_rows):
+        strip = image[start : start + strip_rows]
+        index = np.left_shift(strip[..., 1], 8, dtype=np.uint32)
+        index |= strip[..., 2]
+        index = PARTIAL_INDEX[index].astype(np.uint32)
+        index <<= 8
+        index |= strip[..., 0]
+        histogram += np.bincount(EXG_INDEX[index].ravel(), minlength=len(EXG_VALUES))
+    return histogram
+
+
+def green_pixels_from_histogram(histogram):
+    """
+    Count the pixels above the Otsu threshold of ExG from an ExG histogram.
+
+    The values are binned over their range into OTSU_BINS float32 bins, as
+    skimage.filters.threshold_otsu does with the pixels of the float32 ExG image
+    of get_gvi_score_float, so that the bins, and the threshold, are the same.
+
+    Args:
+        histogram (numpy.ndarray): Number of pixels at each ExG value, as
+            returned by exg_histogram.
+
+    Returns:
+        int: Number of pixels with an ExG above the Otsu threshold.
+    """
+    present = np.flatnonzero(histogram)
+    # Like threshold_otsu, an image with a single ExG has no pixel above it
+    if len(present) < 2:
+        return 0
+    counts = histogram[present]
+    exg = EXG_VALUES[present]
+    edges = np.histogram_bin_edges(exg, bins=OTSU_BINS, range=(exg[0], exg[-1]))
+    binned, _ = np.histogram(exg, bins=edges, weights=counts)
+    threshold = threshold_otsu(
+        hist=(binned.astype(np.int64), (edges[:-1] + edges[1:]) / 2)
+    )
+    return int(counts[exg > threshold].sum())
+
+
+def get_gvi_score(image_path, scale=1):
     """
     Calculate the Green View Index (GVI) for a given image file.
 
+    ExG and the Otsu threshold are calculated from a histogram of the image, in
+    a single pass and without floating point copies of the image. Scores are
+    identical to those of get_gvi_score_float.
+
+    With a scale above 1, JPEG images are decoded at 1/scale of their width and
+    height by skipping DCT coefficients, so the full-resolution image is never
+    built in memory. As GVI is a share of pixels, it changes little.
+
+    Args:
+        image_path (str): Path to the image file.
+        scale (int): Reduction of the decoded image, one of 1, 2, 4 or 8.
+
+    Returns:
+        float: The Green View Index (GVI) score for the given image.
+    """
+    if scale not in DECODE_FLAGS:
+        raise ValueError(f"Scale must be one of {list(DECODE_FLAGS)}, not {scale}")
+    with metrics.timer("gvi.decode"):
+        image = cv2.imread(image_path, DECODE_FLAGS[scale])
+    if image is None:
+        raise ValueError(f"Could not read image: {image_path}")
+    return _gvi_score_of_image(image)
+
+
+def get_gvi_score_from_content(image_content, scale=1):
+    """
+    Calculate the Green View Index (GVI) for the content of an image file, as
+    get_gvi_score does for the file, without writing it to disk.
+
+    Args:
+        image_content (bytes): Content of the image file.
+        scale (int): Reduction of the decoded image, one of 1, 2, 4 or 8.
+
+    Returns:
+        float: The Green View Index (GVI) score for the given image.
+    """
+    if scale not in DECODE_FLAGS:
+        raise ValueError(f"Scale must be one of {list(DECODE_FLAGS)}, not {scale}")
+    with metrics.timer("gvi.decode"):
+        image = cv2.imdecode(
+            np.frombuffer(image_content, np.uint8), DECODE_FLAGS[scale]
+        )
+    if image is None:
+        raise ValueError("Could not decode image content")
+    return _gvi_score_of_image(image)
+
+
+def _gvi_score_of_image(image):
+    with metrics.timer("gvi.compute"):
+        green_pixels = green_pixels_from_histogram(exg_histogram(image))
+    metrics.count("gvi.images")
+    metrics.count("gvi.pixels", image.shape[0] * image.shape[1])
+    return (green_pixels / (image.shape[0] * image.shape[1])) * 100
+
+
+def get_gvi_score_float(image_path):
+    """
+    Calculate the Green View Index (GVI) for a given image file, on floating
+    point copies of the image.
+
+    This is the reference implementation of get_gvi_score, which is faster and
+    uses much less memory.
+
     Args:
         image_path (str): Path to the image file.
 
@@ -52,7 +239,395 @@ def get_gvi_score(image_path):
     return gvi_score
 
 
+def score_parameters(scale=1):
+    """
+    Describe how images are scored, to key cached scores with.
+
+    Args:
+        scale (int): Reduction of the decoded images.
+
+    Returns:
+        str: The scoring method, version and parameters.
+    """
+    return f"{GVI_METHOD}:v{GVI_VERSION}:scale={scale}"
+
+
+# Score cache and image store of a worker process, set by _init_worker
+_worker_cache = None
+_worker_store = None
+
+
+def _init_worker(
+    cache: Optional[ScoreCache] = None,
+    store: Optional[PackedImageStore] = None,
+    record_metrics: bool = False,
+):
+    global _worker_cache, _worker_store
+    # Each process scores one image at a time, so OpenCV threads would only
+    # compete with the other processes
+    cv2.setNumThreads(1)
+    _worker_cache = cache
+    _worker_store = store
+    metrics.enable(record_metrics)
+    metrics.reset()
+
+
+def _score_cached(
+    images: List[str],
+    scale: int,
+    cache: Optional[ScoreCache],
+    store: Optional[PackedImageStore] = None,
+) -> List[Tuple[float, bool]]:
+    if store is not None:
+        # Images are read by ID from the memory maps of the store, without copies
+        contents = (store.get(image_id) for image_id in images)
+        digest = content_digest
+        score_image = get_gvi_score_from_content
+    else:
+        contents = images
+        digest = file_digest
+        score_image = get_gvi_score
+    if cache is None:
+        return [
+            (_score_or_nan(score_image, content, scale), False) for content in contents
+        ]
+    parameters = score_parameters(scale)
+    results = []
+    new_scores = []
+    for content in contents:
+        content_key = digest(content)
+        score = cache.get(content_key, parameters)
+        results.append((score, score is not None))
+        if score is None:
+            score = _score_or_nan(score_image, content, scale)
+            results[-1] = (score, False)
+            # Images that could not be decoded are tried again in later runs
+            if not np.isnan(score):
+                new_scores.append((content_key, parameters, score))
+    cache.put(new_scores)
+    return results
+
+
+def _score_or_nan(score_image, content, scale: int) -> float:
+    # An image that cannot be decoded, such as a truncated download, has no score
+    # rather than stopping the run
+    try:
+        return score_image(content, scale=scale)
+    except (ValueError, OSError):
+        metrics.count("gvi.unreadable")
+        return np.nan
+
+
+def _score_chunk(
+    images: List[str], scale: int = 1
+) -> Tuple[List[Tuple[float, bool]], Optional[dict]]:
+    # Metrics of the worker are sent back with the scores of each chunk
+    return _score_cached(images, scale, _worker_cache, _worker_store), metrics.collect()
+
+
+def score_images(
+    image_paths: List[str],
+    workers: int = 1,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    scale: int = 1,
+    cache: Optional[ScoreCache] = None,
+    store: Optional[PackedImageStore] = None,
+) -> Iterator[float]:
+    """
+    Calculate the GVI score of each image, on a pool of worker processes.
+
+    Images are sent to the workers in chunks, and at most two chunks per worker
+    are in flight at a time, so memory use does not grow with the number of
+    images. Scores are the same as get_gvi_score, whatever the number of workers.
+
+    With a cache, images whose content was already scored with the same method
+    and parameters are not decoded again, and the hits and misses of the cache
+    are counted.
+
+    With a packed image store, images are read from the store by ID instead of
+    from files.
+
+    Images that cannot be decoded, such as truncated files, are given a NaN
+    score, and are not cached.
+
+    Args:
+        image_paths (list): Paths to the image files, or IDs of the images in
+            the store if there is one.
+        workers (int): Number of worker processes, 1 to score in this process.
+        chunk_size (int): Number of images sent to a worker at a time.
+        scale (int): Reduction of the decoded images, one of 1, 2, 4 or 8.
+        cache (ScoreCache): Cache of scores to look images up in and add to.
+        store (PackedImageStore): Store to read the images from.
+
+    Returns:
+        Iterator[float]: The GVI score of each image, in the order of image_paths,
+            or NaN.
+    """
+    if scale not in DECODE_FLAGS:
+        raise ValueError(f"Scale must be one of {list(DECODE_FLAGS)}, not {scale}")
+    chunks = (
+        image_paths[i : i + chunk_size] for i in range(0, len(image_paths), chunk_size)
+    )
+    if workers == 1:
+        results = (_score_cached(chunk, scale, cache, store) for chunk in chunks)
+        yield from _count_hits(results, cache)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(cache, store, metrics.enabled()),
+    ) as executor:
+        score_chunk = partial(_score_chunk, scale=scale)
+        results = bounded_map(executor, score_chunk, chunks, 2 * workers)
+        yield from _count_hits(metrics.merged(results), cache)
+
+
+def _count_hits(
+    results: Iterator[List[Tuple[float, bool]]], cache: Optional[ScoreCache]
+) -> Iterator[float]:
+    for chunk in results:
+        for score, hit in chunk:
+            if cache is not None:
+                cache.hits += hit
+                cache.misses += not hit
+            yield score
+
+
+def _score_result(
+    result: dict, scale: int = 1, store: Optional[PackedImageStore] = None
+) -> dict:
+    image_content = result.pop("image_content", None)
+    result["gvi_score"] = None
+    try:
+        if image_content is not None:
+            result["gvi_score"] = get_gvi_score_from_content(image_content, scale)
+        elif result["image_path"] is not None:
+            result["gvi_score"] = get_gvi_score(str(result["image_path"]), scale)
+        elif store is not None and result["image_id"] is not None:
+            result["gvi_score"] = get_gvi_score_from_content(
+                store.get(result["image_id"]), scale
+            )
+    except (ValueError, OSError, KeyError) as e:
+        result["error"] = e.__class__.__name__
+    return result
+
+
+def _score_worker_result(result: dict, scale: int = 1) -> Tuple[dict, Optional[dict]]:
+    return _score_result(result, scale, _worker_store), metrics.collect()
+
+
+def score_results(
+    results: Iterable[dict],
+    workers: int = 1,
+    scale: int = 1,
+    store: Optional[PackedImageStore] = None,
+) -> Iterator[dict]:
+    """
+    Calculate the GVI score of the image of each point as images are assigned,
+    on a pool of worker processes.
+
+    The results of an image source are consumed lazily, with at most two per
+    worker waiting to be scored, so that images are downloaded while others are
+    scored, and only a few are held in memory at a time.
+
+    Args:
+        results (Iterable[dict]): Result dicts of an image source, with the
+            image_content of the image, its image_path, or its image_id in the
+            store.
+        workers (int): Number of worker processes, 1 to score in this process.
+        scale (int): Reduction of the decoded images, one of 1, 2, 4 or 8.
+        store (PackedImageStore): Store to read images without a path from.
+
+    Returns:
+        Iterator[dict]: The result dicts, in order, with the gvi_score of the
+            image, or None, and without the image_content.
+    """
+    if workers == 1:
+        yield from map(partial(_score_result, scale=scale, store=store), results)
+        return
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(None, store, metrics.enabled()),
+    ) as executor:
+        score_result = partial(_score_worker_result, scale=scale)
+        yield from metrics.merged(
+            bounded_map(executor, score_result, results, 2 * workers)
+        )
+
+
+def image_work_list(
+    gdf: gpd.GeoDataFrame,
+    image_directory: Path,
+    store: Optional[PackedImageStore] = None,
+) -> Tuple[Dict[str, str], List[str]]:
+    """
+    List the images to score for a set of points, each image once.
+
+    The image of a point is read from its `image_path` if it has one and the
+    file exists, and otherwise from `<image_id>.jpeg` in the image directory.
+    With a packed image store, images are instead read from the store by ID.
+
+    Args:
+        gdf (geopandas.GeoDataFrame): Points with an `image_id` column, and
+            optionally an `image_path` column, as written by assign_images.
+        image_directory (Path): Directory holding the images of the points.
+        store (PackedImageStore): Store holding the images of the points.
+
+    Returns:
+        tuple: The path of each image to score by image ID, or its ID if it is in
+            the store, sorted by image ID, and the IDs of the images of points
+            whose file could not be found.
+    """
+    image_paths = gdf["image_path"] if "image_path" in gdf else [None] * len(gdf.index)
+    packed = store.image_ids() if store is not None else set()
+    images = {}
+    missing = set()
+    for image_id, image_path in zip(gdf["image_id"], image_paths):
+        if pd.isna(image_id) or str(image_id) in images or str(image_id) in missing:
+            continue
+        image_id = str(image_id)
+        if store is not None:
+            if image_id in packed:
+                images[image_id] = image_id
+            else:
+                missing.add(image_id)
+            continue
+        # assign_images writes "None" for points without an image
+        candidates = [Path(image_directory, f"{image_id}.jpeg")]
+        if isinstance(image_path, str) and image_path != "None":
+            candidates.insert(0, Path(image_path))
+        found = next((path for path in candidates if path.is_file()), None)
+        if found is None:
+            missing.add(image_id)
+        else:
+            images[image_id] = str(found)
+    return dict(sorted(images.items())), sorted(missing)
+
+
+def assign_gvi_scores(
+    gdf: gpd.GeoDataFrame,
+    image_directory: Path,
+    output_file: Path,
+    workers: int = 1,
+    resume: bool = False,
+    scale: int = 1,
+    score_cache: bool = True,
+    score_cache_path: Optional[Path] = None,
+    score_cache_size: float = DEFAULT_MAX_SIZE_MB,
+) -> gpd.GeoDataFrame:
+    """
+    Calculate the GVI score of the image of each point of a GeoDataFrame, in
+    memory, as main does for a points file. The options are those of main.
+
+    Args:
+        gdf (geopandas.GeoDataFrame): Points with an `image_id` column, and
+            optionally an `image_path` column, as returned by assign_images.
+        image_directory (Path): Directory holding the images of the points.
+        output_file (Path): File the points will be written to, next to which
+            scores are journaled as they are calculated.
+
+    Returns:
+        geopandas.GeoDataFrame: A copy of the points, with the `gvi_score` of
+            their image.
+    """
+    if scale not in DECODE_FLAGS:
+        raise ValueError(f"Scale must be one of {list(DECODE_FLAGS)}, not {scale}")
+    gdf = gdf.copy()
+    image_directory = Path(image_directory)
+    # Check interim data is valid
+    # Point data
+    if "Point" in gdf.geometry.type.unique():
+        pass
+    else:
+        raise Exception("Expected point data in the points but none found")
+    # Image IDs (This is based on the output of assign_images.py)
+    if "image_id" in gdf:
+        pass
+    else:
+        raise Exception("Expected an image_id column in the points")
+
+    # Images of a directory with a packed store are read from the store by ID
+    store = open_store(image_directory)
+
+    # Only score the images of the points, each once
+    images, missing = image_work_list(gdf, image_directory, store=store)
+    if len(missing) > 0:
+        logger.warning(
+            "{} images of points could not be found and are not scored",
+            len(missing),
+        )
+        logger.debug("Missing images: {}", missing)
+    if len(images) == 0 and len(missing) > 0:
+        raise Exception("None of the images of the points could be found")
+
+    # Scores are journaled next to the output file as they are calculated
+    journal = ScoreJournal(output_file, score_parameters(scale), resume=resume)
+
+    # Scores of images already scored are looked up in the cache
+    cache = None
+    if score_cache:
+        if score_cache_path is None:
+            score_cache_path = Path(image_directory, ScoreCache.filename)
+        cache = ScoreCache(score_cache_path, max_size_mb=score_cache_size)
+
+    # Loop through each image of the points and get the GVI score
+    scored = journal.scored()
+    image_ids = [image_id for image_id in images if image_id not in scored]
+    scores = score_images(
+        [images[image_id] for image_id in image_ids],
+        workers=workers,
+        scale=scale,
+        cache=cache,
+        store=store,
+    )
+    batch = []
+    unreadable = []
+    for image_id, gvi_score in tqdm.tqdm(zip(image_ids, scores), total=len(image_ids)):
+        # Images that could not be decoded are not journaled, so that a resumed
+        # run tries them again
+        if np.isnan(gvi_score):
+            unreadable.append(image_id)
+            continue
+        batch.append((image_id, float(gvi_score)))
+        if len(batch) >= DEFAULT_BATCH_SIZE:
+            journal.append(batch)
+            batch = []
+    journal.append(batch)
+    if len(unreadable) > 0:
+        logger.warning(
+            "{} images of points could not be decoded and are not scored",
+            len(unreadable),
+        )
+        logger.debug("Unreadable images: {}", unreadable)
+
+    df = journal.read()
+    journal.close()
+    if store is not None:
+        store.close()
+    if cache is not None:
+        cache.evict()
+        cache.close()
+        # Scores evicted by worker processes are only counted in the metrics
+        logger.info(
+            "Score cache: {} hits, {} misses, {} evicted",
+            cache.hits,
+            cache.misses,
+            cache.evicted,
+        )
+
+    # Join the GVI score to the interim point data using the `image id` attribute
+    gdf["gvi_score"] = (
+        gdf["image_id"].astype(str).map(df.set_index("image_id")["gvi_score"])
+    )
+
+    return gdf
+
+
 @app.command()
+@use_toml_config(section=["assign_gvi_to_points"])
 def main(
     image_directory: Annotated[
         Path,
@@ -68,6 +643,60 @@ def main(
             help="File to write output data to (can specify any GDAL-supported format)."
         ),
     ],
+    workers: Annotated[
+        int,
+        typer.Option(min=1, help="Number of processes scoring images in parallel."),
+    ] = 1,
+    resume: Annotated[
+        bool,
+        typer.Option(
+            help="Keep the scores of a previous, interrupted run, and only score "
+            "the images that do not have one yet."
+        ),
+    ] = False,
+    scale: Annotated[
+        int,
+        typer.Option(
+            help="Decode images at 1/scale of their width and height to score them "
+            "faster: 1, 2, 4 or 8."
+        ),
+    ] = 1,
+    score_cache: Annotated[
+        bool,
+        typer.Option(
+            help="Reuse the scores of images already scored with the same method "
+            "and parameters, in this or earlier runs."
+        ),
+    ] = True,
+    score_cache_path: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="File of the score cache, .gvi_cache.sqlite in the image "
+            "directory if not set."
+        ),
+    ] = None,
+    score_cache_size: Annotated[
+        float,
+        typer.Option(
+            min=0,
+            help="Maximum size of the score cache, in megabytes. The least recently "
+            "used scores are evicted first, as new ones are cached.",
+        ),
+    ] = DEFAULT_MAX_SIZE_MB,
+    metrics_out: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="Write the time spent decoding and scoring images, reading and "
+            "writing points, and counters, to this JSON file."
+        ),
+    ] = None,
+    profile: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="Write cProfile statistics of the run to this file. Worker "
+            "processes are not profiled."
+        ),
+    ] = None,
 ):
     """Calculate Green View Index (GVI) scores for a dataset of street-level images.
 
@@ -75,57 +704,51 @@ def main(
             image_directory: directory path for folder holding Mapillary images
             interim_data: file holding interim data (output from create_points.py)
             output_file: file to save GeoPackage output to (provide full path)
+            workers: number of processes scoring images in parallel
+            resume: keep the scores journaled by a previous run, and only score
+                the images that do not have one yet
+            scale: decode images at 1/scale of their width and height, one of 1,
+                2, 4 or 8
+            score_cache: reuse the scores of images already scored with the same
+                method and parameters
+            score_cache_path: file of the score cache, in the image directory if
+                not set
+            score_cache_size: maximum size of the score cache, in megabytes
+            metrics_out: JSON file to write timers and counters of the run to
+            profile: file to write cProfile statistics of the run to
 
     Returns:
             File containing point locations with associated Green View score
 
     """
-    # Check image directory exists
-    if os.path.exists(image_directory):
-        pass
-    else:
-        raise ValueError("Image directory could not be found")
-    # Check image directory contains image files
-    # (This is based on the jpeg export in assign_images.py)
-    if ".jpeg" in "\t".join(os.listdir(os.path.join(image_directory))):
-        pass
-    else:
-        raise Exception(
-            "Image directory doesn't contain expected contents (.jpeg files)"
+    with metrics.recording("assign_gvi_to_points", metrics_out, profile):
+        if scale not in DECODE_FLAGS:
+            raise typer.BadParameter(
+                f"Must be one of {list(DECODE_FLAGS)}", param_hint="--scale"
+            )
+        # Check image directory exists
+        if os.path.exists(image_directory):
+            pass
+        else:
+            raise ValueError("Image directory could not be found")
+        # Open the interim point data
+        with metrics.timer("read_file"):
+            gdf = gpd.read_file(interim_data)
+        gdf = assign_gvi_scores(
+            gdf,
+            image_directory,
+            output_file,
+            workers=workers,
+            resume=resume,
+            scale=scale,
+            score_cache=score_cache,
+            score_cache_path=score_cache_path,
+            score_cache_size=score_cache_size,
         )
-    # Check interim data is valid
-    # Point data
-    if "Point" in gpd.read_file(interim_data).geometry.type.unique():
-        pass
-    else:
-        raise Exception("Expected point data in interim data file but none found")
-
-    # Make an empty dataframe to hold the data
-    df = pd.DataFrame({"filename": [], "gvi_score": []})
-
-    # Loop through each image in the Mapillary folder and get the GVI score
-    for i in tqdm.tqdm(os.listdir(image_directory)):
-        gvi_score = get_gvi_score(os.path.join(image_directory, i))
-
-        temp_df = pd.DataFrame({"filename": [i], "gvi_score": [gvi_score]})
-
-        print(i, "\t", str(gvi_score))
-
-        df = pd.concat([df, temp_df], ignore_index=True)
-
-    # Create an image ID from the file name, to match to the point dataset
-    df["image_id"] = df["filename"].str[:-5]
-
-    # Open the interim point data
-    gdf = gpd.read_file(interim_data)
-
-    # Join the GVI score to the interim point data using the `image id` attribute
-    gdf = gdf.merge(df, how="left", on="image_id")
-
-    # Print how many records were matched on each side
 
-    # Export as GPKG
-    gdf.to_file(output_file)
+        # Export as GPKG
+        with metrics.timer("to_file"):
+            gdf.to_file(output_file)
 
 
 if __name__ == "__main__":
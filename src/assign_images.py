@@ -1,24 +1,190 @@
 from os import getenv
 from pathlib import Path
 import sys
-from typing import Annotated
+from typing import Annotated, Iterable, Optional
 
 import geopandas as gpd
 from loguru import logger as log
+import numpy as np
 from pandas import Series
-from requests.exceptions import HTTPError
-from tenacity import RetryError
 from tqdm import tqdm
 from typer import Argument, Option, Typer
+from typer_config import use_toml_config
 
-from src.images.image_source import ImageSourceSelector
+from src import metrics
+from src.assign_gvi_to_points import DECODE_FLAGS, score_results
+from src.images.exif import DEFAULT_WORKERS
+from src.images.image_source import (
+    RESULT_COLUMNS,
+    ImageSourceSelector,
+    results_to_columns,
+)
+from src.images.image_store import open_store
 from src.images.local_images import LocalImages
-from src.images.mapillary import Mapillary
+from src.images.mapillary import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_METADATA_RATE,
+    DEFAULT_TILE_SIZE,
+    Mapillary,
+)
+from src.images.near_duplicates import (
+    DEFAULT_MAX_DISPLACEMENT,
+    DEFAULT_MAX_HASH_DISTANCE,
+)
+from src.images.response_cache import (
+    DEFAULT_MAX_SIZE_MB,
+    DEFAULT_TTL_DAYS,
+    ResponseCache,
+)
 
 app = Typer()
 
+DEFAULT_MAX_DISTANCE = 10.0  # meters
+
+
+def assign_images_to_points(
+    gdf: gpd.GeoDataFrame,
+    image_source: ImageSourceSelector,
+    images_path: Path,
+    max_distance: float = DEFAULT_MAX_DISTANCE,
+    rebuild_index: bool = False,
+    workers: int = DEFAULT_WORKERS,
+    dedup: bool = False,
+    dedup_distance: float = DEFAULT_MAX_DISPLACEMENT,
+    dedup_hash_distance: int = DEFAULT_MAX_HASH_DISTANCE,
+    prefetch: bool = False,
+    tile_size: float = DEFAULT_TILE_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY,
+    metadata_rate: float = DEFAULT_METADATA_RATE,
+    image_rate: float = 0,
+    cache: bool = True,
+    cache_ttl: float = DEFAULT_TTL_DAYS,
+    cache_size: float = DEFAULT_MAX_SIZE_MB,
+    offline: bool = False,
+    score: bool = False,
+    score_workers: int = 1,
+    scale: int = 1,
+    keep_images: bool = True,
+    packed: bool = False,
+    exclude_images: Iterable[str] = (),
+) -> gpd.GeoDataFrame:
+    """
+    Assigns Images to Points of a GeoDataFrame, in memory, as main does for a
+    points file. The options are those of main
+    Args:
+        gdf: Points to assign images to
+        image_source: Where to get images from
+        images_path: Where the images should be located
+        exclude_images: IDs of images already assigned to other points, that
+            are not assigned again
+
+    Returns: A copy of the points, with the columns of the assigned images, and
+        their gvi_score with score
+
+    """
+    gdf = gdf.copy()
+    images_path = Path(images_path)
+    if not keep_images and not score:
+        raise ValueError("--no-keep-images Requires --score")
+    if scale not in DECODE_FLAGS:
+        raise ValueError(f"--scale Must Be One Of {list(DECODE_FLAGS)}")
+
+    response_cache = None
+    store = None
+    if image_source == ImageSourceSelector.local:
+        source = LocalImages(
+            images_path,
+            max_distance,
+            rebuild_index=rebuild_index,
+            workers=workers,
+            dedup=dedup,
+            dedup_distance=dedup_distance,
+            dedup_hash_distance=dedup_hash_distance,
+        )
+    elif image_source == ImageSourceSelector.mapillary:
+        if offline and not cache:
+            raise ValueError("--offline Requires --cache")
+        if cache:
+            images_path.mkdir(parents=True, exist_ok=True)
+            response_cache = ResponseCache(
+                images_path,
+                ttl_days=cache_ttl,
+                max_size_mb=cache_size,
+                offline=offline,
+            )
+        store = open_store(images_path, create=packed)
+        source = Mapillary(
+            getenv("MAPILLARY_CLIENT_TOKEN"),
+            images_path,
+            max_distance,
+            url=getenv("MAPILLARY_API_URL"),
+            concurrency=concurrency,
+            cache=response_cache,
+            keep_images=keep_images,
+            with_content=score,
+            store=store,
+            metadata_rate=metadata_rate or None,
+            image_rate=image_rate or None,
+        )
+    else:
+        raise ValueError(f"Unknown Image Source: {image_source}")
+
+    source.exclude_images(exclude_images)
+    if prefetch and image_source == ImageSourceSelector.mapillary:
+        source.prefetch(gdf.geometry.y, gdf.geometry.x, tile_size=tile_size)
+
+    points = np.column_stack([gdf.geometry.y, gdf.geometry.x])
+    if score and store is None:
+        # Packed images of LOCAL sources are scored from the store
+        store = open_store(images_path)
+    if score:
+        # Images are scored while the next ones are downloaded
+        results = score_results(
+            source.get_images_from_coordinates(map(tuple, points)),
+            workers=score_workers,
+            scale=scale,
+            store=store,
+        )
+        columns = results_to_columns(
+            tqdm(
+                results,
+                total=len(points),
+                desc="Assigning Images to Points",
+                unit="points",
+            ),
+            RESULT_COLUMNS + ("gvi_score",),
+        )
+    else:
+        columns = source.get_images_for_points(points)
+
+    for column in RESULT_COLUMNS + (("gvi_score",) if score else ()):
+        values = columns[column]
+        if column == "image_path":
+            values = [str(value) for value in values]
+        numeric = column in ("image_lat", "image_lon", "residual", "gvi_score")
+        gdf[column] = Series(
+            values, index=gdf.index, dtype=float if numeric else object
+        )
+
+    if image_source == ImageSourceSelector.mapillary:
+        # Requests slowed down or throttled by Mapillary
+        log.info("Rate Limits: {}", source.metadata_limiter.summary())
+        log.info("Rate Limits: {}", source.image_limiter.summary())
+    if response_cache is not None:
+        log.info(
+            "Response Cache: {} Hits, {} Misses",
+            response_cache.hits,
+            response_cache.misses,
+        )
+        response_cache.close()
+    if store is not None:
+        store.close()
+
+    return gdf
+
 
 @app.command()
+@use_toml_config(section=["assign_images"])
 def main(
     points_file: Annotated[
         Path,
@@ -34,7 +200,165 @@ def main(
     max_distance: Annotated[
         float,
         Option(help="Maximum distance between point and image location, in meters"),
-    ] = 10,
+    ] = DEFAULT_MAX_DISTANCE,
+    rebuild_index: Annotated[
+        bool,
+        Option(
+            help="LOCAL only: read the GPS location of every image again instead of "
+            "reusing the GPS index stored in the images directory"
+        ),
+    ] = False,
+    workers: Annotated[
+        int,
+        Option(
+            min=1,
+            help="LOCAL only: number of threads reading image GPS locations at the "
+            "same time",
+        ),
+    ] = DEFAULT_WORKERS,
+    dedup: Annotated[
+        bool,
+        Option(
+            help="LOCAL only: skip the near-duplicate frames of captures, such as "
+            "those taken while stopped, before assigning and scoring images"
+        ),
+    ] = False,
+    dedup_distance: Annotated[
+        float,
+        Option(
+            min=0,
+            help="--dedup only: maximum distance between near-duplicate frames, "
+            "in meters",
+        ),
+    ] = DEFAULT_MAX_DISPLACEMENT,
+    dedup_hash_distance: Annotated[
+        int,
+        Option(
+            min=0,
+            help="--dedup only: maximum number of differing bits between the 64-bit "
+            "hashes of near-duplicate frames",
+        ),
+    ] = DEFAULT_MAX_HASH_DISTANCE,
+    prefetch: Annotated[
+        bool,
+        Option(
+            help="MAPILLARY only: retrieve the metadata of all images around the "
+            "points with one search per tile, instead of one search per point"
+        ),
+    ] = False,
+    tile_size: Annotated[
+        float,
+        Option(help="MAPILLARY only: size of the --prefetch tiles, in degrees"),
+    ] = DEFAULT_TILE_SIZE,
+    concurrency: Annotated[
+        int,
+        Option(
+            min=1,
+            help="MAPILLARY only: maximum number of requests to Mapillary at the "
+            "same time",
+        ),
+    ] = DEFAULT_CONCURRENCY,
+    metadata_rate: Annotated[
+        float,
+        Option(
+            min=0,
+            help="MAPILLARY only: maximum number of searches per second, "
+            "unlimited if 0",
+        ),
+    ] = DEFAULT_METADATA_RATE,
+    image_rate: Annotated[
+        float,
+        Option(
+            min=0,
+            help="MAPILLARY only: maximum number of image downloads per second, "
+            "unlimited if 0",
+        ),
+    ] = 0,
+    cache: Annotated[
+        bool,
+        Option(
+            help="MAPILLARY only: cache the responses of Mapillary searches in the "
+            "images directory, and reuse them in later runs"
+        ),
+    ] = True,
+    cache_ttl: Annotated[
+        float,
+        Option(
+            min=0,
+            help="MAPILLARY only: age after which cached responses are requested "
+            "again, in days",
+        ),
+    ] = DEFAULT_TTL_DAYS,
+    cache_size: Annotated[
+        float,
+        Option(
+            min=0,
+            help="MAPILLARY only: maximum size of the response cache, in megabytes. "
+            "The least recently used responses are evicted first",
+        ),
+    ] = DEFAULT_MAX_SIZE_MB,
+    offline: Annotated[
+        bool,
+        Option(
+            help="MAPILLARY only: only use cached responses and already downloaded "
+            "images, without calling Mapillary"
+        ),
+    ] = False,
+    score: Annotated[
+        bool,
+        Option(
+            help="Calculate the GVI score of each image as soon as it is assigned, "
+            "while other images are downloaded"
+        ),
+    ] = False,
+    score_workers: Annotated[
+        int,
+        Option(min=1, help="--score only: number of processes scoring images"),
+    ] = 1,
+    scale: Annotated[
+        int,
+        Option(
+            help="--score only: decode images at 1/scale of their width and height: "
+            "1, 2, 4 or 8"
+        ),
+    ] = 1,
+    keep_images: Annotated[
+        bool,
+        Option(
+            help="MAPILLARY only: write downloaded images to the images directory. "
+            "Use --no-keep-images with --score to score them from memory only"
+        ),
+    ] = True,
+    packed: Annotated[
+        bool,
+        Option(
+            help="MAPILLARY only: keep downloaded images in a packed store in the "
+            "images directory instead of one file per image. Always used if the "
+            "images directory already has a store"
+        ),
+    ] = False,
+    output_file: Annotated[
+        Optional[Path],
+        Option(
+            help="Where to write the points and their images, "
+            "<points_file stem>_images.gpkg next to the points file if not set"
+        ),
+    ] = None,
+    metrics_out: Annotated[
+        Optional[Path],
+        Option(
+            help="Write the time spent in Mapillary requests, downloads, EXIF "
+            "parsing, scoring, reading and writing points, and counters, to this "
+            "JSON file"
+        ),
+    ] = None,
+    profile: Annotated[
+        Optional[Path],
+        Option(
+            help="Write cProfile statistics of the run to this file. Scoring worker "
+            "processes are not profiled"
+        ),
+    ] = None,
     verbose: Annotated[bool, Option(help="Sets log level to DEBUG")] = False,
 ) -> Path:
     """
@@ -46,6 +370,45 @@ def main(
         images_path: Where the images should be located
         max_distance: Maximum distance between point and image location, in meters
             Can also be interpreted as "radius" of image bounding box
+        rebuild_index: LOCAL only: read the GPS location of every image again
+            instead of reusing the GPS index stored in the images directory
+        workers: LOCAL only: number of threads reading image GPS locations at the
+            same time
+        dedup: LOCAL only: skip the near-duplicate frames of captures, such as
+            those taken while stopped, before assigning and scoring images
+        dedup_distance: --dedup only: maximum distance between near-duplicate
+            frames, in meters
+        dedup_hash_distance: --dedup only: maximum number of differing bits
+            between the hashes of near-duplicate frames
+        prefetch: MAPILLARY only: retrieve the metadata of all images around the
+            points with one search per tile, instead of one search per point
+        tile_size: MAPILLARY only: size of the prefetch tiles, in degrees
+        concurrency: MAPILLARY only: maximum number of requests to Mapillary at the
+            same time
+        metadata_rate: MAPILLARY only: maximum number of searches per second,
+            unlimited if 0
+        image_rate: MAPILLARY only: maximum number of image downloads per second,
+            unlimited if 0
+        cache: MAPILLARY only: cache the responses of Mapillary searches in the
+            images directory, and reuse them in later runs
+        cache_ttl: MAPILLARY only: age after which cached responses are requested
+            again, in days
+        cache_size: MAPILLARY only: maximum size of the response cache, in
+            megabytes
+        offline: MAPILLARY only: only use cached responses and already downloaded
+            images, without calling Mapillary
+        score: Calculate the GVI score of each image as soon as it is assigned,
+            while other images are downloaded
+        score_workers: --score only: number of processes scoring images
+        scale: --score only: decode images at 1/scale of their width and height
+        keep_images: MAPILLARY only: write downloaded images to the images
+            directory
+        packed: MAPILLARY only: keep downloaded images in a packed store in the
+            images directory instead of one file per image
+        output_file: Where to write the points and their images,
+            <points_file stem>_images.gpkg next to the points file if not set
+        metrics_out: JSON file to write timers and counters of the run to
+        profile: File to write cProfile statistics of the run to
         verbose: Sets log level to DEBUG
 
     Returns: The Path of the output GPKG file
@@ -57,55 +420,52 @@ def main(
     else:
         log.add(sys.stdout, level="INFO")
 
-    if image_source == ImageSourceSelector.local:
-        source = LocalImages(images_path, max_distance)
-    elif image_source == ImageSourceSelector.mapillary:
-        source = Mapillary(getenv("MAPILLARY_CLIENT_TOKEN"), images_path, max_distance)
-    else:
-        raise ValueError(f"Unknown Image Source: {image_source}")
+    with metrics.recording("assign_images", metrics_out, profile):
+        with metrics.timer("read_file"):
+            gdf = gpd.read_file(points_file)
+        metrics.count("points", len(gdf))
+        gdf = assign_images_to_points(
+            gdf,
+            image_source,
+            images_path,
+            max_distance=max_distance,
+            rebuild_index=rebuild_index,
+            workers=workers,
+            dedup=dedup,
+            dedup_distance=dedup_distance,
+            dedup_hash_distance=dedup_hash_distance,
+            prefetch=prefetch,
+            tile_size=tile_size,
+            concurrency=concurrency,
+            metadata_rate=metadata_rate,
+            image_rate=image_rate,
+            cache=cache,
+            cache_ttl=cache_ttl,
+            cache_size=cache_size,
+            offline=offline,
+            score=score,
+            score_workers=score_workers,
+            scale=scale,
+            keep_images=keep_images,
+            packed=packed,
+        )
+
+        log.info(gdf.head())
+        log.info(
+            "Are There Duplicates? {}",
+            gdf[gdf["image_id"] is not None and gdf["image_id"].notna()]["image_id"]
+            .duplicated()
+            .any(),
+        )
+
+        if output_file is None:
+            output_file = Path(points_file.parent, f"{points_file.stem}_images.gpkg")
+        output_file = output_file.resolve()
+        with metrics.timer("to_file"):
+            gdf.to_file(output_file, driver="GPKG")
+        log.success("Saved Points and Images to {}", output_file)
 
-    gdf = gpd.read_file(points_file)
-    gdf["image_id"] = Series()
-    gdf["image_lat"] = Series()
-    gdf["image_lon"] = Series()
-    gdf["residual"] = Series()
-    gdf["image_path"] = Series()
-    gdf["error"] = Series()
-
-    for i, point in tqdm(
-        gdf.iterrows(),
-        total=len(gdf.index),
-        desc="Assigning Images to Points",
-        unit="points",
-    ):
-        latitude = point["geometry"].y
-        longitude = point["geometry"].x
-
-        try:
-            results = source.get_image_from_coordinates(latitude, longitude)
-            gdf.at[i, "image_lat"] = results["image_lat"]
-            gdf.at[i, "image_lon"] = results["image_lon"]
-            gdf.at[i, "residual"] = results["residual"]
-            gdf.at[i, "image_id"] = results["image_id"]
-            gdf.at[i, "image_path"] = str(results["image_path"])
-            gdf.at[i, "error"] = results["error"]
-        except HTTPError or RetryError as e:
-            log.error(e)
-            gdf.at[i, "error"] = e.__class__.__name__
-
-    log.info(gdf.head())
-    log.info(
-        "Are There Duplicates? {}",
-        gdf[gdf["image_id"] is not None and gdf["image_id"].notna()]["image_id"]
-        .duplicated()
-        .any(),
-    )
-
-    output_file = Path(points_file.parent, f"{points_file.stem}_images.gpkg").resolve()
-    gdf.to_file(output_file, driver="GPKG")
-    log.success("Saved Points and Images to {}", output_file)
-
-    return output_file
+        return output_file
 
 
 if __name__ == "__main__":
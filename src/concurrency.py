@@ -0,0 +1,31 @@
+from collections import deque
+from concurrent.futures import Executor
+from typing import Callable, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def bounded_map(
+    executor: Executor, fn: Callable[[T], R], items: Iterable[T], max_in_flight: int
+) -> Iterator[R]:
+    """
+    Like Executor.map, but only submits a new item once there are fewer than
+    max_in_flight items submitted and not yet yielded, so that the input is consumed
+    lazily and memory use stays bounded. Results are yielded in input order
+    Args:
+        executor: Executor to run fn on
+        fn: Function to apply to each item
+        items: Items to apply fn to
+        max_in_flight: Maximum number of items submitted but not yet yielded
+
+    Returns: Iterator over the results of fn, in the order of items
+
+    """
+    pending = deque()
+    for item in items:
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().result()
+        pending.append(executor.submit(fn, item))
+    while pending:
+        yield pending.popleft().result()
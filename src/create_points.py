@@ -3,7 +3,7 @@ See: https://github.com/mittrees/Treepedia_Public/blob/master/Treepedia/createPo
 """
 
 from pathlib import Path
-from typing import List
+from typing import Iterator, List, Optional, Tuple
 
 try:
     from typing import Annotated
@@ -14,11 +14,14 @@ except ImportError:
 import geopandas as gpd
 from loguru import logger
 import numpy as np
+import pyogrio
 import shapely
 import typer
 from typer_config import use_toml_config
 from typer_config.callbacks import argument_list_callback
 
+from src import metrics
+
 DEFAULT_MINI_DIST = 20.0  # meters
 DEFAULT_HIGHWAY_VALUES_TO_KEEP = [
     "primary",
@@ -33,6 +36,17 @@ DEFAULT_HIGHWAY_VALUES_TO_KEEP = [
 app = typer.Typer()
 
 
+def check_highway_types(highway_types: List[str]) -> None:
+    """Raises a ValueError if no highway type to keep is given, as no road would be
+    selected.
+
+    Args:
+        highway_types (List[str]): List of OSM highway types to keep.
+    """
+    if len(highway_types) == 0:
+        raise ValueError("At least one highway type to keep must be given.")
+
+
 def filter_by_highway_type(
     gdf: gpd.GeoDataFrame, highway_types: List[str] = DEFAULT_HIGHWAY_VALUES_TO_KEEP
 ):
@@ -53,10 +67,75 @@ def filter_by_highway_type(
             "'highway' column not found in input GeoDataFrame. "
             "Input data must be of OpenStreetMap roads."
         )
+    check_highway_types(highway_types)
     out_gdf = gdf[gdf["highway"].isin(highway_types)].copy()
     return out_gdf
 
 
+def highway_type_where_clause(highway_types: List[str]) -> str:
+    """Returns an OGR SQL WHERE clause that keeps features whose 'highway' value is one
+    of the provided highway types, so that features can be filtered while reading.
+
+    Args:
+        highway_types (List[str]): List of OSM highway types to keep.
+
+    Returns:
+        str: WHERE clause usable as the `where` argument of geopandas.read_file
+    """
+    check_highway_types(highway_types)
+    values = ", ".join(
+        "'{}'".format(value.replace("'", "''")) for value in highway_types
+    )
+    return f'"highway" IN ({values})'
+
+
+def read_roads_in_batches(
+    in_file: Path,
+    batch_size: int,
+    highway_types: List[str] = DEFAULT_HIGHWAY_VALUES_TO_KEEP,
+) -> Iterator[gpd.GeoDataFrame]:
+    """Reads OpenStreetMap road features of the given highway types in batches of at
+    most `batch_size` features. Filtering by highway type happens during the read, and
+    only the 'osm_id', 'highway' and geometry columns are loaded.
+
+    The feature IDs of matching features are read first (without geometries or other
+    attributes), then each batch is read by feature ID, so the cost of reading a batch
+    does not depend on its position in the file.
+
+    Args:
+        in_file (Path): OpenStreetMap roads data file readable by geopandas.
+        batch_size (int): Maximum number of features per batch.
+        highway_types (List[str]): List of OSM highway types to keep.
+
+    Yields:
+        geopandas.GeoDataFrame: batch of road features
+    """
+    if "highway" not in pyogrio.read_info(in_file)["fields"]:
+        raise ValueError(
+            "'highway' column not found in input data. "
+            "Input data must be of OpenStreetMap roads."
+        )
+    where = highway_type_where_clause(highway_types)
+    with metrics.timer("read_file"):
+        fids = pyogrio.read_dataframe(
+            in_file,
+            columns=["highway"],
+            where=where,
+            read_geometry=False,
+            fid_as_index=True,
+        ).index.to_numpy()
+    logger.debug("{} road features to read in batches of {}", len(fids), batch_size)
+    for start in range(0, len(fids), batch_size):
+        with metrics.timer("read_file"):
+            batch = gpd.read_file(
+                in_file,
+                fids=fids[start : start + batch_size],
+                columns=["osm_id", "highway"],
+            )
+        yield batch
+
+
+@metrics.timed("interpolate")
 def interpolate_along_line(
     line: shapely.LineString, mini_dist: float
 ) -> shapely.MultiPoint:
@@ -79,6 +158,37 @@ def interpolate_along_line(
     return shapely.MultiPoint(new_coords)
 
 
+@metrics.timed("interpolate")
+def interpolate_along_lines(
+    lines: np.ndarray, mini_dist: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Vectorized version of `interpolate_along_line` for an array of LineStrings.
+    The sample distances for every line are computed as one flat array and all points
+    are interpolated with a single shapely call, so no intermediate MultiPoint features
+    are built. The points are identical to those of `interpolate_along_line`.
+
+    Args:
+        lines (numpy.ndarray): array of shapely LineStrings
+        mini_dist (float): distance in meters between interpolated points
+
+    Returns:
+        Tuple[numpy.ndarray, numpy.ndarray]: index into `lines` of the line that each
+            point was sampled from, and the array of interpolated shapely Points
+    """
+    lengths = shapely.length(lines)
+    counts = (lengths / mini_dist).astype(np.int64)
+    line_index = np.repeat(np.arange(len(lines)), counts)
+    # Position of each point along its own line: 0, 1, ..., count - 1
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    steps = np.arange(counts.sum()) - starts
+    # Same spacing as np.linspace(0.0, length, num=count, endpoint=False)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        spacing = lengths / counts
+    distances = steps * spacing[line_index]
+    points = shapely.line_interpolate_point(lines[line_index], distances)
+    return line_index, points
+
+
 def create_points(gdf: gpd.GeoDataFrame, mini_dist: float = DEFAULT_MINI_DIST):
     """Given a GeoDataFrame of OpenStreetMap data with LineString features, returns an
     exploded GeodataFrame of Point features interpolated along the lines with distance
@@ -103,15 +213,103 @@ def create_points(gdf: gpd.GeoDataFrame, mini_dist: float = DEFAULT_MINI_DIST):
     # Drop metadata other than 'osm_id'
     gdf = gdf[["osm_id", "highway", "geometry"]]
     # EPSG:3857 is pseudo WGS84 with unit in meters
-    gdf = gdf.to_crs("EPSG:3857")
-    # Interpolate along lines and explode
-    gdf["geometry"] = gdf["geometry"].apply(interpolate_along_line, args=(mini_dist,))
-    gdf = gdf.explode(ignore_index=True, index_parts=False)
+    with metrics.timer("reproject"):
+        gdf = gdf.to_crs("EPSG:3857")
+    # Interpolate along lines, repeating each line's attributes for its points
+    line_index, points = interpolate_along_lines(gdf.geometry.to_numpy(), mini_dist)
+    gdf = gpd.GeoDataFrame(
+        gdf.drop(columns="geometry").iloc[line_index].reset_index(drop=True),
+        geometry=points,
+        crs=gdf.crs,
+    )
     # Convert output to WGS84
-    gdf.to_crs("EPSG:4326", inplace=True)
+    with metrics.timer("reproject"):
+        gdf.to_crs("EPSG:4326", inplace=True)
+    metrics.count("points", len(gdf))
+    return gdf
+
+
+def select_roads(
+    gdf: gpd.GeoDataFrame,
+    drop_null: bool = False,
+    highway_types: List[str] = DEFAULT_HIGHWAY_VALUES_TO_KEEP,
+) -> gpd.GeoDataFrame:
+    """Returns the OpenStreetMap road features that points are sampled along: those
+    of the given highway types, without null geometries if `drop_null` is set.
+
+    Args:
+        gdf (geopandas.GeoDataFrame): OpenStreetMap road features.
+        drop_null (bool): whether features with null geometries should be removed
+        highway_types (List[str]): List of OSM highway types to keep.
+
+    Returns:
+        geopandas.GeoDataFrame: Copy of the selected road features.
+    """
+    gdf = filter_by_highway_type(gdf, highway_types=highway_types)
+    if drop_null:
+        gdf = gdf[~gdf.geometry.isna()]
     return gdf
 
 
+def points_from_roads(
+    gdf: gpd.GeoDataFrame,
+    mini_dist: float = DEFAULT_MINI_DIST,
+    drop_null: bool = False,
+    highway_types: List[str] = DEFAULT_HIGHWAY_VALUES_TO_KEEP,
+) -> gpd.GeoDataFrame:
+    """In-memory version of `main`: filters OpenStreetMap road features by highway
+    type, and returns the points interpolated along them.
+
+    Args:
+        gdf (geopandas.GeoDataFrame): OpenStreetMap road features.
+        mini_dist (float): distance in meters between interpolated points
+        drop_null (bool): whether features with null geometries should be removed
+        highway_types (List[str]): List of OSM highway types to keep.
+
+    Returns:
+        geopandas.GeoDataFrame: interpolated points
+    """
+    gdf = select_roads(gdf, drop_null=drop_null, highway_types=highway_types)
+    return create_points(gdf, mini_dist=mini_dist)
+
+
+def create_points_in_batches(
+    in_file: Path,
+    out_file: Path,
+    batch_size: int,
+    mini_dist: float = DEFAULT_MINI_DIST,
+    drop_null: bool = False,
+    highway_types: List[str] = DEFAULT_HIGHWAY_VALUES_TO_KEEP,
+) -> int:
+    """Streaming version of reading roads, `create_points` and writing the output.
+    Road features are read, sampled and appended to `out_file` one batch at a time, so
+    that memory use depends on `batch_size` rather than on the size of the input.
+
+    Args:
+        in_file (Path): OpenStreetMap roads data file readable by geopandas.
+        out_file (Path): File to write interpolated points to.
+        batch_size (int): Maximum number of road features to process at a time.
+        mini_dist (float): distance in meters between interpolated points
+        drop_null (bool): whether features with null geometries should be removed
+        highway_types (List[str]): List of OSM highway types to keep.
+
+    Returns:
+        int: number of points written
+    """
+    n_points = 0
+    for batch in read_roads_in_batches(in_file, batch_size, highway_types):
+        if drop_null:
+            batch = batch[~batch.geometry.isna()]
+        points = create_points(batch, mini_dist=mini_dist)
+        if len(points) == 0:
+            continue
+        with metrics.timer("to_file"):
+            points.to_file(out_file, mode="a" if n_points else "w")
+        n_points += len(points)
+        logger.debug("{} points written", n_points)
+    return n_points
+
+
 @app.command()
 @use_toml_config(section=["create_points"])
 def main(
@@ -151,23 +349,61 @@ def main(
             callback=argument_list_callback,
         ),
     ] = DEFAULT_HIGHWAY_VALUES_TO_KEEP,
+    batch_size: Annotated[
+        Optional[int],
+        typer.Option(
+            min=1,
+            help=(
+                "Read, sample and write road features in batches of this many "
+                "features to bound memory use. If not set, the whole input file is "
+                "loaded at once."
+            ),
+        ),
+    ] = None,
+    metrics_out: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="Write the time spent reading, reprojecting, interpolating and "
+            "writing, and counters, to this JSON file."
+        ),
+    ] = None,
+    profile: Annotated[
+        Optional[Path],
+        typer.Option(help="Write cProfile statistics of the run to this file."),
+    ] = None,
 ):
     """Create a dataset of interpolated points along OpenStreetMap roads."""
-    logger.debug("mini_dist: {}", mini_dist)
-    logger.debug("drop_null: {}", drop_null)
-    logger.debug("highway_types: {}", highway_types)
+    with metrics.recording("create_points", metrics_out, profile):
+        logger.debug("mini_dist: {}", mini_dist)
+        logger.debug("drop_null: {}", drop_null)
+        logger.debug("highway_types: {}", highway_types)
+        logger.debug("batch_size: {}", batch_size)
 
-    logger.info("Loading road features from: {}", in_file)
+        logger.info("Loading road features from: {}", in_file)
 
-    gdf = gpd.read_file(in_file)
-    gdf = filter_by_highway_type(gdf, highway_types=highway_types)
-    if drop_null:
-        gdf = gdf[~gdf.geometry.isna()]
-    else:
-        pass
-    gdf = create_points(gdf, mini_dist=mini_dist)
-    gdf.to_file(out_file)
-    logger.success("Interpolated points written to: {}", out_file)
+        if batch_size is not None:
+            n_points = create_points_in_batches(
+                in_file,
+                out_file,
+                batch_size,
+                mini_dist=mini_dist,
+                drop_null=drop_null,
+                highway_types=highway_types,
+            )
+            if n_points == 0:
+                logger.warning("No points were created from: {}", in_file)
+                return
+            logger.success("{} interpolated points written to: {}", n_points, out_file)
+            return
+
+        with metrics.timer("read_file"):
+            gdf = gpd.read_file(in_file)
+        gdf = points_from_roads(
+            gdf, mini_dist=mini_dist, drop_null=drop_null, highway_types=highway_types
+        )
+        with metrics.timer("to_file"):
+            gdf.to_file(out_file)
+        logger.success("Interpolated points written to: {}", out_file)
 
 
 if __name__ == "__main__":
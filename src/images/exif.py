@@ -0,0 +1,295 @@
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+from pathlib import Path
+import struct
+from typing import BinaryIO, Callable, Dict, List, Tuple
+
+from loguru import logger as log
+from PIL.ExifTags import GPS, IFD
+from PIL.Image import Exif
+
+from src import metrics
+from src.sidecar import open_sidecar
+
+DEFAULT_WORKERS = 8
+JPEG_SOI = b"\xff\xd8"
+JPEG_EOI = b"\xff\xd9"
+JPEG_APP1 = 0xE1
+EXIF_IDENTIFIER = b"Exif\x00\x00"
+# Bytes read at the end of a JPEG file to find its end of image marker
+JPEG_TAIL_SIZE = 64
+
+
+def dms_to_decimal(dms: tuple, direction: str) -> float:
+    """
+    Converts EXIF GPS degrees, minutes and seconds to decimal degrees
+    Args:
+        dms: Degrees, minutes and seconds
+        direction: Reference direction, one of N, S, E or W
+
+    Returns: Decimal degrees, negative for S and W
+
+    """
+    degrees = float(dms[0]) + (float(dms[1]) / 60 + float(dms[2]) / 3600)
+    return -degrees if direction in ("S", "W") else degrees
+
+
+def is_complete_jpeg(head: bytes, tail: bytes) -> bool:
+    """
+    Checks that JPEG content starts with the start of image marker and ends with
+    the end of image marker, which a truncated download or write does not
+    Args:
+        head: The first bytes of the content
+        tail: The last bytes of the content
+
+    Returns: Whether the content is a complete JPEG image
+
+    """
+    # Some encoders pad the content after the end of image marker
+    return head.startswith(JPEG_SOI) and tail.rstrip(b"\x00\r\n ").endswith(JPEG_EOI)
+
+
+def is_complete_jpeg_file(image_path: Path) -> bool:
+    """
+    Checks that a file exists and is a complete JPEG image, reading only its first
+    and last bytes
+    Args:
+        image_path: Path of the file
+
+    Returns: Whether the file is a complete JPEG image
+
+    """
+    try:
+        with open(image_path, "rb") as image:
+            head = image.read(len(JPEG_SOI))
+            image.seek(max(image.seek(0, os.SEEK_END) - JPEG_TAIL_SIZE, 0))
+            return is_complete_jpeg(head, image.read())
+    except OSError:
+        return False
+
+
+def read_exif_segment(image_path: Path) -> bytes:
+    """
+    Reads the raw EXIF segment of a JPEG file, without reading the image data that
+    comes after the header segments
+    Args:
+        image_path: Path of the JPEG image
+
+    Returns: The EXIF segment, starting with the "Exif" identifier
+
+    """
+    with open(image_path, "rb") as image:
+        return _exif_segment(image)
+
+
+def _exif_segment(image: BinaryIO) -> bytes:
+    if image.read(2) != JPEG_SOI:
+        raise ValueError("Not a JPEG file")
+    while True:
+        marker = image.read(2)
+        # Image data starts at SOS, the EXIF segment can only be before it
+        if len(marker) < 2 or marker[0] != 0xFF or marker[1] in (0xD9, 0xDA):
+            raise ValueError("No EXIF data")
+        (length,) = struct.unpack(">H", image.read(2))
+        if marker[1] == JPEG_APP1:
+            segment = image.read(length - 2)
+            if segment.startswith(EXIF_IDENTIFIER):
+                return segment
+        else:
+            image.seek(length - 2, os.SEEK_CUR)
+
+
+@metrics.timed("exif")
+def read_gps_coordinates(image_path: Path) -> Tuple[float, float]:
+    """
+    Reads the GPS location of an image from its EXIF data
+    Args:
+        image_path: Path of the image
+
+    Returns: Latitude and longitude of the image, in decimal degrees
+
+    """
+    return _gps_coordinates(read_exif_segment(image_path))
+
+
+@metrics.timed("exif")
+def gps_coordinates_from_content(image_content: bytes) -> Tuple[float, float]:
+    """
+    Reads the GPS location of an image from the EXIF data of its content, as
+    read_gps_coordinates does for a file
+    Args:
+        image_content: Content of the JPEG image
+
+    Returns: Latitude and longitude of the image, in decimal degrees
+
+    """
+    return _gps_coordinates(_exif_segment(io.BytesIO(image_content)))
+
+
+def _gps_coordinates(exif_segment: bytes) -> Tuple[float, float]:
+    exif = Exif()
+    exif.load(exif_segment)
+    gps_data = exif.get_ifd(IFD.GPSInfo)
+    try:
+        latitude = dms_to_decimal(
+            gps_data[GPS.GPSLatitude], gps_data[GPS.GPSLatitudeRef]
+        )
+        longitude = dms_to_decimal(
+            gps_data[GPS.GPSLongitude], gps_data[GPS.GPSLongitudeRef]
+        )
+    except KeyError as e:
+        raise ValueError(f"No GPS {GPS(e.args[0]).name} in EXIF data") from None
+    return latitude, longitude
+
+
+def scan_gps_coordinates(
+    image_paths: List[Path],
+    workers: int = DEFAULT_WORKERS,
+    read_coordinates: Callable[[Path], Tuple[float, float]] = read_gps_coordinates,
+) -> Tuple[Dict[Path, Tuple[float, float]], Dict[Path, str]]:
+    """
+    Reads the GPS locations of images on a pool of threads
+    Args:
+        image_paths: Paths of the images
+        workers: Number of threads reading images at the same time
+        read_coordinates: Reads the latitude and longitude of an image
+
+    Returns: The locations of the images that could be read, and an error message
+        for each image that could not, both in the order of image_paths
+
+    """
+
+    def read(image_path: Path):
+        try:
+            return read_coordinates(image_path), None
+        except Exception as e:
+            return None, f"{e.__class__.__name__}: {e}"
+
+    locations = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for image_path, (location, error) in zip(
+            image_paths, executor.map(read, image_paths)
+        ):
+            if error is None:
+                locations[image_path] = location
+            else:
+                errors[image_path] = error
+    return locations, errors
+
+
+class GpsIndex:
+    """
+    Sidecar SQLite index of image GPS locations, stored in the images directory.
+    Entries are keyed by the image path relative to the directory and are reused
+    for as long as the size and modification time of the file are unchanged.
+    Images whose location could not be read are kept with their error message, so
+    they are not read again either
+    """
+
+    filename = ".gps_index.sqlite"
+    schema_version = 2
+
+    def __init__(self, images_path: Path, rebuild: bool = False) -> None:
+        """
+        All Args Constructor
+        Args:
+            images_path: Directory containing the images and the index
+            rebuild: Discard any existing index and parse every image again
+        """
+        self.images_path = images_path
+        self.path = Path(images_path, self.filename)
+        if rebuild:
+            self.path.unlink(missing_ok=True)
+
+        self.connection = open_sidecar(
+            self.path,
+            [
+                """
+                CREATE TABLE IF NOT EXISTS images (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    latitude REAL,
+                    longitude REAL,
+                    error TEXT
+                )
+                """
+            ],
+            self.schema_version,
+        )
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def update(
+        self,
+        image_paths: List[Path],
+        workers: int = DEFAULT_WORKERS,
+        read_coordinates: Callable[[Path], Tuple[float, float]] = read_gps_coordinates,
+    ) -> Tuple[Dict[Path, Tuple[float, float]], Dict[Path, str]]:
+        """
+        Brings the index up to date with the images in the directory, reading the
+        coordinates only of images that are new or changed since the last update
+        and dropping entries for images that no longer exist
+        Args:
+            image_paths: Paths of all the images in the directory
+            workers: Number of threads reading images at the same time
+            read_coordinates: Reads the latitude and longitude of an image
+
+        Returns: The locations of the images that have one, and an error message
+            for each image that does not, both in the order of image_paths
+
+        """
+        indexed: Dict[str, tuple] = {
+            row[0]: row[1:]
+            for row in self.connection.execute(
+                "SELECT path, size, mtime_ns, latitude, longitude, error FROM images"
+            )
+        }
+
+        entries = {}
+        stale = {}
+        for image_path in image_paths:
+            key = image_path.relative_to(self.images_path).as_posix()
+            stat = image_path.stat()
+            entry = indexed.pop(key, None)
+            if entry is not None and entry[:2] == (stat.st_size, stat.st_mtime_ns):
+                entries[image_path] = entry[2:]
+            else:
+                entries[image_path] = None
+                stale[image_path] = (key, stat.st_size, stat.st_mtime_ns)
+
+        scanned, scan_errors = scan_gps_coordinates(
+            list(stale), workers=workers, read_coordinates=read_coordinates
+        )
+        updates = []
+        for image_path, (key, size, mtime_ns) in stale.items():
+            latitude, longitude = scanned.get(image_path, (None, None))
+            error = scan_errors.get(image_path)
+            entries[image_path] = (latitude, longitude, error)
+            updates.append((key, size, mtime_ns, latitude, longitude, error))
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?)", updates
+            )
+            self.connection.executemany(
+                "DELETE FROM images WHERE path = ?", [(key,) for key in indexed]
+            )
+        log.debug(
+            "GPS Index: {} Images Read, {} Reused, {} Removed",
+            len(updates),
+            len(image_paths) - len(updates),
+            len(indexed),
+        )
+
+        locations = {}
+        errors = {}
+        for image_path, (latitude, longitude, error) in entries.items():
+            if error is None:
+                locations[image_path] = (latitude, longitude)
+            else:
+                errors[image_path] = error
+        return locations, errors
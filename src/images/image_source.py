@@ -1,6 +1,39 @@
 from abc import ABC, abstractmethod
 from enum import Enum
 from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+# Keys of the result dict of a point, and columns of the results of several points
+RESULT_COLUMNS = (
+    "image_id",
+    "image_lat",
+    "image_lon",
+    "residual",
+    "image_path",
+    "error",
+)
+
+
+def results_to_columns(
+    results: Iterable[dict], columns: Sequence[str] = RESULT_COLUMNS
+) -> Dict[str, List]:
+    """
+    Gathers the result dicts of several points into columns
+    Args:
+        results: Result dict of each point
+        columns: Keys of the result dicts to gather
+
+    Returns: The list of the values of each key, in the order of results
+
+    """
+    gathered = {column: [] for column in columns}
+    for result in results:
+        for column, values in gathered.items():
+            values.append(result[column])
+    return gathered
 
 
 class ImageSource(ABC):
@@ -33,6 +66,53 @@ class ImageSource(ABC):
         """
         raise NotImplementedError
 
+    @abstractmethod
+    def exclude_images(self, image_ids: Iterable[str]) -> None:
+        """
+        Marks images as already assigned, such as the images of the points of a
+        previous run that are kept, so they are not assigned to other points
+        Args:
+            image_ids: IDs of the images
+        """
+        raise NotImplementedError
+
+    def get_images_from_coordinates(
+        self, coordinates: Iterable[Tuple[float, float]]
+    ) -> Iterator[dict]:
+        """
+        Gets an image for each set of coordinates, in order. Image sources that can
+        look up several points at the same time override this
+        Args:
+            coordinates: (Latitude, Longitude) of each point to get an image for
+
+        Returns: Iterator over the result dict of each point, in the order of
+            coordinates, as returned by get_image_from_coordinates
+
+        """
+        for latitude, longitude in coordinates:
+            yield self.get_image_from_coordinates(latitude, longitude)
+
+    def get_images_for_points(self, points: np.ndarray) -> Dict[str, List]:
+        """
+        Gets an image for each point, in order, as get_images_from_coordinates
+        does, but returns the results as columns. Image sources that can look up
+        all points at once with arrays override this
+        Args:
+            points: (Latitude, Longitude) of each point, as an array of shape (n, 2)
+
+        Returns: The list of each result of the points, keyed as in the result
+            dict of get_image_from_coordinates, in the order of points
+
+        """
+        return results_to_columns(
+            tqdm(
+                self.get_images_from_coordinates(map(tuple, points)),
+                total=len(points),
+                desc="Assigning Images to Points",
+                unit="points",
+            )
+        )
+
 
 class ImageSourceSelector(str, Enum):
     local = "LOCAL"
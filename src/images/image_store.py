@@ -0,0 +1,266 @@
+import mmap
+import os
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from loguru import logger as log
+
+from src.images.exif import gps_coordinates_from_content
+from src.sidecar import open_sidecar
+
+# Size after which a writer starts a new pack file, in bytes
+DEFAULT_PACK_SIZE = 1 << 30
+
+
+class PackedImageStore:
+    """
+    Store of images packed into a few large files instead of one file per image,
+    stored in the images directory. Images are appended to pack files, and an
+    SQLite index records the pack, offset and size of each image, with its GPS
+    location read from its EXIF data. Images are read back by ID through memory
+    maps of the packs, without copying them.
+
+    Each writer, in this or another process, appends to pack files of its own,
+    claimed when it writes its first image, so several processes can add images to
+    the same store at the same time. Packs are never rewritten: the space of an
+    image replaced by a new one with the same ID is not reclaimed
+    """
+
+    filename = ".image_store.sqlite"
+    schema_version = 1
+    pack_pattern = "images_{:06d}.pack"
+
+    def __init__(self, path: Path, pack_size: int = DEFAULT_PACK_SIZE) -> None:
+        """
+        All Args Constructor
+        Args:
+            path: Directory containing the pack files and their index
+            pack_size: Size after which a writer starts a new pack file, in bytes
+        """
+        self.path = path
+        self.pack_size = pack_size
+        self._lock = Lock()
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._writer = None
+        self._writer_pack = None
+
+        self.path.mkdir(parents=True, exist_ok=True)
+        # Images are written from a pool of threads, the lock serializes access
+        self.connection = open_sidecar(
+            Path(self.path, self.filename),
+            [
+                """
+                CREATE TABLE IF NOT EXISTS images (
+                    image_id TEXT PRIMARY KEY,
+                    pack INTEGER NOT NULL,
+                    offset INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    latitude REAL,
+                    longitude REAL,
+                    error TEXT
+                )
+                """
+            ],
+            self.schema_version,
+            check_same_thread=False,
+        )
+
+    @classmethod
+    def exists(cls, path: Path) -> bool:
+        """
+        Args:
+            path: Directory that may contain a store
+
+        Returns: Whether the directory contains a store
+
+        """
+        return Path(path, cls.filename).is_file()
+
+    def __getstate__(self) -> dict:
+        # Worker processes open their own connection and memory maps
+        return {"path": self.path, "pack_size": self.pack_size}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["path"], state["pack_size"])
+
+    def __contains__(self, image_id: str) -> bool:
+        with self._lock:
+            return (
+                self.connection.execute(
+                    "SELECT 1 FROM images WHERE image_id = ?", (image_id,)
+                ).fetchone()
+                is not None
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.connection.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            # Memory maps are released once the views returned by get are
+            self._maps = {}
+            self.connection.close()
+
+    def image_ids(self) -> Set[str]:
+        """
+        Returns: The IDs of all images in the store
+        """
+        with self._lock:
+            return {
+                row[0] for row in self.connection.execute("SELECT image_id FROM images")
+            }
+
+    def locations(self) -> Tuple[Dict[str, Tuple[float, float]], Dict[str, str]]:
+        """
+        Returns: The GPS location of the images that have one, and an error message
+            for each image that does not, both sorted by image ID
+        """
+        locations = {}
+        errors = {}
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT image_id, latitude, longitude, error FROM images "
+                "ORDER BY image_id"
+            ).fetchall()
+        for image_id, latitude, longitude, error in rows:
+            if error is None:
+                locations[image_id] = (latitude, longitude)
+            else:
+                errors[image_id] = error
+        return locations, errors
+
+    def get(self, image_id: str) -> memoryview:
+        """
+        Gets the content of an image, without copying it
+        Args:
+            image_id: ID of the image
+
+        Returns: A view of the content of the image in the memory map of its pack
+
+        """
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT pack, offset, size FROM images WHERE image_id = ?", (image_id,)
+            ).fetchone()
+            if row is None:
+                raise KeyError(image_id)
+            pack, offset, size = row
+            packed = self._maps.get(pack)
+            # Packs grow while they are written to, map them again if needed
+            if packed is None or len(packed) < offset + size:
+                with open(Path(self.path, self.pack_pattern.format(pack)), "rb") as f:
+                    packed = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[pack] = packed
+        return memoryview(packed)[offset : offset + size]
+
+    def put(self, image_id: str, image_content: bytes) -> None:
+        """
+        Adds an image to the store, replacing any image with the same ID
+        Args:
+            image_id: ID of the image
+            image_content: Content of the image file
+        """
+        self.put_many([(image_id, image_content)])
+
+    def put_many(self, images: Iterable[Tuple[str, bytes]]) -> None:
+        """
+        Adds a batch of images to the store, in one transaction of the index. The
+        images are durably written to their pack before they are indexed, so the
+        index never refers to content lost in a crash
+        Args:
+            images: (ID, Content) of each image
+        """
+        entries = []
+        with self._lock:
+            for image_id, image_content in images:
+                writer = self._pack_writer(len(image_content))
+                offset = writer.tell()
+                writer.write(image_content)
+                try:
+                    latitude, longitude = gps_coordinates_from_content(image_content)
+                    error = None
+                except Exception as e:
+                    latitude, longitude = None, None
+                    error = f"{e.__class__.__name__}: {e}"
+                entries.append(
+                    (
+                        image_id,
+                        self._writer_pack,
+                        offset,
+                        len(image_content),
+                        latitude,
+                        longitude,
+                        error,
+                    )
+                )
+            if len(entries) == 0:
+                return
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    entries,
+                )
+
+    def _pack_writer(self, size: int):
+        """
+        Returns the pack file to append an image to, claiming a new pack if this
+        writer has none yet or the image would make its pack larger than pack_size
+        Args:
+            size: Size of the image, in bytes
+        """
+        if self._writer is not None and (
+            self._writer.tell() == 0 or self._writer.tell() + size <= self.pack_size
+        ):
+            return self._writer
+        if self._writer is not None:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+            self._writer.close()
+        pack = self._next_pack()
+        self._writer = open(Path(self.path, self.pack_pattern.format(pack)), "ab")
+        self._writer_pack = pack
+        log.debug("Writing Images To Pack {}", pack)
+        return self._writer
+
+    def _next_pack(self) -> int:
+        # Only one writer can create a pack file, which makes it its own
+        pack = len(self.packs())
+        while True:
+            try:
+                os.close(
+                    os.open(
+                        Path(self.path, self.pack_pattern.format(pack)),
+                        os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+                    )
+                )
+                return pack
+            except FileExistsError:
+                pack += 1
+
+    def packs(self) -> List[Path]:
+        """
+        Returns: The pack files of the store
+        """
+        return sorted(self.path.glob(self.pack_pattern.replace("{:06d}", "*")))
+
+
+def open_store(path: Path, create: bool = False) -> Optional[PackedImageStore]:
+    """
+    Opens the store of an images directory
+    Args:
+        path: The images directory
+        create: Create a store if the directory does not have one
+
+    Returns: The store, or None if the directory has none and create is not set
+
+    """
+    if create or PackedImageStore.exists(path):
+        return PackedImageStore(path)
+    return None
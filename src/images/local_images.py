@@ -1,15 +1,21 @@
 from pathlib import Path
+from typing import Dict, Iterable, List
 
-from geopy import Point
-from geopy.distance import ELLIPSOIDS, distance
 from loguru import logger as log
-from PIL.ExifTags import GPS
-from PIL.Image import open as open_image
+import numpy as np
 from typing_extensions import override
 
+from src import metrics
+from src.images.exif import DEFAULT_WORKERS, GpsIndex
 from src.images.image_source import ImageSource
-
-EXIF_GPS_TAG = 34853
+from src.images.image_store import open_store
+from src.images.near_duplicates import (
+    DEFAULT_MAX_DISPLACEMENT,
+    DEFAULT_MAX_HASH_DISTANCE,
+    frame_hash,
+    near_duplicate_frames,
+)
+from src.images.spatial_index import SpatialImageIndex
 
 
 class LocalImages(ImageSource):
@@ -17,50 +23,136 @@ class LocalImages(ImageSource):
     Local Image Source
     """
 
-    def __init__(self, images_path: Path, max_distance: float) -> None:
+    def __init__(
+        self,
+        images_path: Path,
+        max_distance: float,
+        rebuild_index: bool = False,
+        workers: int = DEFAULT_WORKERS,
+        dedup: bool = False,
+        dedup_distance: float = DEFAULT_MAX_DISPLACEMENT,
+        dedup_hash_distance: int = DEFAULT_MAX_HASH_DISTANCE,
+    ) -> None:
         """
         All Args Constructor
         Args:
-            images_path: Where the images should be located
+            images_path: Where the images should be located, as JPEG files or in
+                a packed store
             max_distance: Maximum distance between point and image location, in meters
+            rebuild_index: Read the GPS location of every image again instead of
+                reusing the sidecar GPS index of the directory
+            workers: Number of threads reading image GPS locations at the same time
+            dedup: Skip the near-duplicate frames of captures, such as those taken
+                while stopped, so that only the first frame of each run of them can
+                be assigned and scored
+            dedup_distance: Maximum distance between near-duplicate frames, in
+                meters
+            dedup_hash_distance: Maximum number of differing bits between the
+                hashes of near-duplicate frames
 
         """
         super().__init__(images_path, max_distance)
-        dir_images = (
-            set()
-            .union(images_path.glob("**/*.jpg"))
-            .union(images_path.glob("**/*.jpeg"))
-        )
-        if len(dir_images) == 0:
-            raise FileNotFoundError(f"No Images Found In Path: {images_path}")
-
-        self.images = dict()
-        for image_path in dir_images:
-            with open_image(image_path) as image:
-                exif_data = image._getexif()
-                gps_data = exif_data.get(EXIF_GPS_TAG)
-
-                latitude_dms = gps_data[GPS.GPSLatitude]
-                latitude_dir = gps_data[GPS.GPSLatitudeRef]
-                longitude_dms = gps_data[GPS.GPSLongitude]
-                longitude_dir = gps_data[GPS.GPSLongitudeRef]
-
-                location = "{} {}m {}s {} {} {}m {}s {}".format(
-                    latitude_dms[0],
-                    latitude_dms[1],
-                    latitude_dms[2],
-                    latitude_dir,
-                    longitude_dms[0],
-                    longitude_dms[1],
-                    longitude_dms[2],
-                    longitude_dir,
+        # ID of the first frame of its run of each skipped near-duplicate frame
+        self.duplicates = {}
+        store = open_store(images_path)
+        if store is not None:
+            # Packed images are read by ID, their locations are in the store index
+            try:
+                locations, self.errors = store.locations()
+                if len(locations) + len(self.errors) == 0:
+                    raise FileNotFoundError(f"No Images Found In Store: {images_path}")
+                if dedup:
+                    self.duplicates = self._near_duplicates(
+                        locations,
+                        dedup_distance,
+                        dedup_hash_distance,
+                        lambda image_id: frame_hash(store.get(image_id)),
+                        workers,
+                    )
+            finally:
+                store.close()
+            self.image_ids = list(locations)
+            self.image_paths = [None] * len(locations)
+        else:
+            dir_images = sorted(
+                set()
+                .union(images_path.glob("**/*.jpg"))
+                .union(images_path.glob("**/*.jpeg"))
+            )
+            if len(dir_images) == 0:
+                raise FileNotFoundError(f"No Images Found In Path: {images_path}")
+
+            gps_index = GpsIndex(images_path, rebuild=rebuild_index)
+            try:
+                locations, self.errors = gps_index.update(dir_images, workers=workers)
+            finally:
+                gps_index.close()
+            if dedup:
+                duplicates = self._near_duplicates(
+                    locations, dedup_distance, dedup_hash_distance, frame_hash, workers
                 )
+                self.duplicates = {
+                    frame.stem: first.stem for frame, first in duplicates.items()
+                }
+            self.image_ids = [image_path.stem for image_path in locations]
+            self.image_paths = list(locations)
+        if len(self.errors) > 0:
+            log.warning("Could Not Read GPS Location Of {} Images", len(self.errors))
+            for image, error in self.errors.items():
+                log.debug("{}: {}", image, error)
+        if len(locations) == 0:
+            raise FileNotFoundError(f"No Geotagged Images Found In Path: {images_path}")
+
+        latitudes, longitudes = zip(*locations.values())
+        self.index = SpatialImageIndex(latitudes, longitudes)
+
+        log.debug("Images in Directory: {}", len(self.index))
+
+    @staticmethod
+    def _near_duplicates(
+        locations: dict,
+        max_displacement: float,
+        max_hash_distance: int,
+        read_hash,
+        workers: int,
+    ) -> dict:
+        """
+        Removes the near-duplicate frames from the image locations, in place
+        Args:
+            locations: Location of each image, in capture order
+            max_displacement: Maximum distance between near-duplicate frames,
+                in meters
+            max_hash_distance: Maximum number of differing bits between the hashes
+                of near-duplicate frames
+            read_hash: Computes the hash of an image
+            workers: Number of threads decoding images at the same time
 
-                self.images[image_path] = location
-
-        self.assigned_images = set()
+        Returns: The first frame of its run of each removed frame
 
-        log.debug("Images in Directory: {}", self.images)
+        """
+        if len(locations) == 0:
+            return {}
+        latitudes, longitudes = zip(*locations.values())
+        with metrics.timer("near_duplicates"):
+            duplicates = near_duplicate_frames(
+                list(locations),
+                latitudes,
+                longitudes,
+                max_displacement=max_displacement,
+                max_hash_distance=max_hash_distance,
+                read_hash=read_hash,
+                workers=workers,
+            )
+        for frame in duplicates:
+            del locations[frame]
+        log.info(
+            "Skipped {} Near-Duplicate Frames Of {} ({:.1%})",
+            len(duplicates),
+            len(duplicates) + len(locations),
+            len(duplicates) / (len(duplicates) + len(locations)),
+        )
+        metrics.count("near_duplicates", len(duplicates))
+        return duplicates
 
     @override
     def get_image_from_coordinates(self, latitude: float, longitude: float) -> dict:
@@ -84,35 +176,72 @@ class LocalImages(ImageSource):
             "error": None,
         }
 
-        filtered_images = filter(
-            lambda img: img not in self.assigned_images, self.images.keys()
+        closest, closest_distance = self.index.nearest(
+            latitude, longitude, self.max_distance
         )
-
-        closest = None
-        closest_distance = self.max_distance
-        for i, image in enumerate(filtered_images):
-            image_coordinates = Point(self.images[image])
-            coordinates = Point(latitude, longitude)
-            residual = distance(
-                coordinates, image_coordinates, ellipsoid=ELLIPSOIDS["WGS-84"]
-            ).m
-
-            if residual < closest_distance:
-                closest = image
-                closest_distance = residual
-
         if closest is None:
             log.debug("No Unassigned Images Available")
             return results
 
-        image = closest
-        log.debug("Closest Image: {}", image)
-        results["image_id"] = image.stem
-        image_coordinates = Point(self.images[image])
-        results["image_lat"] = image_coordinates.latitude
-        results["image_lon"] = image_coordinates.longitude
+        image_path = self.image_paths[closest]
+        log.debug("Closest Image: {}", self.image_ids[closest])
+        results["image_id"] = self.image_ids[closest]
+        results["image_lat"] = float(self.index.latitudes[closest])
+        results["image_lon"] = float(self.index.longitudes[closest])
         results["residual"] = closest_distance
-        results["image_path"] = image.resolve()
-        self.assigned_images.add(image)
+        if image_path is not None:
+            results["image_path"] = image_path.resolve()
+        self.index.assign(closest)
 
         return results
+
+    @override
+    def exclude_images(self, image_ids: Iterable[str]) -> None:
+        """
+        Marks images as already assigned, so they are not assigned to other points
+        Args:
+            image_ids: IDs of the images, unknown IDs are ignored
+        """
+        positions = {image_id: i for i, image_id in enumerate(self.image_ids)}
+        for image_id in image_ids:
+            if image_id in positions:
+                self.index.assign(positions[image_id])
+
+    @override
+    def get_images_for_points(self, points: np.ndarray) -> Dict[str, List]:
+        """
+        Gets an image for each point, in order, with the same results as
+        get_image_from_coordinates, looking all points up in the index at once
+        Args:
+            points: (Latitude, Longitude) of each point, as an array of shape (n, 2)
+
+        Returns: The list of each result of the points, keyed as in the result
+            dict of get_image_from_coordinates, in the order of points
+
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        closest, residuals = self.index.nearest_many(
+            points[:, 0], points[:, 1], self.max_distance
+        )
+        log.debug(
+            "Assigned Images To {} Of {} Points", (closest >= 0).sum(), len(points)
+        )
+        found = (closest >= 0).tolist()
+        closest = closest.tolist()
+        latitudes = self.index.latitudes[closest].tolist()
+        longitudes = self.index.longitudes[closest].tolist()
+        return {
+            "image_id": [
+                self.image_ids[i] if f else None for i, f in zip(closest, found)
+            ],
+            "image_lat": [v if f else None for v, f in zip(latitudes, found)],
+            "image_lon": [v if f else None for v, f in zip(longitudes, found)],
+            "residual": [v if f else None for v, f in zip(residuals.tolist(), found)],
+            "image_path": [
+                self.image_paths[i].resolve()
+                if f and self.image_paths[i] is not None
+                else None
+                for i, f in zip(closest, found)
+            ],
+            "error": [None] * len(points),
+        }
@@ -1,16 +1,51 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
 from pathlib import Path
-from typing import Optional
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
-from geopy.distance import ELLIPSOIDS, distance
 from loguru import logger as log
+import numpy as np
 import requests
 from requests import RequestException
+from requests.adapters import HTTPAdapter
 from stamina import retry
 from tenacity import RetryError
+from tqdm import tqdm
 from typing_extensions import override
 from urllib3.exceptions import HTTPError
 
+from src import metrics
+from src.concurrency import bounded_map
+from src.images.exif import JPEG_TAIL_SIZE, is_complete_jpeg, is_complete_jpeg_file
 from src.images.image_source import ImageSource
+from src.images.image_store import PackedImageStore
+from src.images.rate_limiter import RateLimiter
+from src.images.response_cache import OfflineCacheMiss, ResponseCache, request_key
+from src.images.spatial_index import WGS84_GEOD, SpatialImageIndex
+
+# Size in degrees of the tiles used to prefetch image metadata for an area
+DEFAULT_TILE_SIZE = 0.01
+# Largest page size accepted by the Graph API
+PAGE_LIMIT = 2000
+# Size in degrees under which tiles whose search results are cut short are not
+# split anymore, about 10 meters
+MIN_TILE_SIZE = 0.0001
+DEFAULT_CONCURRENCY = 8
+# Rate limit of the search API, 10,000 requests per minute per application
+DEFAULT_METADATA_RATE = 10_000 / 60
+# Attempts of each request, throttled ones included
+RETRY_ATTEMPTS = 5
+# Bytes of an image downloaded and written at a time
+DOWNLOAD_CHUNK_SIZE = 1 << 16
+
+
+class IncompleteImage(RequestException):
+    """
+    Raised when a downloaded image is shorter than announced or is not a complete
+    JPEG image, so that the download is retried
+    """
 
 
 class Mapillary(ImageSource):
@@ -19,9 +54,21 @@ class Mapillary(ImageSource):
     """
 
     url = "https://graph.mapillary.com/images"
+    fields = "id,thumb_original_url,geometry"
 
     def __init__(
-        self, access_token: str, images_path: Path, max_distance: float
+        self,
+        access_token: str,
+        images_path: Path,
+        max_distance: float,
+        url: Optional[str] = None,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        cache: Optional[ResponseCache] = None,
+        keep_images: bool = True,
+        with_content: bool = False,
+        store: Optional[PackedImageStore] = None,
+        metadata_rate: Optional[float] = DEFAULT_METADATA_RATE,
+        image_rate: Optional[float] = None,
     ) -> None:
         """
         All Args Constructor
@@ -29,14 +76,47 @@ class Mapillary(ImageSource):
             access_token: Mapillary Access Token
             images_path: Where the images should be located
             max_distance: Maximum distance between point and image location, in meters
+            url: URL of the Graph API images endpoint, if not the Mapillary one
+            concurrency: Maximum number of requests to Mapillary at the same time
+                when getting images for several points
+            cache: Cache of Graph API responses, if searches should be cached
+            keep_images: Write downloaded images to images_path
+            with_content: Include the bytes of the image of each point in its
+                result dict, as image_content
+            store: Packed store to keep downloaded images in, instead of one file
+                per image in images_path
+            metadata_rate: Maximum number of Graph API requests per second,
+                unlimited if None
+            image_rate: Maximum number of image downloads per second, unlimited
+                if None
 
         """
         super().__init__(images_path, max_distance)
         self.access_token = access_token
+        if url is not None:
+            self.url = url
+        self.concurrency = concurrency
+        self.cache = cache
+        self.keep_images = keep_images
+        self.with_content = with_content
+        self.store = store
+        # Searches and downloads have separate budgets, both adapted to throttling
+        self.metadata_limiter = RateLimiter(
+            "Metadata", metadata_rate, max_concurrency=concurrency
+        )
+        self.image_limiter = RateLimiter(
+            "Images", image_rate, max_concurrency=concurrency
+        )
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         self.assigned_images = set()
+        self._lock = Lock()
+        self.prefetched = None
+        self.prefetched_images = []
 
     @override
-    @retry(on=(HTTPError, RequestException), attempts=3)
     def get_image_from_coordinates(self, latitude: float, longitude: float) -> dict:
         """
         Gets an image for a set of coordinates
@@ -49,73 +129,450 @@ class Mapillary(ImageSource):
 
         """
         log.debug("Get Image From Coordinates: {}, {}", latitude, longitude)
+        if self.prefetched is not None:
+            images = None
+        else:
+            images = self._search_images(latitude, longitude)
+        results, image_url = self._assign_image(latitude, longitude, images)
+        return self._download_results(results, image_url)
+
+    @override
+    def get_images_from_coordinates(
+        self, coordinates: Iterable[Tuple[float, float]]
+    ) -> Iterator[dict]:
+        """
+        Gets an image for each set of coordinates, in order, with up to concurrency
+        requests to Mapillary at the same time. Images are assigned to points in
+        the order of coordinates, as with get_image_from_coordinates, so the same
+        image is never assigned twice and results do not depend on concurrency.
+        Errors are reported in the results of the point instead of being raised
+        Args:
+            coordinates: (Latitude, Longitude) of each point to get an image for
+
+        Returns: Iterator over the result dict of each point, in the order of
+            coordinates
+
+        """
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            max_in_flight = 2 * self.concurrency
+            searches = bounded_map(
+                executor, self._search_point, coordinates, max_in_flight
+            )
+            assignments = (
+                self._assign_image(latitude, longitude, images, error)
+                for latitude, longitude, images, error in searches
+            )
+            yield from bounded_map(
+                executor,
+                lambda assignment: self._download_results(*assignment),
+                assignments,
+                max_in_flight,
+            )
+
+    @override
+    def exclude_images(self, image_ids: Iterable[str]) -> None:
+        """
+        Marks images as already assigned, so they are not assigned to other points
+        Args:
+            image_ids: Mapillary IDs of the images
+        """
+        with self._lock:
+            excluded = set(image_ids) - self.assigned_images
+            self.assigned_images.update(excluded)
+            if self.prefetched is not None:
+                for i, image in enumerate(self.prefetched_images):
+                    if image["id"] in excluded:
+                        self.prefetched.assign(i)
+
+    @override
+    def get_images_for_points(self, points: np.ndarray) -> Dict[str, List]:
+        """
+        Gets an image for each point, in order, with the same results as
+        get_images_from_coordinates. If images were prefetched, all points are
+        looked up in the prefetched images at once, and the assigned images are
+        then downloaded with up to concurrency requests at the same time
+        Args:
+            points: (Latitude, Longitude) of each point, as an array of shape (n, 2)
+
+        Returns: The list of each result of the points, keyed as in the result
+            dict of get_image_from_coordinates, in the order of points
+
+        """
+        if self.prefetched is None:
+            return super().get_images_for_points(points)
+
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        with self._lock:
+            closest, residuals = self.prefetched.nearest_many(
+                points[:, 0], points[:, 1], self.max_distance
+            )
+            images = [
+                self.prefetched_images[i] if i >= 0 else None for i in closest.tolist()
+            ]
+            self.assigned_images.update(
+                image["id"] for image in images if image is not None
+            )
+
+        columns = {
+            "image_id": [image["id"] if image else None for image in images],
+            "image_lat": [
+                image["geometry"]["coordinates"][1] if image else None
+                for image in images
+            ],
+            "image_lon": [
+                image["geometry"]["coordinates"][0] if image else None
+                for image in images
+            ],
+            "residual": [
+                residual if image else None
+                for image, residual in zip(images, residuals.tolist())
+            ],
+        }
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            downloads = list(
+                tqdm(
+                    bounded_map(
+                        executor,
+                        self._download_prefetched,
+                        images,
+                        2 * self.concurrency,
+                    ),
+                    total=len(images),
+                    desc="Downloading Images",
+                    unit="points",
+                )
+            )
+        columns["image_path"] = [download["image_path"] for download in downloads]
+        columns["error"] = [download["error"] for download in downloads]
+        if self.with_content:
+            columns["image_content"] = [
+                download.get("image_content") for download in downloads
+            ]
+        return columns
+
+    def _download_prefetched(self, image: Optional[dict]) -> dict:
+        """
+        Downloads a prefetched image assigned to a point, if any
+        Args:
+            image: The image, as returned by the Graph API, or None
+
+        Returns: A dict containing the Path of the downloaded image, and Error if
+            any
+
+        """
+        results = {"image_path": None, "error": None}
+        if image is None:
+            return results
+        results["image_id"] = image["id"]
+        return self._download_results(results, image["thumb_original_url"])
+
+    def _search_point(
+        self, coordinates: Tuple[float, float]
+    ) -> Tuple[float, float, Optional[List[dict]], Optional[str]]:
+        """
+        Searches for the images around a point, unless images were prefetched
+        Args:
+            coordinates: (Latitude, Longitude) of the point to get an image for
+
+        Returns: The coordinates, the images found or None if images were
+            prefetched, and the name of the error if the search failed
+
+        """
+        latitude, longitude = coordinates
+        log.debug("Get Image From Coordinates: {}, {}", latitude, longitude)
+        if self.prefetched is not None:
+            return latitude, longitude, None, None
+        try:
+            return latitude, longitude, self._search_images(latitude, longitude), None
+        except (HTTPError, RequestException, RetryError) as e:
+            log.error(e)
+            return latitude, longitude, [], e.__class__.__name__
+
+    def _assign_image(
+        self,
+        latitude: float,
+        longitude: float,
+        images: Optional[List[dict]],
+        error: Optional[str] = None,
+    ) -> Tuple[dict, Optional[str]]:
+        """
+        Assigns the closest unassigned image to a point
+        Args:
+            latitude: Latitude of the point to get an image for
+            longitude: Longitude of the point to get an image for
+            images: Candidate images, or None to use the prefetched images
+            error: Name of the error that occurred while searching for images
+
+        Returns: The result dict of the point, and the URL to download the
+            assigned image from if there is one
+
+        """
         results = {
             "image_lat": None,
             "image_lon": None,
             "residual": None,
             "image_id": None,
             "image_path": None,
-            "error": None,
+            "error": error,
         }
 
-        response = requests.get(
+        with self._lock:
+            if images is None:
+                image, residual = self._closest_prefetched_image(latitude, longitude)
+            else:
+                image, residual = self._closest_image(latitude, longitude, images)
+            if image is None:
+                log.debug("No Unassigned Images Available")
+                return results, None
+            self.assigned_images.add(image["id"])
+
+        log.debug("Closest Image: {}", image["id"])
+        results["image_id"] = image["id"]
+        results["image_lat"] = image["geometry"]["coordinates"][1]
+        results["image_lon"] = image["geometry"]["coordinates"][0]
+        results["residual"] = residual
+        return results, image["thumb_original_url"]
+
+    def _download_results(self, results: dict, image_url: Optional[str]) -> dict:
+        """
+        Downloads the image assigned to a point, if any
+        Args:
+            results: The result dict of the point
+            image_url: The URL of the assigned image, or None
+
+        Returns: The result dict, with the path of the downloaded image if it was
+            kept, and its content if with_content is set
+
+        """
+        if image_url is None:
+            return results
+        try:
+            image_path, image_content = self._download_image(
+                image_url, results["image_id"]
+            )
+        except (HTTPError, RequestException, RetryError) as e:
+            results["error"] = e.__class__.__name__
+            return results
+        if image_path is not None:
+            results["image_path"] = image_path.resolve()
+        if self.with_content:
+            results["image_content"] = image_content
+        return results
+
+    def _search_images(self, latitude: float, longitude: float) -> List[dict]:
+        """
+        Searches for panoramic images in the bounding box around a point
+        Args:
+            latitude: Latitude of the point to get an image for
+            longitude: Longitude of the point to get an image for
+
+        Returns: The images found, as returned by the Graph API
+
+        """
+        images = self._get_json(
             self.url,
             params={
                 "access_token": self.access_token,
-                "fields": "id,thumb_original_url,geometry",
+                "fields": self.fields,
                 "is_pano": "true",
                 "bbox": self._bounds(latitude, longitude),
             },
-        )
-        response.raise_for_status()
-
-        images = response.json()["data"]
+        )["data"]
         log.debug("Successfully Retrieved Image Data: {}", images)
         if len(images) == 0:
             log.debug(
                 "No Images in Bounding Box: {}", self._bounds(latitude, longitude)
             )
-            return results
+        return images
+
+    def _closest_image(
+        self, latitude: float, longitude: float, images: List[dict]
+    ) -> Tuple[Optional[dict], Optional[float]]:
+        """
+        Finds the closest unassigned image strictly within max_distance of a point
+        Args:
+            latitude: Latitude of the point to get an image for
+            longitude: Longitude of the point to get an image for
+            images: Candidate images, as returned by the Graph API
+
+        Returns: The closest image and its distance to the point in meters, or
+            (None, None) if there is no such image
 
-        filtered_images = filter(
-            lambda img: img["id"] not in self.assigned_images, images
+        """
+        images = [image for image in images if image["id"] not in self.assigned_images]
+        if len(images) == 0:
+            return None, None
+        coordinates = np.array(
+            [image["geometry"]["coordinates"][:2] for image in images], dtype=np.float64
+        )
+        _, _, residuals = WGS84_GEOD.inv(
+            np.full(len(images), longitude),
+            np.full(len(images), latitude),
+            coordinates[:, 0],
+            coordinates[:, 1],
         )
+        # The first of the closest images, as the Graph API returned them
+        closest = int(np.argmin(residuals))
+        if not residuals[closest] < self.max_distance:
+            return None, None
+        return images[closest], float(residuals[closest])
 
-        closest = 0
-        closest_distance = self.max_distance
-        for i, image in enumerate(filtered_images):
-            image_coordinates = (
-                image["geometry"]["coordinates"][1],
-                image["geometry"]["coordinates"][0],
-            )
-            residual = distance(
-                (latitude, longitude), image_coordinates, ellipsoid=ELLIPSOIDS["WGS-84"]
-            ).m
+    def _closest_prefetched_image(
+        self, latitude: float, longitude: float
+    ) -> Tuple[Optional[dict], Optional[float]]:
+        """
+        Finds the closest unassigned prefetched image strictly within max_distance
+        of a point, without calling the Graph API
+        Args:
+            latitude: Latitude of the point to get an image for
+            longitude: Longitude of the point to get an image for
 
-            if residual < closest_distance:
-                closest = i
-                closest_distance = residual
+        Returns: The closest image and its distance to the point in meters, or
+            (None, None) if there is no such image
 
+        """
+        closest, residual = self.prefetched.nearest(
+            latitude, longitude, self.max_distance
+        )
         if closest is None:
-            log.debug("No Unassigned Images Available")
-            return results
+            return None, None
+        self.prefetched.assign(closest)
+        return self.prefetched_images[closest], residual
 
-        image = images[closest]
-        log.debug("Closest Image: {}", image["id"])
-        results["image_id"] = image["id"]
-        results["image_lat"] = image["geometry"]["coordinates"][1]
-        results["image_lon"] = image["geometry"]["coordinates"][0]
-        results["residual"] = closest_distance
-        image_url = image["thumb_original_url"]
-        try:
-            results["image_path"] = self._download_image(
-                image_url, results["image_id"]
-            ).resolve()
-        except HTTPError or RetryError as e:
-            results["error"] = e.__class__.__name__
-        self.assigned_images.add(results["image_id"])
+    def prefetch(
+        self,
+        latitudes: np.ndarray,
+        longitudes: np.ndarray,
+        tile_size: float = DEFAULT_TILE_SIZE,
+    ) -> int:
+        """
+        Retrieves the metadata of every panoramic image around a set of points, so
+        that images for these points are found without calling the Graph API per
+        point. The bounding box of the points is covered with a grid of tiles, and
+        each tile within max_distance of a point is searched once, page by page.
+        Tiles whose results are cut short are split and searched again
+        Args:
+            latitudes: Latitudes of the points images will be requested for
+            longitudes: Longitudes of the points images will be requested for
+            tile_size: Width and height of the tiles, in degrees
 
-        return results
+        Returns: Number of images found
+
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        if len(latitudes) == 0:
+            return 0
+        lat_margin = self.max_distance / 111_111
+        lon_margin = lat_margin / np.cos(np.radians(np.abs(latitudes).max()))
+        left = longitudes.min() - lon_margin
+        bottom = latitudes.min() - lat_margin
+        # Tiles that the area within max_distance of any point overlaps
+        tiles = set()
+        for lon_offset in (-lon_margin, lon_margin):
+            for lat_offset in (-lat_margin, lat_margin):
+                columns = ((longitudes + lon_offset - left) // tile_size).astype(int)
+                rows = ((latitudes + lat_offset - bottom) // tile_size).astype(int)
+                tiles.update(zip(columns.tolist(), rows.tolist()))
+        log.info("Prefetching Image Data For {} Tiles", len(tiles))
+
+        images = {}
+        for column, row in sorted(tiles):
+            tile = (
+                left + column * tile_size,
+                bottom + row * tile_size,
+                left + (column + 1) * tile_size,
+                bottom + (row + 1) * tile_size,
+            )
+            for image in self._search_tile(tile):
+                images[image["id"]] = image
+
+        self.prefetched_images = list(images.values())
+        self.prefetched = SpatialImageIndex(
+            [image["geometry"]["coordinates"][1] for image in self.prefetched_images],
+            [image["geometry"]["coordinates"][0] for image in self.prefetched_images],
+        )
+        for i, image in enumerate(self.prefetched_images):
+            if image["id"] in self.assigned_images:
+                self.prefetched.assign(i)
+        log.info("Prefetched {} Images", len(self.prefetched_images))
+        return len(self.prefetched_images)
+
+    def _search_tile(self, tile: Tuple[float, float, float, float]) -> Iterator[dict]:
+        """
+        Searches for every panoramic image in a tile, following result pages. The
+        Graph API stops paging after some number of results, with a full last page
+        and no next page: the tile is then split in four, and each quarter is
+        searched again. Images may be returned more than once
+        Args:
+            tile: (left, bottom, right, top) of the tile, in degrees
+
+        Returns: The images found, as returned by the Graph API
+
+        """
+        url = self.url
+        params = {
+            "access_token": self.access_token,
+            "fields": self.fields,
+            "is_pano": "true",
+            "bbox": ",".join(str(value) for value in tile),
+            "limit": PAGE_LIMIT,
+        }
+        while url is not None:
+            body = self._get_json(url, params)
+            yield from body["data"]
+            url = body.get("paging", {}).get("next")
+            # The next page URL includes the query parameters
+            params = None
+        if len(body["data"]) < PAGE_LIMIT:
+            return
+
+        left, bottom, right, top = tile
+        if right - left < 2 * MIN_TILE_SIZE:
+            log.warning("Search Results Of Tile {} May Be Incomplete", tile)
+            return
+        log.debug("Splitting Tile {} With Incomplete Search Results", tile)
+        middle_lon = (left + right) / 2
+        middle_lat = (bottom + top) / 2
+        for quarter in (
+            (left, bottom, middle_lon, middle_lat),
+            (middle_lon, bottom, right, middle_lat),
+            (left, middle_lat, middle_lon, top),
+            (middle_lon, middle_lat, right, top),
+        ):
+            yield from self._search_tile(quarter)
+
+    def _get_json(self, url: str, params: Optional[dict]) -> dict:
+        """
+        Gets the JSON body of a Graph API request, from the cache if there is one
+        and it has the response
+        Args:
+            url: URL of the request
+            params: Query parameters of the request, if not already in the URL
+
+        Returns: The JSON body of the response
+
+        """
+        if self.cache is None:
+            return self._fetch_json(url, params)
+        key = request_key(url, params)
+        body = self.cache.get(key)
+        if body is not None:
+            return body
+        if self.cache.offline:
+            raise OfflineCacheMiss(f"Response Not Cached: {key}")
+        body = self._fetch_json(url, params)
+        self.cache.put(key, body)
+        return body
+
+    @retry(on=(HTTPError, RequestException), attempts=RETRY_ATTEMPTS, timeout=None)
+    def _fetch_json(self, url: str, params: Optional[dict]) -> dict:
+        with self.metadata_limiter.request(), metrics.timer("mapillary.metadata"):
+            response = self.session.get(url, params=params)
+            self.metadata_limiter.observe(response)
+        metrics.count("mapillary.metadata_bytes", len(response.content))
+        response.raise_for_status()
+        return response.json()
 
     def _bounds(self, latitude: float, longitude: float) -> str:
         """
@@ -133,28 +590,124 @@ class Mapillary(ImageSource):
         top = latitude + self.max_distance / 111_111
         return f"{left},{bottom},{right},{top}"
 
-    @retry(on=(HTTPError, RequestException), attempts=3)
-    def _download_image(self, image_url: str, image_id: str) -> Optional[Path]:
+    def _download_image(
+        self, image_url: str, image_id: str
+    ) -> Tuple[Optional[Path], Optional[bytes]]:
         """
-        Downloads an Image from a URL to images_path/image_id.jpeg
+        Downloads an Image from a URL to images_path/image_id.jpeg, or to the store
+        if there is one, unless a complete image was already downloaded
         Args:
             image_url: The URL of the image
             image_id: The Mapillary ID of the image
 
-        Returns: Path of the downloaded image, or None
+        Returns: Path of the downloaded image, or None if keep_images is not set
+            or it is in the store, and the content of the image, or None if it was
+            already downloaded and with_content is not set
 
         """
+        if self.store is not None and image_id in self.store:
+            log.debug("Image Already Packed: {}", image_id)
+            return None, bytes(self.store.get(image_id)) if self.with_content else None
+        image_path = Path(self.images_path, f"{image_id}.jpeg")
+        if self.store is None and is_complete_jpeg_file(image_path):
+            log.debug("Image Already Downloaded: {}", image_path)
+            return image_path, image_path.read_bytes() if self.with_content else None
+        if self.store is None and image_path.exists():
+            log.warning("Downloading Incomplete Image Again: {}", image_path)
+        if self.cache is not None and self.cache.offline:
+            raise OfflineCacheMiss(f"Image Not Downloaded: {image_id}")
+
+        if self.keep_images and self.store is None:
+            # Streamed to disk, the image is never held in memory unless needed
+            self._fetch_image_to_file(image_url, image_id, image_path)
+            return image_path, image_path.read_bytes() if self.with_content else None
+        image_content = self._fetch_image(image_url, image_id)
+        if not self.keep_images:
+            return None, image_content
+        self.store.put(image_id, image_content)
+        log.debug("Successfully Packed Image: {}", image_id)
+        return None, image_content
+
+    @retry(on=(HTTPError, RequestException), attempts=RETRY_ATTEMPTS, timeout=None)
+    def _fetch_image(self, image_url: str, image_id: str) -> bytes:
         log.debug("Downloading Image: {}", image_id)
-        response = requests.get(image_url, stream=True)
-        response.raise_for_status()
-        image_content = response.content
+        with self.image_limiter.request(), metrics.timer(
+            "mapillary.download"
+        ), self.session.get(image_url, stream=True) as response:
+            self.image_limiter.observe(response)
+            response.raise_for_status()
+            image_content = response.content
+            metrics.count("mapillary.download_bytes", len(image_content))
+            self._check_image(
+                response,
+                len(image_content),
+                image_content[:JPEG_TAIL_SIZE],
+                image_content[-JPEG_TAIL_SIZE:],
+            )
         log.debug("Successfully Retrieved Image: {}", image_id)
-        image_path = Path(self.images_path, f"{image_id}.jpeg")
-        log.debug("Writing Image To: {}", image_path)
+        return image_content
 
-        if not image_path.is_file():
-            with open(image_path, "wb") as img:
-                img.write(image_content)
-            log.debug("Successfully Wrote Image: {}", image_path)
+    @retry(on=(HTTPError, RequestException), attempts=RETRY_ATTEMPTS, timeout=None)
+    def _fetch_image_to_file(
+        self, image_url: str, image_id: str, image_path: Path
+    ) -> None:
+        """
+        Downloads an image to a file, a chunk at a time. The image is written to a
+        temporary file in the same directory, which is renamed to image_path once
+        the image is complete, so image_path is never left with a partial image
+        Args:
+            image_url: The URL of the image
+            image_id: The Mapillary ID of the image
+            image_path: Path to write the image to
+        """
+        log.debug("Downloading Image: {}", image_id)
+        with self.image_limiter.request(), metrics.timer(
+            "mapillary.download"
+        ), self.session.get(image_url, stream=True) as response:
+            self.image_limiter.observe(response)
+            response.raise_for_status()
+            part = NamedTemporaryFile(
+                dir=image_path.parent,
+                prefix=f".{image_id}.",
+                suffix=".part",
+                delete=False,
+            )
+            try:
+                with part:
+                    head = b""
+                    tail = b""
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        if len(head) < JPEG_TAIL_SIZE:
+                            head += chunk[:JPEG_TAIL_SIZE]
+                        tail = (tail + chunk)[-JPEG_TAIL_SIZE:]
+                        part.write(chunk)
+                    metrics.count("mapillary.download_bytes", part.tell())
+                    self._check_image(response, part.tell(), head, tail)
+                os.replace(part.name, image_path)
+            except BaseException:
+                Path(part.name).unlink(missing_ok=True)
+                raise
+        log.debug("Successfully Wrote Image: {}", image_path)
 
-        return image_path
+    @staticmethod
+    def _check_image(
+        response: requests.Response, size: int, head: bytes, tail: bytes
+    ) -> None:
+        """
+        Checks that a downloaded image has the announced size and is a complete
+        JPEG image
+        Args:
+            response: The response the image was downloaded from
+            size: Number of bytes downloaded
+            head: The first bytes of the image
+            tail: The last bytes of the image
+        """
+        # Content-Length is the size of the encoded body, if it is encoded
+        expected = response.headers.get("Content-Length")
+        if "Content-Encoding" not in response.headers and expected is not None:
+            if size != int(expected):
+                raise IncompleteImage(
+                    f"Downloaded {size} Of {expected} Bytes", response=response
+                )
+        if not is_complete_jpeg(head, tail):
+            raise IncompleteImage("Not A Complete JPEG Image", response=response)
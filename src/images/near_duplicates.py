@@ -0,0 +1,125 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Sequence, TypeVar
+
+import cv2
+import geopandas as gpd
+from loguru import logger as log
+import numpy as np
+
+from src.images.exif import DEFAULT_WORKERS
+
+T = TypeVar("T")
+
+# Frames less than this many meters from the first frame of a run of near-duplicate
+# frames can belong to the run, as GPS locations drift while a camera is stopped
+DEFAULT_MAX_DISPLACEMENT = 3.0
+# Frames whose hashes differ by at most this many of their HASH_SIZE**2 bits from
+# those of the first frame of a run of near-duplicate frames look the same
+DEFAULT_MAX_HASH_DISTANCE = 6
+# Width and height of the difference hash, in bits
+HASH_SIZE = 8
+# Images are decoded in grayscale at 1/8 of their size, by skipping DCT coefficients
+HASH_DECODE_FLAGS = cv2.IMREAD_REDUCED_GRAYSCALE_8
+
+
+def frame_hash(image) -> Optional[int]:
+    """
+    Computes the difference hash of an image: whether each pixel of a thumbnail of
+    the image is brighter than its left neighbor. Images that look the same have
+    hashes that differ by few bits, whatever their compression or exposure
+    Args:
+        image: Path of the image file, or its content
+
+    Returns: The hash of the image, as an integer of HASH_SIZE**2 bits, or None if
+        the image could not be decoded
+
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        pixels = cv2.imdecode(np.frombuffer(image, np.uint8), HASH_DECODE_FLAGS)
+    else:
+        pixels = cv2.imread(str(image), HASH_DECODE_FLAGS)
+    if pixels is None:
+        return None
+    thumbnail = cv2.resize(
+        pixels, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA
+    )
+    bits = thumbnail[:, 1:] > thumbnail[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hash_distance(a: int, b: int) -> int:
+    """
+    Returns: The number of bits that differ between two frame hashes
+    """
+    return bin(a ^ b).count("1")
+
+
+def near_duplicate_frames(
+    frames: Sequence[T],
+    latitudes: Sequence[float],
+    longitudes: Sequence[float],
+    max_displacement: float = DEFAULT_MAX_DISPLACEMENT,
+    max_hash_distance: int = DEFAULT_MAX_HASH_DISTANCE,
+    read_hash: Callable[[T], Optional[int]] = frame_hash,
+    workers: int = DEFAULT_WORKERS,
+) -> Dict[T, T]:
+    """
+    Finds the runs of near-duplicate frames of a capture, such as those taken while
+    stopped at lights or in traffic. Frames are walked in capture order, and a
+    frame is a near-duplicate of the first frame of the current run if it is within
+    max_displacement meters of it and their hashes differ by at most
+    max_hash_distance bits. Otherwise, it starts a new run. Only frames close to
+    the previous frame are decoded to be hashed, so frames taken while moving cost
+    nothing
+    Args:
+        frames: The frames, in capture order
+        latitudes: Latitude of each frame, in decimal degrees
+        longitudes: Longitude of each frame, in decimal degrees
+        max_displacement: Maximum distance between near-duplicate frames, in meters
+        max_hash_distance: Maximum number of differing bits between the hashes of
+            near-duplicate frames
+        read_hash: Computes the hash of a frame
+        workers: Number of threads decoding frames at the same time
+
+    Returns: The first frame of its run, which is kept, of each near-duplicate
+        frame
+
+    """
+    if len(frames) < 2:
+        return {}
+    locations = gpd.GeoSeries(
+        gpd.points_from_xy(longitudes, latitudes), crs="EPSG:4326"
+    )
+    locations = locations.to_crs(locations.estimate_utm_crs())
+    x = locations.x.to_numpy()
+    y = locations.y.to_numpy()
+
+    # A frame within max_displacement of the first frame of its run, itself within
+    # max_displacement of the previous frame, is within twice that of it
+    steps = np.hypot(np.diff(x), np.diff(y)) <= 2 * max_displacement
+    candidates = np.zeros(len(frames), dtype=bool)
+    candidates[1:] |= steps
+    candidates[:-1] |= steps
+    to_hash = np.flatnonzero(candidates).tolist()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        hashes = dict(
+            zip(to_hash, executor.map(lambda i: read_hash(frames[i]), to_hash))
+        )
+    log.debug("Hashed {} Of {} Frames", len(hashes), len(frames))
+
+    duplicates = {}
+    first = 0
+    for i in range(1, len(frames)):
+        displacement = np.hypot(x[i] - x[first], y[i] - y[first])
+        if displacement <= max_displacement:
+            first_hash = hashes.get(first)
+            this_hash = hashes.get(i)
+            if (
+                first_hash is not None
+                and this_hash is not None
+                and hash_distance(first_hash, this_hash) <= max_hash_distance
+            ):
+                duplicates[frames[i]] = frames[first]
+                continue
+        first = i
+    return duplicates
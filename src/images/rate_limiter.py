@@ -0,0 +1,235 @@
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+import json
+import random
+from threading import Condition
+import time
+from typing import Iterator, List, Optional
+
+from loguru import logger as log
+import requests
+
+# Statuses of responses asking clients to slow down
+THROTTLE_STATUSES = (429, 503)
+# Graph API usage headers, reporting the usage of quotas in percent
+USAGE_HEADERS = ("X-App-Usage", "X-Business-Use-Case-Usage")
+USAGE_KEYS = ("call_count", "total_time", "total_cputime")
+# Usage of a quota, in percent, above which fewer requests are sent at a time
+USAGE_THRESHOLD = 90.0
+# Bounds of the backoff after a throttled response without Retry-After, in seconds
+BACKOFF_INITIAL = 0.5
+BACKOFF_MAX = 60.0
+# Longest pause asked for by a server that is honored, in seconds
+MAX_PAUSE = 300.0
+# Values of rate limit headers above this many seconds are times since the epoch
+EPOCH_THRESHOLD = 1e9
+# Seconds after a decrease of the concurrency during which throttled responses,
+# to requests sent before the decrease, do not decrease it again
+DECREASE_INTERVAL = 1.0
+
+
+def retry_after(response: requests.Response) -> Optional[float]:
+    """
+    Reads how long a server asks clients to wait before their next request, from
+    the Retry-After header, or from X-RateLimit-Reset once X-RateLimit-Remaining
+    reaches 0
+    Args:
+        response: The response of the server
+
+    Returns: Seconds to wait, or None if the server did not say
+
+    """
+    value = response.headers.get("Retry-After")
+    if value is None and response.headers.get("X-RateLimit-Remaining") == "0":
+        value = response.headers.get("X-RateLimit-Reset")
+    if value is None:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        seconds = None
+    if seconds is not None:
+        # Some servers give the time of the reset, in seconds since the epoch
+        if seconds > EPOCH_THRESHOLD:
+            seconds -= time.time()
+        return max(seconds, 0.0)
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def quota_usage(response: requests.Response) -> Optional[float]:
+    """
+    Reads the usage of the quotas of the application reported by the Graph API
+    Args:
+        response: The response of the Graph API
+
+    Returns: The highest usage of a quota, in percent, or None if not reported
+
+    """
+    found = []
+    for header in USAGE_HEADERS:
+        try:
+            found.extend(_usages(json.loads(response.headers.get(header) or "{}")))
+        except ValueError:
+            log.debug("Invalid {} Header", header)
+    return max(found) if found else None
+
+
+def _usages(value) -> List[float]:
+    if isinstance(value, list):
+        return [usage for item in value for usage in _usages(item)]
+    if not isinstance(value, dict):
+        return []
+    found = []
+    for key, item in value.items():
+        if key in USAGE_KEYS and isinstance(item, (int, float)):
+            found.append(float(item))
+        else:
+            found.extend(_usages(item))
+    return found
+
+
+class RateLimiter:
+    """
+    Rate limiter shared by the threads making one kind of request to an API. A
+    token bucket caps the rate of requests, and the number of requests in flight
+    is adapted to the throttling signals of the server: increased by one after a
+    window of successful responses, and halved after a throttled response or a
+    report of a quota close to its limit (AIMD). Throttled responses also pause
+    all requests for as long as the server asks, or for an exponential backoff
+    with full jitter if it does not say
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: Optional[float] = None,
+        max_concurrency: int = 8,
+        min_concurrency: int = 1,
+    ) -> None:
+        """
+        All Args Constructor
+        Args:
+            name: Name of the requests, for the metrics summary
+            rate: Maximum number of requests per second, unlimited if None. Up to
+                one second of requests can be made at once after being idle
+            max_concurrency: Maximum number of requests in flight
+            min_concurrency: Number of requests in flight that the limit is never
+                decreased below
+        """
+        self.name = name
+        self.rate = rate
+        self.burst = max(rate or 1.0, 1.0)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.tokens = self.burst
+        self.refilled = time.monotonic()
+        self.paused_until = 0.0
+        self.last_decrease = float("-inf")
+        self.backoff = BACKOFF_INITIAL
+        self._condition = Condition()
+
+        # Metrics
+        self.requests = 0
+        self.throttled = 0
+        self.decreases = 0
+        self.waited = 0.0
+        self.lowest_limit = max_concurrency
+
+    @contextmanager
+    def request(self) -> Iterator[None]:
+        """
+        Waits until a request can be made, and keeps it in flight until the end
+        of the block, in which its response should be passed to observe
+        """
+        start = time.monotonic()
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if self.rate is not None:
+                    self.tokens = min(
+                        self.burst, self.tokens + (now - self.refilled) * self.rate
+                    )
+                self.refilled = now
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.in_flight >= int(self.limit):
+                    # Woken up when a request completes
+                    wait = None
+                elif self.rate is not None and self.tokens < 1:
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    break
+                self._condition.wait(wait)
+            if self.rate is not None:
+                self.tokens -= 1
+            self.in_flight += 1
+            self.requests += 1
+            self.waited += time.monotonic() - start
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_flight -= 1
+                self._condition.notify_all()
+
+    def observe(self, response: requests.Response) -> None:
+        """
+        Adapts the limits to the response of a request
+        Args:
+            response: The response of a request made in a request block
+        """
+        wait = retry_after(response)
+        usage = quota_usage(response)
+        with self._condition:
+            now = time.monotonic()
+            if response.status_code in THROTTLE_STATUSES:
+                self.throttled += 1
+                if wait is None:
+                    # Full jitter, so that threads do not all retry at once
+                    wait = random.uniform(0, self.backoff)
+                    self.backoff = min(self.backoff * 2, BACKOFF_MAX)
+                else:
+                    wait = min(wait, MAX_PAUSE) * random.uniform(1.0, 1.1)
+                self.paused_until = max(self.paused_until, now + wait)
+                self._decrease(now)
+                log.debug(
+                    "{} Throttled: Pausing {:.2f}s, Concurrency {}",
+                    self.name,
+                    wait,
+                    int(self.limit),
+                )
+            else:
+                if wait is not None:
+                    # Quota used up, but this response was still served
+                    self.paused_until = max(
+                        self.paused_until, now + min(wait, MAX_PAUSE)
+                    )
+                if usage is not None and usage >= USAGE_THRESHOLD:
+                    self._decrease(now)
+                elif response.ok:
+                    self.backoff = BACKOFF_INITIAL
+                    self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def _decrease(self, now: float) -> None:
+        if now - self.last_decrease < DECREASE_INTERVAL:
+            return
+        self.last_decrease = now
+        self.limit = max(float(self.min_concurrency), self.limit / 2)
+        self.lowest_limit = min(self.lowest_limit, int(self.limit))
+        self.decreases += 1
+
+    def summary(self) -> str:
+        """
+        Returns: A summary of the requests made and of the throttling
+        """
+        return (
+            f"{self.name}: {self.requests} Requests, {self.throttled} Throttled, "
+            f"{self.decreases} Concurrency Decreases, Lowest Concurrency "
+            f"{self.lowest_limit}, {self.waited:.1f}s Waited"
+        )
@@ -0,0 +1,185 @@
+import json
+from pathlib import Path
+from threading import Lock
+import time
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import zlib
+
+from loguru import logger as log
+from requests import RequestException
+
+from src.sidecar import open_sidecar
+
+# Query parameters that do not change the response, and are left out of the keys
+IGNORED_PARAMS = ("access_token",)
+# Bounding box coordinates are rounded to this many decimals, about 1 cm
+BBOX_DECIMALS = 7
+DEFAULT_TTL_DAYS = 30.0
+DEFAULT_MAX_SIZE_MB = 512.0
+# Once full, the cache is evicted down to this fraction of its maximum size, so
+# that it is not evicted again on every new response
+EVICT_TO = 0.9
+
+
+class OfflineCacheMiss(RequestException):
+    """
+    Raised in offline mode for a request whose response is not in the cache
+    """
+
+
+def request_key(url: str, params: Optional[dict] = None) -> str:
+    """
+    Normalizes a GET request into a cache key: query parameters are merged with the
+    ones of the URL and sorted, bounding box coordinates are rounded to
+    BBOX_DECIMALS, and parameters in IGNORED_PARAMS are left out
+    Args:
+        url: URL of the request, possibly with query parameters
+        params: Additional query parameters
+
+    Returns: The cache key of the request
+
+    """
+    scheme, netloc, path, query, _ = urlsplit(url)
+    query_params = dict(parse_qsl(query))
+    query_params.update({key: str(value) for key, value in (params or {}).items()})
+    for key in IGNORED_PARAMS:
+        query_params.pop(key, None)
+    if "bbox" in query_params:
+        query_params["bbox"] = ",".join(
+            f"{float(value):.{BBOX_DECIMALS}f}"
+            for value in query_params["bbox"].split(",")
+        )
+    return urlunsplit(
+        (scheme, netloc, path, urlencode(sorted(query_params.items())), "")
+    )
+
+
+class ResponseCache:
+    """
+    Persistent SQLite cache of JSON API responses, stored in the images directory
+    and keyed by the normalized request. Entries older than the TTL are not served,
+    and the least recently used entries are evicted once the compressed responses
+    take more than the maximum size. In offline mode, requests are only answered
+    from the cache, regardless of the TTL
+    """
+
+    filename = ".mapillary_cache.sqlite"
+    schema_version = 1
+
+    def __init__(
+        self,
+        images_path: Path,
+        ttl_days: float = DEFAULT_TTL_DAYS,
+        max_size_mb: float = DEFAULT_MAX_SIZE_MB,
+        offline: bool = False,
+    ) -> None:
+        """
+        All Args Constructor
+        Args:
+            images_path: Directory containing the images and the cache
+            ttl_days: Age after which cached responses are requested again, in days
+            max_size_mb: Maximum size of the cached responses, in megabytes
+            offline: Only answer from the cache, and never expire responses
+        """
+        self.path = Path(images_path, self.filename)
+        self.ttl = ttl_days * 86_400
+        self.max_size = int(max_size_mb * 1_000_000)
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+        # Requests are made from a pool of threads, the lock serializes access
+        self.connection = open_sidecar(
+            self.path,
+            [
+                """
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    body BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    accessed REAL NOT NULL
+                )
+                """,
+                "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)",
+            ],
+            self.schema_version,
+            check_same_thread=False,
+        )
+        # Size of the cached responses, kept up to date by put
+        self.size = self._total_size()
+
+    def _total_size(self) -> int:
+        (total,) = self.connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        return total
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        Gets a cached response
+        Args:
+            key: Cache key of the request, as returned by request_key
+
+        Returns: The JSON body of the response, or None if it is not cached or
+            has expired
+
+        """
+        now = time.time()
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT body, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (not self.offline and now - row[1] > self.ttl):
+                self.misses += 1
+                return None
+            with self.connection:
+                self.connection.execute(
+                    "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+                )
+            self.hits += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, key: str, body: dict) -> None:
+        """
+        Caches a response. Once the cache takes more than its maximum size, the
+        least recently used responses are evicted until it takes EVICT_TO of it
+        Args:
+            key: Cache key of the request, as returned by request_key
+            body: JSON body of the response
+        """
+        blob = zlib.compress(json.dumps(body, separators=(",", ":")).encode())
+        now = time.time()
+        with self._lock, self.connection:
+            replaced = self.connection.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self.connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now),
+            )
+            self.size += len(blob) - (0 if replaced is None else replaced[0])
+            if self.size <= self.max_size:
+                return
+            # Other processes sharing the cache may have added or evicted responses
+            self.size = self._total_size()
+            if self.size <= self.max_size:
+                return
+            evicted = 0
+            for old_key, size in self.connection.execute(
+                "SELECT key, size FROM responses ORDER BY accessed"
+            ).fetchall():
+                if self.size <= EVICT_TO * self.max_size:
+                    break
+                self.connection.execute(
+                    "DELETE FROM responses WHERE key = ?", (old_key,)
+                )
+                self.size -= size
+                evicted += 1
+        log.debug("Response Cache: Evicted {} Responses", evicted)
@@ -0,0 +1,157 @@
+from typing import Optional, Tuple
+
+import numpy as np
+from pyproj import Geod, Transformer
+from scipy.spatial import cKDTree
+
+WGS84_GEOD = Geod(ellps="WGS84")
+# Earth-centered, earth-fixed coordinates of locations on the WGS84 ellipsoid
+ECEF_TRANSFORMER = Transformer.from_crs("EPSG:4979", "EPSG:4978", always_xy=True)
+
+# The straight line between two locations is never longer than the geodesic
+# between them, wherever they are, so candidates are found within max_distance of
+# a point in ECEF coordinates before they are checked geodesically. The radius is
+# widened slightly so that rounding does not drop images at max_distance
+SEARCH_RADIUS_MARGIN = 1.001
+
+
+def ecef(latitudes: np.ndarray, longitudes: np.ndarray) -> np.ndarray:
+    """
+    Converts locations on the WGS84 ellipsoid to ECEF coordinates
+    Args:
+        latitudes: Latitudes of the locations, in decimal degrees
+        longitudes: Longitudes of the locations, in decimal degrees
+
+    Returns: The x, y and z coordinates of each location, in meters
+
+    """
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    return np.column_stack(
+        ECEF_TRANSFORMER.transform(longitudes, latitudes, np.zeros_like(latitudes))
+    ).reshape(-1, 3)
+
+
+class SpatialImageIndex:
+    """
+    Spatial index of image locations for nearest unassigned image lookups
+    """
+
+    def __init__(self, latitudes: np.ndarray, longitudes: np.ndarray) -> None:
+        """
+        All Args Constructor
+        Args:
+            latitudes: Latitudes of the images, in decimal degrees
+            longitudes: Longitudes of the images, in decimal degrees
+        """
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)
+        self.assigned = np.zeros(len(self.latitudes), dtype=bool)
+
+        self._tree = cKDTree(ecef(self.latitudes, self.longitudes))
+
+    def __len__(self) -> int:
+        return len(self.latitudes)
+
+    def nearest(
+        self, latitude: float, longitude: float, max_distance: float
+    ) -> Tuple[Optional[int], Optional[float]]:
+        """
+        Finds the closest unassigned image strictly within max_distance of a point.
+        Ties are broken in favor of the image with the lowest index
+        Args:
+            latitude: Latitude of the point
+            longitude: Longitude of the point
+            max_distance: Maximum geodesic distance to the image, in meters
+
+        Returns: The index of the closest image and its geodesic distance to the
+            point in meters, or (None, None) if there is no such image
+
+        """
+        candidates = np.array(
+            self._tree.query_ball_point(
+                ecef(latitude, longitude)[0], max_distance * SEARCH_RADIUS_MARGIN
+            ),
+            dtype=np.int64,
+        )
+        candidates = np.sort(candidates[~self.assigned[candidates]])
+        if len(candidates) == 0:
+            return None, None
+
+        _, _, residuals = WGS84_GEOD.inv(
+            np.full(len(candidates), longitude),
+            np.full(len(candidates), latitude),
+            self.longitudes[candidates],
+            self.latitudes[candidates],
+        )
+        closest = np.argmin(residuals)
+        if not residuals[closest] < max_distance:
+            return None, None
+        return int(candidates[closest]), float(residuals[closest])
+
+    def nearest_many(
+        self, latitudes: np.ndarray, longitudes: np.ndarray, max_distance: float
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Finds and assigns the closest unassigned image strictly within max_distance
+        of each point, in order, with the same results as calling nearest and
+        assign for each point. The candidates of all points are found with one
+        query of the tree against a tree of the points, and their geodesic
+        distances with one vectorized call
+        Args:
+            latitudes: Latitudes of the points
+            longitudes: Longitudes of the points
+            max_distance: Maximum geodesic distance to the image, in meters
+
+        Returns: The index of the image assigned to each point, or -1, and its
+            geodesic distance to the point in meters, or NaN
+
+        """
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        images = np.full(len(latitudes), -1, dtype=np.int64)
+        residuals = np.full(len(latitudes), np.nan)
+        if len(latitudes) == 0 or len(self) == 0:
+            return images, residuals
+
+        pairs = cKDTree(ecef(latitudes, longitudes)).sparse_distance_matrix(
+            self._tree, max_distance * SEARCH_RADIUS_MARGIN, output_type="ndarray"
+        )
+        points = pairs["i"].astype(np.int64)
+        candidates = pairs["j"].astype(np.int64)
+        unassigned = ~self.assigned[candidates]
+        points, candidates = points[unassigned], candidates[unassigned]
+        _, _, distances = WGS84_GEOD.inv(
+            longitudes[points],
+            latitudes[points],
+            self.longitudes[candidates],
+            self.latitudes[candidates],
+        )
+        within = distances < max_distance
+        points, candidates, distances = (
+            points[within],
+            candidates[within],
+            distances[within],
+        )
+
+        # Candidates of each point from closest to farthest, ties broken by index
+        order = np.lexsort((candidates, distances, points))
+        assigned = self.assigned
+        for point, candidate, residual in zip(
+            points[order].tolist(),
+            candidates[order].tolist(),
+            distances[order].tolist(),
+        ):
+            if images[point] < 0 and not assigned[candidate]:
+                images[point] = candidate
+                residuals[point] = residual
+                assigned[candidate] = True
+        return images, residuals
+
+    def assign(self, index: int) -> None:
+        """
+        Marks an image as assigned so it is no longer returned by nearest
+        Args:
+            index: Index of the image
+        """
+        self.assigned[index] = True
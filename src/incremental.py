@@ -0,0 +1,138 @@
+"""Manifest of the roads of a pipeline run, to only process the roads that changed in
+the next run.
+
+Each road is identified by its `osm_id` and hashed with its geometry and highway
+type. The points of the roads whose hash is unchanged are reused from the output of
+the previous run, with their images and GVI scores, and only the roads that were
+added or changed are sampled, assigned images and scored again.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+
+import geopandas as gpd
+import pandas as pd
+import shapely
+
+# Version of the format of the manifest, and of the hashes of the roads
+MANIFEST_VERSION = 1
+MANIFEST_SUFFIX = ".manifest.json"
+
+
+def manifest_path(output_file: Path) -> Path:
+    """Returns the path of the manifest of the run writing to `output_file`."""
+    return Path(output_file.parent, f"{output_file.name}{MANIFEST_SUFFIX}")
+
+
+def road_hashes(roads: gpd.GeoDataFrame) -> Dict[str, str]:
+    """Hashes the geometry and highway type of the roads of each OSM ID.
+
+    Geometries are hashed as WKB, so any change to their coordinates or to the
+    order of their vertices, which changes where points are sampled, changes the
+    hash. Features sharing an OSM ID are hashed together, in order.
+
+    Args:
+        roads (geopandas.GeoDataFrame): Road features with 'osm_id' and 'highway'
+            columns, as filtered for sampling.
+
+    Returns:
+        Dict[str, str]: Hash of the roads of each OSM ID.
+    """
+    digests = {}
+    wkbs = shapely.to_wkb(roads.geometry.to_numpy())
+    for osm_id, highway, wkb in zip(
+        roads["osm_id"].astype(str), roads["highway"].astype(str), wkbs
+    ):
+        digest = digests.setdefault(osm_id, hashlib.sha1())
+        digest.update(highway.encode())
+        digest.update(b"\x00" if wkb is None else wkb)
+    return {osm_id: digest.hexdigest() for osm_id, digest in digests.items()}
+
+
+def diff_roads(
+    previous: Dict[str, str], current: Dict[str, str]
+) -> Tuple[Set[str], Set[str]]:
+    """Compares the road hashes of two runs.
+
+    Args:
+        previous (Dict[str, str]): Road hashes of the previous run.
+        current (Dict[str, str]): Road hashes of this run.
+
+    Returns:
+        Tuple[Set[str], Set[str]]: OSM IDs of the roads that were added or changed,
+            and of the roads that were removed.
+    """
+    changed = {
+        osm_id for osm_id, digest in current.items() if previous.get(osm_id) != digest
+    }
+    removed = set(previous) - set(current)
+    return changed, removed
+
+
+def read_manifest(output_file: Path, options: dict) -> Optional[Dict[str, str]]:
+    """Reads the road hashes of the previous run writing to `output_file`.
+
+    Args:
+        output_file (Path): Output file of the run.
+        options (dict): Options changing the output of the run, that must be the
+            same as in the previous run for its output to be reused.
+
+    Returns:
+        Optional[Dict[str, str]]: The road hashes of the previous run, or None if
+            there is no previous run whose output can be reused.
+    """
+    path = manifest_path(output_file)
+    if not path.is_file() or not output_file.is_file():
+        return None
+    manifest = json.loads(path.read_text())
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    if manifest.get("options") != json.loads(json.dumps(options, default=str)):
+        return None
+    return manifest["roads"]
+
+
+def write_manifest(output_file: Path, hashes: Dict[str, str], options: dict) -> None:
+    """Writes the road hashes of a run next to its output, once it is written.
+
+    Args:
+        output_file (Path): Output file of the run.
+        hashes (Dict[str, str]): Road hashes of the run.
+        options (dict): Options changing the output of the run.
+    """
+    path = manifest_path(output_file)
+    part = Path(path.parent, f".{path.name}.part")
+    part.write_text(
+        json.dumps(
+            {"version": MANIFEST_VERSION, "options": options, "roads": hashes},
+            default=str,
+        )
+    )
+    os.replace(part, path)
+
+
+def merge_points(
+    kept: gpd.GeoDataFrame, added: gpd.GeoDataFrame, roads: gpd.GeoDataFrame
+) -> gpd.GeoDataFrame:
+    """Merges the points reused from a previous run with the points of the roads
+    processed again, in the order of the roads, as a full run would write them.
+
+    Args:
+        kept (geopandas.GeoDataFrame): Points of the unchanged roads.
+        added (geopandas.GeoDataFrame): Points of the roads added or changed.
+        roads (geopandas.GeoDataFrame): Road features of this run.
+
+    Returns:
+        geopandas.GeoDataFrame: The points of all roads.
+    """
+    order = pd.Series(roads["osm_id"].astype(str).unique())
+    position = pd.Series(order.index, index=order.to_numpy())
+    merged = pd.concat([kept, added.to_crs(kept.crs)], ignore_index=True)
+    # The points of each road stay in the order they were sampled in
+    merged = merged.iloc[
+        position[merged["osm_id"].astype(str)].to_numpy().argsort(kind="stable")
+    ]
+    return gpd.GeoDataFrame(merged.reset_index(drop=True), crs=kept.crs)
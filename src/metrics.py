@@ -0,0 +1,244 @@
+"""Timers and counters around the hot paths of the pipeline, written to a JSON file
+with --metrics-out"""
+
+from contextlib import contextmanager, nullcontext
+import cProfile
+from functools import wraps
+import json
+from pathlib import Path
+from threading import Lock
+import time
+from typing import Callable, Dict, Iterator, List, Optional, TypeVar
+
+from loguru import logger
+
+T = TypeVar("T")
+
+# Version of the format of the metrics file
+METRICS_VERSION = 1
+
+# Recording is off unless a stage is run with --metrics-out, and then timers and
+# counters are a flag check away from doing nothing
+_enabled = False
+_lock = Lock()
+# Number of calls and total seconds of each timer
+_timers: Dict[str, List[float]] = {}
+_counters: Dict[str, float] = {}
+_DISABLED = nullcontext()
+
+
+class _Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        seconds = time.perf_counter() - self.start
+        with _lock:
+            timer = _timers.setdefault(self.name, [0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+
+
+def enable(enabled: bool = True) -> None:
+    """
+    Turns recording of timers and counters on or off in this process
+    Args:
+        enabled: Whether to record them
+    """
+    global _enabled
+    _enabled = enabled
+
+
+def enabled() -> bool:
+    """
+    Returns: Whether timers and counters are recorded in this process
+    """
+    return _enabled
+
+
+def reset() -> None:
+    """
+    Forgets the timers and counters recorded so far
+    """
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def timer(name: str):
+    """
+    Times a block of code, adding its duration to the timer of that name
+    Args:
+        name: Name of the timer
+
+    Returns: A context manager timing its block, which does nothing if recording is
+        off
+
+    """
+    return _Timer(name) if _enabled else _DISABLED
+
+
+def timed(name: str) -> Callable[[Callable[..., T]], Callable[..., T]]:
+    """
+    Decorator timing each call of a function, as timer does for a block
+    Args:
+        name: Name of the timer
+
+    Returns: The decorator
+
+    """
+
+    def decorator(function: Callable[..., T]) -> Callable[..., T]:
+        @wraps(function)
+        def wrapper(*args, **kwargs) -> T:
+            if not _enabled:
+                return function(*args, **kwargs)
+            with _Timer(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name: str, value: float = 1) -> None:
+    """
+    Adds a value, such as a number of items or bytes, to the counter of that name
+    Args:
+        name: Name of the counter
+        value: Value to add
+    """
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def snapshot() -> dict:
+    """
+    Returns: The timers, with their number of calls and total seconds, and the
+        counters recorded so far. Timers of threads and processes running at the
+        same time add up, so they can exceed the wall time of the stage
+
+    """
+    with _lock:
+        return {
+            "timers": {
+                name: {"calls": int(calls), "seconds": seconds}
+                for name, (calls, seconds) in sorted(_timers.items())
+            },
+            "counters": dict(sorted(_counters.items())),
+        }
+
+
+def collect() -> Optional[dict]:
+    """
+    Takes the timers and counters recorded since the last call, for a worker process
+    to send them back to the main process with its results
+    Returns: The recorded timers and counters, or None if recording is off
+
+    """
+    if not _enabled:
+        return None
+    recorded = snapshot()
+    reset()
+    return recorded
+
+
+def merge(recorded: Optional[dict]) -> None:
+    """
+    Adds timers and counters collected in a worker process to those of this process
+    Args:
+        recorded: Timers and counters returned by collect, or None
+    """
+    if recorded is None:
+        return
+    with _lock:
+        for name, value in recorded["timers"].items():
+            timer = _timers.setdefault(name, [0, 0.0])
+            timer[0] += value["calls"]
+            timer[1] += value["seconds"]
+        for name, value in recorded["counters"].items():
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def merged(results: Iterator[tuple]) -> Iterator:
+    """
+    Merges the timers and counters sent back by worker processes along with their
+    results
+    Args:
+        results: Pairs of a result and the collected timers and counters
+
+    Returns: Iterator over the results
+
+    """
+    for result, recorded in results:
+        merge(recorded)
+        yield result
+
+
+@contextmanager
+def recording(
+    stage: str,
+    metrics_out: Optional[Path] = None,
+    profile_out: Optional[Path] = None,
+) -> Iterator[None]:
+    """
+    Records the timers and counters of a stage of the pipeline run in the block,
+    and writes them to a JSON file, and optionally profiles the stage
+    Args:
+        stage: Name of the stage
+        metrics_out: JSON file to write the timers and counters to, nothing is
+            recorded if None
+        profile_out: File to write cProfile statistics of the block to, readable
+            with pstats or snakeviz. Only this process is profiled
+    """
+    if metrics_out is None and profile_out is None:
+        yield
+        return
+    reset()
+    enable(metrics_out is not None)
+    profiler = cProfile.Profile() if profile_out is not None else None
+    start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        wall_seconds = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_out)
+            logger.info("Profile of {} written to: {}", stage, profile_out)
+        if metrics_out is not None:
+            write(metrics_out, stage, wall_seconds)
+            logger.info("Metrics of {} written to: {}", stage, metrics_out)
+        enable(False)
+
+
+def write(metrics_out: Path, stage: str, wall_seconds: float) -> None:
+    """
+    Writes the timers and counters recorded so far to a JSON file
+    Args:
+        metrics_out: JSON file to write to
+        stage: Name of the stage they were recorded in
+        wall_seconds: Wall time of the stage
+    """
+    metrics_out = Path(metrics_out)
+    metrics_out.parent.mkdir(parents=True, exist_ok=True)
+    metrics_out.write_text(
+        json.dumps(
+            {
+                "version": METRICS_VERSION,
+                "stage": stage,
+                "wall_seconds": wall_seconds,
+                **snapshot(),
+            },
+            indent=2,
+        )
+    )
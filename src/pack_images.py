@@ -0,0 +1,87 @@
+"""Convert a directory of JPEG images into a packed image store"""
+
+from pathlib import Path
+from typing import Annotated, Optional
+
+from loguru import logger as log
+from tqdm import tqdm
+from typer import Argument, Option, Typer
+
+from src.images.image_store import DEFAULT_PACK_SIZE, PackedImageStore
+
+# Number of images indexed per transaction
+DEFAULT_BATCH_SIZE = 256
+
+app = Typer()
+
+
+@app.command()
+def main(
+    images_path: Annotated[Path, Argument(help="Directory of the JPEG images to pack")],
+    store_path: Annotated[
+        Optional[Path],
+        Argument(help="Directory of the packed store, the images directory if not set"),
+    ] = None,
+    delete: Annotated[
+        bool,
+        Option(help="Delete each image file once it is packed"),
+    ] = False,
+    pack_size: Annotated[
+        int,
+        Option(min=1, help="Size after which a new pack file is started, in bytes"),
+    ] = DEFAULT_PACK_SIZE,
+) -> int:
+    """
+    Packs the JPEG images of a directory into a packed image store, with the file
+    name of each image, without extension, as its ID. Images already in the store
+    are skipped, so an interrupted conversion can be run again
+    Args:
+        images_path: Directory of the JPEG images to pack
+        store_path: Directory of the packed store, the images directory if not set
+        delete: Delete each image file once it is packed
+        pack_size: Size after which a new pack file is started, in bytes
+
+    Returns: The number of images packed
+
+    """
+    if store_path is None:
+        store_path = images_path
+    image_files = sorted(
+        set().union(images_path.glob("**/*.jpg")).union(images_path.glob("**/*.jpeg"))
+    )
+    if len(image_files) == 0:
+        raise FileNotFoundError(f"No Images Found In Path: {images_path}")
+
+    store = PackedImageStore(store_path, pack_size=pack_size)
+    packed = store.image_ids()
+    batch = []
+    count = 0
+    try:
+        for image_file in tqdm(image_files, desc="Packing Images", unit="images"):
+            if image_file.stem in packed:
+                log.debug("Image Already Packed: {}", image_file)
+            else:
+                batch.append(image_file)
+                packed.add(image_file.stem)
+            if len(batch) >= DEFAULT_BATCH_SIZE:
+                count += _pack_batch(store, batch, delete)
+                batch = []
+        count += _pack_batch(store, batch, delete)
+    finally:
+        store.close()
+    log.success("Packed {} Images To {}", count, store_path)
+    return count
+
+
+def _pack_batch(store: PackedImageStore, image_files: list, delete: bool) -> int:
+    store.put_many(
+        (image_file.stem, image_file.read_bytes()) for image_file in image_files
+    )
+    if delete:
+        for image_file in image_files:
+            image_file.unlink()
+    return len(image_files)
+
+
+if __name__ == "__main__":
+    app()
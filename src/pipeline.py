@@ -0,0 +1,347 @@
+"""Run create_points, assign_images and assign_gvi_to_points in one process.
+
+Points are passed from one step to the next in memory instead of through files, and
+libraries are imported once. The options of each step are read from the section of
+the config file named after the step, the same sections that the steps read when
+they are run on their own with --config.
+
+With --incremental, only the roads added or changed since the previous run writing
+to the same output file are processed, and the points of the other roads are reused
+from its output. The intermediate points files then hold the points of all roads,
+as in a full run.
+"""
+
+from inspect import Parameter, signature
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+try:
+    from typing import Annotated
+except ImportError:
+    # For Python <3.9
+    from typing_extensions import Annotated
+
+import geopandas as gpd
+from loguru import logger
+import typer
+from typer_config.loaders import toml_loader
+
+from src import assign_gvi_to_points, assign_images, create_points, metrics
+from src.images.image_source import RESULT_COLUMNS, ImageSourceSelector
+from src.incremental import (
+    diff_roads,
+    merge_points,
+    read_manifest,
+    road_hashes,
+    write_manifest,
+)
+
+app = typer.Typer()
+
+# Options of each step that change its output, so that the output of a previous run
+# with different values cannot be reused by an incremental run
+RESULT_OPTIONS = {
+    "create_points": ("mini_dist", "drop_null", "highway_types"),
+    "assign_images": (
+        "max_distance",
+        "dedup",
+        "dedup_distance",
+        "dedup_hash_distance",
+        # Searching images per point or per tile can match points to other images
+        "prefetch",
+        "score",
+        "scale",
+    ),
+    "assign_gvi_to_points": ("scale",),
+}
+
+
+def stage_options(config: dict, stage: str, function: Callable, command: Callable):
+    """Returns the options of a step in its section of the config, as keyword
+    arguments of the in-memory function of the step.
+
+    Options of the step's command that do not apply when points are passed in
+    memory, such as its input and output files, are ignored with a warning.
+
+    Args:
+        config (dict): Parsed config file.
+        stage (str): Name of the step, and of its section in the config.
+        function (Callable): In-memory function of the step.
+        command (Callable): Command of the step, reading the same section.
+
+    Returns:
+        dict: Keyword arguments for `function`.
+
+    Raises:
+        typer.BadParameter: If an option is not an option of the step.
+    """
+    command_parameters = signature(command).parameters
+    parameters = {
+        name
+        for name, parameter in signature(function).parameters.items()
+        if parameter.default is not Parameter.empty and name in command_parameters
+    }
+    options = {}
+    for name, value in config.get(stage, {}).items():
+        if name in parameters:
+            # Paths are strings in TOML
+            if name.endswith("_path"):
+                value = Path(value)
+            options[name] = value
+        elif name in command_parameters:
+            logger.warning("Option {} of [{}] is not used by the pipeline", name, stage)
+        else:
+            raise typer.BadParameter(
+                f"Unknown option {name} in [{stage}]", param_hint="--config"
+            )
+    return options
+
+
+def result_options(stage_functions: dict, options: dict) -> dict:
+    """Returns the value of the options of each step that change its output,
+    whether they are set in the config or left to their defaults.
+
+    Args:
+        stage_functions (dict): In-memory function of each step, by name.
+        options (dict): Options of each step in the config, by name of the step.
+
+    Returns:
+        dict: Values of the options listed in RESULT_OPTIONS, by step.
+    """
+    values = {}
+    for stage, names in RESULT_OPTIONS.items():
+        parameters = signature(stage_functions[stage]).parameters
+        values[stage] = {
+            name: options[stage].get(name, parameters[name].default) for name in names
+        }
+    return values
+
+
+def run_steps(
+    roads: gpd.GeoDataFrame,
+    image_source: ImageSourceSelector,
+    images_path: Path,
+    output_file: Path,
+    options: dict,
+    points_file: Optional[Path] = None,
+    images_file: Optional[Path] = None,
+    exclude_images: Iterable[str] = (),
+) -> gpd.GeoDataFrame:
+    """Samples points along roads, assigns images to them and scores the images.
+
+    Args:
+        roads (geopandas.GeoDataFrame): OpenStreetMap road features.
+        image_source (ImageSourceSelector): Where to get images from.
+        images_path (Path): Where the images should be located.
+        output_file (Path): File the points will be written to.
+        options (dict): Options of each step, by name of the step.
+        points_file (Path): File to also write the sampled points to.
+        images_file (Path): File to also write the points and their images to.
+        exclude_images (Iterable[str]): IDs of images already assigned to other
+            points, that are not assigned again.
+
+    Returns:
+        geopandas.GeoDataFrame: The points, with their images and GVI scores.
+    """
+    with metrics.timer("create_points"):
+        gdf = create_points.points_from_roads(roads, **options["create_points"])
+    logger.info("{} points sampled from the roads", len(gdf))
+    write_points(gdf, points_file, "Points")
+
+    with metrics.timer("assign_images"):
+        gdf = assign_images.assign_images_to_points(
+            gdf,
+            image_source,
+            images_path,
+            exclude_images=exclude_images,
+            **options["assign_images"],
+        )
+    write_points(gdf, images_file, "Points and images")
+
+    # Images are already scored if assign_images scored them as assigned
+    if "gvi_score" not in gdf:
+        with metrics.timer("assign_gvi_to_points"):
+            gdf = assign_gvi_to_points.assign_gvi_scores(
+                gdf, images_path, output_file, **options["assign_gvi_to_points"]
+            )
+    return gdf
+
+
+def write_points(gdf: gpd.GeoDataFrame, points_file: Optional[Path], name: str):
+    """Writes the points of an intermediate step, if a file is given for them."""
+    if points_file is None:
+        return
+    with metrics.timer("to_file"):
+        gdf.to_file(points_file)
+    logger.info("{} written to: {}", name, points_file)
+
+
+def write_merged_steps(
+    gdf: gpd.GeoDataFrame,
+    options: dict,
+    points_file: Optional[Path] = None,
+    images_file: Optional[Path] = None,
+):
+    """Writes the points of the intermediate steps of an incremental run, from the
+    merged points of all roads, so that they hold the same points as in a full run.
+
+    Args:
+        gdf (geopandas.GeoDataFrame): The points of all roads, with their images
+            and GVI scores.
+        options (dict): Options of each step, by name of the step.
+        points_file (Path): File to write the sampled points to.
+        images_file (Path): File to write the points and their images to.
+    """
+    # assign_images only returns GVI scores if it scored the images
+    scored = options["assign_images"].get("score", False)
+    images = gdf if scored else gdf.drop(columns="gvi_score")
+    write_points(images, images_file, "Points and images")
+    points = gdf.drop(columns=[*RESULT_COLUMNS, "gvi_score"])
+    write_points(points, points_file, "Points")
+
+
+@app.command()
+def main(
+    roads_file: Annotated[
+        Path,
+        typer.Argument(help="Path to input OpenStreetMap roads data file."),
+    ],
+    image_source: Annotated[
+        ImageSourceSelector, typer.Argument(help="Where to get images from.")
+    ],
+    images_path: Annotated[
+        Path, typer.Argument(help="Where the images should be located.")
+    ],
+    output_file: Annotated[
+        Path,
+        typer.Argument(help="File to write the points and their GVI scores to."),
+    ],
+    config: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="TOML config file with the options of each step, in its "
+            "[create_points], [assign_images] and [assign_gvi_to_points] section."
+        ),
+    ] = None,
+    points_file: Annotated[
+        Optional[Path],
+        typer.Option(help="Also write the points sampled from the roads here."),
+    ] = None,
+    images_file: Annotated[
+        Optional[Path],
+        typer.Option(help="Also write the points and their images here."),
+    ] = None,
+    metrics_out: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="Write the time spent in each step and in its hot paths, and "
+            "counters, to this JSON file."
+        ),
+    ] = None,
+    incremental: Annotated[
+        bool,
+        typer.Option(
+            help="Only process the roads added or changed since the previous "
+            "incremental run writing to the same output file, and reuse the points, "
+            "images and GVI scores of the other roads from its output."
+        ),
+    ] = False,
+    profile: Annotated[
+        Optional[Path],
+        typer.Option(
+            help="Write cProfile statistics of the run to this file. Worker "
+            "processes are not profiled."
+        ),
+    ] = None,
+):
+    """Sample points along roads, assign images to them and score the images, in
+    one process."""
+    config = toml_loader(config) if config is not None else {}
+    stage_functions = {
+        "create_points": create_points.points_from_roads,
+        "assign_images": assign_images.assign_images_to_points,
+        "assign_gvi_to_points": assign_gvi_to_points.assign_gvi_scores,
+    }
+    stage_commands = {
+        "create_points": create_points.main,
+        "assign_images": assign_images.main,
+        "assign_gvi_to_points": assign_gvi_to_points.main,
+    }
+    options = {
+        stage: stage_options(config, stage, function, stage_commands[stage])
+        for stage, function in stage_functions.items()
+    }
+
+    with metrics.recording("pipeline", metrics_out, profile):
+        logger.info("Loading road features from: {}", roads_file)
+        with metrics.timer("read_file"):
+            roads = gpd.read_file(roads_file)
+        changed_roads = roads
+        kept = None
+        if incremental:
+            selection = options["create_points"].copy()
+            selection.pop("mini_dist", None)
+            roads = create_points.select_roads(roads, **selection)
+            changed_roads = roads
+            hashes = road_hashes(roads)
+            run_options = result_options(stage_functions, options)
+            run_options["image_source"] = image_source.value
+            run_options["images_path"] = str(images_path.resolve())
+            previous = read_manifest(output_file, run_options)
+            if previous is None:
+                logger.info("No previous run with the same options: all roads are new")
+            else:
+                changed, removed = diff_roads(previous, hashes)
+                logger.info(
+                    "{} roads unchanged, {} added or changed, {} removed",
+                    len(hashes) - len(changed),
+                    len(changed),
+                    len(removed),
+                )
+                metrics.count("roads_reused", len(hashes) - len(changed))
+                # Points of the unchanged roads are reused from the previous output
+                with metrics.timer("read_file"):
+                    kept = gpd.read_file(output_file)
+                kept = kept[~kept["osm_id"].astype(str).isin(changed | removed)]
+                changed_roads = roads[roads["osm_id"].astype(str).isin(changed)]
+        metrics.count("roads_processed", changed_roads["osm_id"].nunique())
+
+        if kept is None:
+            gdf = run_steps(
+                changed_roads,
+                image_source,
+                images_path,
+                output_file,
+                options,
+                points_file=points_file,
+                images_file=images_file,
+            )
+        else:
+            if len(changed_roads) == 0:
+                gdf = kept
+            else:
+                gdf = run_steps(
+                    changed_roads,
+                    image_source,
+                    images_path,
+                    output_file,
+                    options,
+                    # Images of the kept points stay theirs
+                    exclude_images=kept["image_id"].dropna().astype(str).tolist(),
+                )
+                gdf = merge_points(kept, gdf, roads)
+            # Intermediate files hold the points of all roads, not only of the
+            # roads processed in this run
+            write_merged_steps(gdf, options, points_file, images_file)
+        del roads, changed_roads, kept
+
+        with metrics.timer("to_file"):
+            gdf.to_file(output_file)
+        if incremental:
+            # Only written once the output is, so that it always describes it
+            write_manifest(output_file, hashes, run_options)
+        logger.success("Points and GVI scores written to: {}", output_file)
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,199 @@
+"""Persistent cache of GVI scores, keyed by image content"""
+
+import hashlib
+from pathlib import Path
+import time
+from typing import Iterable, Optional, Tuple
+
+from src import metrics
+from src.sidecar import open_sidecar
+
+DEFAULT_MAX_SIZE_MB = 256.0
+# Bytes taken by a score besides its digest and parameters, which are stored both
+# in the table and in its primary key index
+ENTRY_OVERHEAD = 48
+# Once full, the cache is evicted down to this fraction of its maximum size, so
+# that it is not evicted again on every new batch of scores
+EVICT_TO = 0.9
+# Bytes of an image read at a time to hash it
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def file_digest(path: str) -> str:
+    """
+    Hashes the content of a file, a block at a time
+    Args:
+        path: Path of the file
+
+    Returns: The SHA-256 digest of the file, in hexadecimal
+
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def content_digest(content: bytes) -> str:
+    """
+    Hashes the content of a file held in memory, as file_digest does for a file
+    Args:
+        content: Content of the file
+
+    Returns: The SHA-256 digest of the content, in hexadecimal
+
+    """
+    return hashlib.sha256(content).hexdigest()
+
+
+class ScoreCache:
+    """
+    SQLite cache of GVI scores, keyed by the SHA-256 digest of the image file and
+    by the scoring method, version and parameters, so that an image is scored
+    again only if its content or the way it is scored changed. Several processes
+    can use the same cache at the same time. Once its scores take more than the
+    maximum size, the least recently used ones are evicted as new ones are put.
+    Hits and misses are counted by the caller, as lookups can be made by other
+    processes
+    """
+
+    filename = ".gvi_cache.sqlite"
+    schema_version = 1
+
+    def __init__(self, path: Path, max_size_mb: float = DEFAULT_MAX_SIZE_MB) -> None:
+        """
+        All Args Constructor
+        Args:
+            path: File of the cache
+            max_size_mb: Maximum size of the cached scores, in megabytes
+        """
+        self.path = path
+        self.max_size_mb = max_size_mb
+        self.max_size = int(max_size_mb * 1_000_000)
+        self.hits = 0
+        self.misses = 0
+        # Number of scores evicted by this process
+        self.evicted = 0
+
+        self.connection = open_sidecar(
+            self.path,
+            [
+                """
+                CREATE TABLE IF NOT EXISTS scores (
+                    digest TEXT NOT NULL,
+                    parameters TEXT NOT NULL,
+                    gvi_score REAL NOT NULL,
+                    accessed REAL NOT NULL,
+                    PRIMARY KEY (digest, parameters)
+                )
+                """,
+                "CREATE INDEX IF NOT EXISTS scores_accessed ON scores (accessed)",
+            ],
+            self.schema_version,
+            # Several processes read and write the cache at the same time
+            wal=True,
+        )
+        # Size of the cached scores, kept up to date by put
+        self.size = self._total_size()
+
+    def __getstate__(self) -> dict:
+        # Worker processes open their own connection to the cache
+        return {"path": self.path, "max_size_mb": self.max_size_mb}
+
+    def __setstate__(self, state: dict) -> None:
+        self.__init__(state["path"], state["max_size_mb"])
+
+    def _total_size(self) -> int:
+        (total,) = self.connection.execute(
+            "SELECT COALESCE(SUM(2 * (length(digest) + length(parameters)) + ?), 0) "
+            "FROM scores",
+            (ENTRY_OVERHEAD,),
+        ).fetchone()
+        return total
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def get(self, digest: str, parameters: str) -> Optional[float]:
+        """
+        Gets a cached score
+        Args:
+            digest: Digest of the image file, as returned by file_digest
+            parameters: Scoring method, version and parameters
+
+        Returns: The GVI score of the image, or None if it is not cached
+
+        """
+        row = self.connection.execute(
+            "SELECT gvi_score FROM scores WHERE digest = ? AND parameters = ?",
+            (digest, parameters),
+        ).fetchone()
+        if row is None:
+            return None
+        with self.connection:
+            self.connection.execute(
+                "UPDATE scores SET accessed = ? WHERE digest = ? AND parameters = ?",
+                (time.time(), digest, parameters),
+            )
+        return row[0]
+
+    def put(self, scores: Iterable[Tuple[str, str, float]]) -> None:
+        """
+        Caches a batch of scores, then evicts the least recently used scores if
+        the cache takes more than its maximum size
+        Args:
+            scores: (Digest, parameters, GVI score) of each image
+        """
+        now = time.time()
+        rows = [
+            (digest, parameters, score, now) for digest, parameters, score in scores
+        ]
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)", rows
+            )
+        # Replaced scores are counted twice, until the size is summed again
+        self.size += sum(
+            2 * (len(digest) + len(parameters)) + ENTRY_OVERHEAD
+            for digest, parameters, _, _ in rows
+        )
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Evicts the least recently used scores, down to EVICT_TO of the maximum
+        size, if the cache takes more than it
+
+        Returns: Number of scores evicted
+
+        """
+        with self.connection:
+            # Other processes sharing the cache may have added or evicted scores
+            self.size = self._total_size()
+            if self.size <= self.max_size:
+                return 0
+            excess = self.size - EVICT_TO * self.max_size
+            evicted = 0
+            for (size,) in self.connection.execute(
+                "SELECT 2 * (length(digest) + length(parameters)) + ? FROM scores "
+                "ORDER BY accessed",
+                (ENTRY_OVERHEAD,),
+            ):
+                if excess <= 0:
+                    break
+                excess -= size
+                self.size -= size
+                evicted += 1
+            self.connection.execute(
+                """
+                DELETE FROM scores WHERE rowid IN (
+                    SELECT rowid FROM scores ORDER BY accessed LIMIT ?
+                )
+                """,
+                (evicted,),
+            )
+        self.evicted += evicted
+        metrics.count("score_cache.evicted", evicted)
+        return evicted
@@ -0,0 +1,98 @@
+"""Durable journal of GVI scores, written while images are being scored"""
+
+from pathlib import Path
+from typing import Iterable, Set, Tuple
+
+from loguru import logger
+import pandas as pd
+
+from src.sidecar import open_sidecar
+
+
+class ScoreJournal:
+    """
+    SQLite journal of the GVI score of each image, stored next to the output file.
+    Scores are appended in batches, each in its own transaction, so that the
+    scores of the batches written before a crash are kept and do not have to be
+    calculated again when resuming. Scores calculated with other scoring
+    parameters, such as another scale, are discarded when resuming
+    """
+
+    suffix = ".journal.sqlite"
+    schema_version = 3
+
+    def __init__(
+        self, output_file: Path, parameters: str, resume: bool = False
+    ) -> None:
+        """
+        All Args Constructor
+        Args:
+            output_file: File the scores will be written to once all are calculated
+            parameters: Scoring method, version and parameters of the scores
+            resume: Keep the scores of an existing journal calculated with the same
+                parameters, instead of starting from an empty one
+        """
+        self.path = Path(output_file.parent, f"{output_file.name}{self.suffix}")
+        if not resume:
+            self.path.unlink(missing_ok=True)
+
+        self.connection = open_sidecar(
+            self.path,
+            [
+                """
+                CREATE TABLE IF NOT EXISTS scores (
+                    image_id TEXT PRIMARY KEY,
+                    gvi_score REAL NOT NULL
+                )
+                """,
+                "CREATE TABLE IF NOT EXISTS parameters (value TEXT NOT NULL)",
+            ],
+            self.schema_version,
+        )
+        row = self.connection.execute("SELECT value FROM parameters").fetchone()
+        if row is not None and row[0] != parameters:
+            logger.warning(
+                "Journaled scores were calculated with {}, not {}: scoring all "
+                "images again",
+                row[0],
+                parameters,
+            )
+            row = None
+        if row is None:
+            with self.connection:
+                self.connection.execute("DELETE FROM scores")
+                self.connection.execute("DELETE FROM parameters")
+                self.connection.execute(
+                    "INSERT INTO parameters VALUES (?)", (parameters,)
+                )
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def scored(self) -> Set[str]:
+        """
+        Returns: The IDs of the images that already have a score
+        """
+        return {
+            row[0] for row in self.connection.execute("SELECT image_id FROM scores")
+        }
+
+    def append(self, scores: Iterable[Tuple[str, float]]) -> None:
+        """
+        Durably writes a batch of scores
+        Args:
+            scores: (Image ID, GVI score) of each image
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO scores VALUES (?, ?)", scores
+            )
+
+    def read(self) -> pd.DataFrame:
+        """
+        Returns: The image ID and GVI score of every image in the journal, sorted
+            by image ID
+        """
+        return pd.read_sql_query(
+            "SELECT image_id, gvi_score FROM scores ORDER BY image_id", self.connection
+        )
@@ -0,0 +1,332 @@
+"""Split a points file into spatial shards, process the shards on several workers,
+and merge their outputs.
+
+Points are partitioned into the tiles of a fixed grid, in degrees. Each shard also
+holds the points of neighboring tiles within a margin of its tile, so that images
+near tile edges are assigned knowing about the points on both sides. Shards are
+listed in a manifest, and workers claim them by atomically creating a claim file
+in a directory shared by all workers, so they can run on several machines with
+shared storage.
+"""
+
+import json
+import os
+from pathlib import Path
+import socket
+import time
+from typing import Iterator, List, Optional
+
+try:
+    from typing import Annotated
+except ImportError:
+    # For Python <3.9
+    from typing_extensions import Annotated
+
+import geopandas as gpd
+from loguru import logger
+import numpy as np
+import pandas as pd
+import typer
+
+from src import assign_images
+from src.images.image_source import ImageSourceSelector
+from src.images.mapillary import DEFAULT_CONCURRENCY
+
+DEFAULT_TILE_SIZE = 0.05  # degrees
+DEFAULT_MARGIN = 50.0  # meters
+MANIFEST = "manifest.json"
+CLAIMS = "claims"
+DONE = "done"
+
+app = typer.Typer()
+
+
+def shard_tiles(gdf: gpd.GeoDataFrame, tile_size: float, margin: float) -> pd.DataFrame:
+    """Returns the tiles of a grid that each point belongs to.
+
+    A point belongs to the tile it is in, its core tile, and to every tile that is
+    within margin meters of it.
+
+    Args:
+        gdf (gpd.GeoDataFrame): points, in a geographic CRS
+        tile_size (float): width and height of the tiles, in degrees
+        margin (float): distance in meters within which points of neighboring
+            tiles are included in a shard
+
+    Returns:
+        pd.DataFrame: one row per point and tile, with the position of the point
+            in gdf, the column and row of the tile, and whether it is the core tile
+            of the point
+    """
+    latitudes = gdf.geometry.y.to_numpy()
+    longitudes = gdf.geometry.x.to_numpy()
+    lat_margin = margin / 111_111
+    lon_margin = lat_margin / np.cos(np.radians(np.abs(latitudes)))
+    positions = np.arange(len(gdf))
+    core = pd.DataFrame(
+        {
+            "position": positions,
+            "column": np.floor(longitudes / tile_size).astype(int),
+            "row": np.floor(latitudes / tile_size).astype(int),
+            "core": True,
+        }
+    )
+    edges = [
+        pd.DataFrame(
+            {
+                "position": positions,
+                "column": np.floor(
+                    (longitudes + lon_sign * lon_margin) / tile_size
+                ).astype(int),
+                "row": np.floor((latitudes + lat_sign * lat_margin) / tile_size).astype(
+                    int
+                ),
+                "core": False,
+            }
+        )
+        for lon_sign in (-1, 1)
+        for lat_sign in (-1, 1)
+    ]
+    # Core rows come first, so they are the ones kept for the core tile
+    return pd.concat([core] + edges, ignore_index=True).drop_duplicates(
+        ["position", "column", "row"]
+    )
+
+
+def split_points(
+    points_file: Path,
+    shards_dir: Path,
+    tile_size: float = DEFAULT_TILE_SIZE,
+    margin: float = DEFAULT_MARGIN,
+) -> List[str]:
+    """Splits a points file into shards, and writes the manifest listing them.
+
+    Each shard is written to `<shards_dir>/<name>.gpkg`, with a `point_id` column
+    giving the position of each point in the points file, and a `shard_core`
+    column telling whether the shard is the one the point belongs to.
+
+    Args:
+        points_file (Path): points file to split
+        shards_dir (Path): directory to write the shards and the manifest to
+        tile_size (float): width and height of the tiles, in degrees
+        margin (float): distance in meters within which points of neighboring
+            tiles are included in a shard
+
+    Returns:
+        List[str]: names of the shards
+    """
+    gdf = gpd.read_file(points_file).to_crs("EPSG:4326")
+    gdf["point_id"] = np.arange(len(gdf))
+    tiles = shard_tiles(gdf, tile_size, margin)
+
+    shards_dir.mkdir(parents=True, exist_ok=True)
+    names = []
+    for (column, row), members in tiles.groupby(["column", "row"]):
+        if not members["core"].any():
+            # Only points of neighboring tiles, which their own shards cover
+            continue
+        # Points keep their order, so images are assigned the same way in every
+        # shard that has them
+        members = members.sort_values("position")
+        name = f"shard_{column}_{row}"
+        shard = gdf.iloc[members["position"].to_numpy()].copy()
+        shard["shard_core"] = members["core"].to_numpy()
+        shard.to_file(Path(shards_dir, f"{name}.gpkg"), driver="GPKG")
+        names.append(name)
+
+    manifest = {
+        "points_file": str(points_file),
+        "tile_size": tile_size,
+        "margin": margin,
+        "shards": names,
+    }
+    Path(shards_dir, MANIFEST).write_text(json.dumps(manifest, indent=2))
+    logger.info("Split {} points into {} shards", len(gdf), len(names))
+    return names
+
+
+def claim_shards(shards_dir: Path) -> Iterator[str]:
+    """Claims the shards of a manifest that no other worker has claimed, one at a
+    time.
+
+    A shard is claimed by creating `claims/<name>` exclusively, which only one
+    worker can do, even on shared storage. The claim file records the host and
+    process of the worker. A shard whose worker failed stays claimed but not done,
+    and is claimed again once its claim file is deleted.
+
+    Args:
+        shards_dir (Path): directory of the shards and the manifest
+
+    Returns:
+        Iterator[str]: names of the shards claimed by this worker
+    """
+    manifest = json.loads(Path(shards_dir, MANIFEST).read_text())
+    claims = Path(shards_dir, CLAIMS)
+    claims.mkdir(exist_ok=True)
+    for name in manifest["shards"]:
+        try:
+            claim = os.open(Path(claims, name), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            continue
+        with os.fdopen(claim, "w") as claim_file:
+            claim_file.write(f"{socket.gethostname()} {os.getpid()} {time.time()}\n")
+        yield name
+
+
+def mark_done(shards_dir: Path, name: str) -> None:
+    done = Path(shards_dir, DONE)
+    done.mkdir(exist_ok=True)
+    Path(done, name).touch()
+
+
+def merge_shards(shards_dir: Path, output_file: Path) -> gpd.GeoDataFrame:
+    """Merges the outputs of the shards of a manifest into one file.
+
+    Each point is taken from the shard it belongs to. Shards assign images
+    independently, so an image near a tile edge can be assigned to points of two
+    shards: it is then kept for the closest point only, and the others are left
+    without an image, with a `DuplicateImage` error.
+
+    Args:
+        shards_dir (Path): directory of the shards and the manifest
+        output_file (Path): file to write the merged points to
+
+    Returns:
+        gpd.GeoDataFrame: the merged points, in the order of the points file
+    """
+    manifest = json.loads(Path(shards_dir, MANIFEST).read_text())
+    missing = [
+        name for name in manifest["shards"] if not Path(shards_dir, DONE, name).exists()
+    ]
+    if len(missing) > 0:
+        raise Exception(f"{len(missing)} shards are not done: {missing}")
+
+    outputs = []
+    for name in manifest["shards"]:
+        shard = gpd.read_file(Path(shards_dir, f"{name}_images.gpkg"))
+        outputs.append(shard[shard["shard_core"].astype(bool)])
+    gdf = pd.concat(outputs, ignore_index=True).sort_values("point_id")
+
+    # Keep each image for its closest point
+    assigned = gdf[gdf["image_id"].notna()].sort_values(["residual", "point_id"])
+    duplicates = assigned.index[assigned["image_id"].duplicated()]
+    image_columns = ["image_id", "image_lat", "image_lon", "residual", "image_path"]
+    if "gvi_score" in gdf:
+        image_columns.append("gvi_score")
+    gdf.loc[duplicates, image_columns] = None
+    gdf.loc[duplicates, "error"] = "DuplicateImage"
+    if len(duplicates) > 0:
+        logger.info("Unassigned {} images assigned in two shards", len(duplicates))
+
+    gdf = gpd.GeoDataFrame(
+        gdf.drop(columns=["point_id", "shard_core"]).reset_index(drop=True),
+        crs=outputs[0].crs,
+    )
+    gdf.to_file(output_file)
+    return gdf
+
+
+@app.command()
+def split(
+    points_file: Annotated[Path, typer.Argument(help="Path to input points file.")],
+    shards_dir: Annotated[
+        Path, typer.Argument(help="Directory to write the shards and manifest to.")
+    ],
+    tile_size: Annotated[
+        float, typer.Option(help="Width and height of the tiles, in degrees.")
+    ] = DEFAULT_TILE_SIZE,
+    margin: Annotated[
+        float,
+        typer.Option(
+            help="Distance in meters within which points of neighboring tiles are "
+            "included in a shard."
+        ),
+    ] = DEFAULT_MARGIN,
+):
+    """Split a points file into spatial shards for several workers."""
+    split_points(points_file, shards_dir, tile_size=tile_size, margin=margin)
+
+
+@app.command()
+def work(
+    shards_dir: Annotated[
+        Path, typer.Argument(help="Directory of the shards and manifest.")
+    ],
+    image_source: Annotated[
+        ImageSourceSelector, typer.Argument(help="Where to get images from.")
+    ],
+    images_path: Annotated[
+        Path, typer.Argument(help="Where the images should be located.")
+    ],
+    max_distance: Annotated[
+        float,
+        typer.Option(help="Maximum distance between point and image, in meters."),
+    ] = 10,
+    prefetch: Annotated[
+        bool,
+        typer.Option(help="MAPILLARY only: prefetch image metadata for each shard."),
+    ] = False,
+    concurrency: Annotated[
+        int,
+        typer.Option(min=1, help="MAPILLARY only: maximum concurrent requests."),
+    ] = DEFAULT_CONCURRENCY,
+    score_workers: Annotated[
+        int, typer.Option(min=1, help="Number of processes scoring images.")
+    ] = 1,
+    scale: Annotated[
+        int, typer.Option(help="Decode images at 1/scale of their size.")
+    ] = 1,
+    keep_images: Annotated[
+        bool,
+        typer.Option(help="MAPILLARY only: write downloaded images to disk."),
+    ] = True,
+    packed: Annotated[
+        bool,
+        typer.Option(help="MAPILLARY only: keep images in a packed image store."),
+    ] = False,
+    max_shards: Annotated[
+        Optional[int],
+        typer.Option(min=1, help="Stop after this many shards."),
+    ] = None,
+):
+    """Claim shards that no other worker has claimed, and assign and score images
+    for each of them, until there are none left."""
+    processed = 0
+    for name in claim_shards(shards_dir):
+        logger.info("Processing shard {}", name)
+        assign_images.main(
+            Path(shards_dir, f"{name}.gpkg"),
+            image_source,
+            images_path,
+            max_distance=max_distance,
+            prefetch=prefetch,
+            concurrency=concurrency,
+            score=True,
+            score_workers=score_workers,
+            scale=scale,
+            keep_images=keep_images,
+            packed=packed,
+        )
+        mark_done(shards_dir, name)
+        processed += 1
+        if max_shards is not None and processed >= max_shards:
+            break
+    logger.success("Processed {} shards", processed)
+
+
+@app.command()
+def merge(
+    shards_dir: Annotated[
+        Path, typer.Argument(help="Directory of the shards and manifest.")
+    ],
+    output_file: Annotated[
+        Path, typer.Argument(help="File to write the merged points to.")
+    ],
+):
+    """Merge the outputs of all shards, once they are all done."""
+    gdf = merge_shards(shards_dir, output_file)
+    logger.success("Merged {} points to {}", len(gdf), output_file)
+
+
+if __name__ == "__main__":
+    app()
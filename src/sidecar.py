@@ -0,0 +1,52 @@
+"""SQLite files kept next to the data they describe: the indexes, caches and journals
+of the pipeline"""
+
+from pathlib import Path
+import sqlite3
+from typing import Iterable
+
+# Seconds to wait for another process, such as a shard worker, to release its lock
+# on a sidecar file
+TIMEOUT = 60
+
+
+def open_sidecar(
+    path: Path,
+    schema: Iterable[str],
+    schema_version: int,
+    check_same_thread: bool = True,
+    wal: bool = False,
+) -> sqlite3.Connection:
+    """
+    Opens a sidecar SQLite file, creating its tables if needed. Tables written with
+    another version of the schema are dropped, their content is lost
+    Args:
+        path: Path of the file
+        schema: CREATE TABLE and CREATE INDEX statements of the tables, with
+            IF NOT EXISTS
+        schema_version: Version of the schema, to increment whenever it, or the
+            meaning of what is stored, changes
+        check_same_thread: Only allow the connection to be used by the thread
+            that opened it. Callers sharing it between threads serialize access
+        wal: Use write-ahead logging, so that readers do not block the writer
+
+    Returns: The connection to the file
+
+    """
+    connection = sqlite3.connect(
+        path, check_same_thread=check_same_thread, timeout=TIMEOUT
+    )
+    if wal:
+        connection.execute("PRAGMA journal_mode = WAL")
+    with connection:
+        if connection.execute("PRAGMA user_version").fetchone()[0] != schema_version:
+            tables = connection.execute(
+                "SELECT name FROM sqlite_master "
+                "WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+            ).fetchall()
+            for (table,) in tables:
+                connection.execute(f'DROP TABLE IF EXISTS "{table}"')
+            connection.execute(f"PRAGMA user_version = {schema_version}")
+        for statement in schema:
+            connection.execute(statement)
+    return connection
@@ -1,6 +1,27 @@
+from pathlib import Path
+import time
+
+import cv2
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely.geometry import Point
 from typer.testing import CliRunner
 
-from src.assign_gvi_to_points import app
+from benchmarks.synthetic import write_geotagged_jpeg
+import src.assign_gvi_to_points
+from src.assign_gvi_to_points import (
+    app,
+    get_gvi_score,
+    get_gvi_score_float,
+    score_images,
+    score_parameters,
+    score_results,
+)
+from src.images.exif import GpsIndex
+from src.images.response_cache import ResponseCache
+from src.score_cache import ENTRY_OVERHEAD, ScoreCache
+from src.score_journal import ScoreJournal
 
 runner = CliRunner(mix_stderr=False)
 
@@ -14,3 +35,269 @@ def test_help():
         "Calculate Green View Index (GVI) scores for a dataset of street-level images."
         in result.output
     )
+
+
+def test_skips_caches(tmp_path):
+    """Files other than images in the images directory, such as the caches of
+    assign_images, are not scored."""
+    images_path = tmp_path / "images"
+    images_path.mkdir()
+    for i in range(2):
+        write_geotagged_jpeg(images_path / f"{i}.jpeg", 0, 0, width=64, height=32)
+    GpsIndex(images_path).close()
+    ResponseCache(images_path).close()
+    points_file = tmp_path / "points.gpkg"
+    gpd.GeoDataFrame(
+        {"image_id": ["0", "1"]}, geometry=[Point(0, 0)] * 2, crs="EPSG:4326"
+    ).to_file(points_file)
+    output_file = tmp_path / "gvi.gpkg"
+
+    result = runner.invoke(app, [str(images_path), str(points_file), str(output_file)])
+    assert result.exit_code == 0, result.stderr
+    assert gpd.read_file(output_file)["gvi_score"].notna().all()
+
+
+@pytest.fixture
+def image_paths(tmp_path):
+    """Writes synthetic panoramas with increasing amounts of green."""
+    paths = []
+    for i in range(20):
+        path = tmp_path / f"{i:03d}.jpeg"
+        write_geotagged_jpeg(path, 0, 0, green_fraction=i / 20, width=64, height=32)
+        paths.append(str(path))
+    return paths
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_score_images(image_paths, workers):
+    expected = [get_gvi_score(image_path) for image_path in image_paths]
+    scores = list(score_images(image_paths, workers=workers, chunk_size=4))
+    assert scores == expected
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_score_images_truncated(tmp_path, image_paths, workers):
+    expected = [get_gvi_score(image_path) for image_path in image_paths]
+    truncated = Path(image_paths[5])
+    truncated.write_bytes(truncated.read_bytes()[:200])
+    cache = ScoreCache(tmp_path / "cache.sqlite")
+    scores = list(score_images(image_paths, workers=workers, cache=cache))
+    assert np.isnan(scores[5])
+    assert scores[:5] + scores[6:] == expected[:5] + expected[6:]
+    # Images that could not be decoded are not cached
+    list(score_images(image_paths, workers=workers, cache=cache))
+    assert (cache.hits, cache.misses) == (19, 21)
+
+    points = gpd.GeoDataFrame(
+        {"image_id": [Path(path).stem for path in image_paths]},
+        geometry=gpd.points_from_xy(range(len(image_paths)), range(len(image_paths))),
+        crs="EPSG:4326",
+    )
+    points_file = tmp_path / "points.gpkg"
+    points.to_file(points_file)
+    output_file = tmp_path / "gvi.gpkg"
+    args = [str(truncated.parent), str(points_file), str(output_file)]
+    for resume in [[], ["--resume"]]:
+        result = runner.invoke(app, args + ["--workers", str(workers)] + resume)
+        assert result.exit_code == 0
+        gvi = gpd.read_file(output_file)
+        assert gvi["gvi_score"].isna().tolist() == [i == 5 for i in range(20)]
+
+
+def test_resume(tmp_path, image_paths, monkeypatch):
+    points = gpd.GeoDataFrame(
+        {"image_id": [Path(path).stem for path in image_paths]},
+        geometry=gpd.points_from_xy(range(len(image_paths)), range(len(image_paths))),
+        crs="EPSG:4326",
+    )
+    points_file = tmp_path / "points.gpkg"
+    points.to_file(points_file)
+    output_file = tmp_path / "output" / "gvi.gpkg"
+    output_file.parent.mkdir()
+    args = [
+        str(Path(image_paths[0]).parent),
+        str(points_file),
+        str(output_file),
+        "--no-score-cache",
+    ]
+
+    result = runner.invoke(app, args)
+    assert result.exit_code == 0
+    expected = gpd.read_file(output_file)
+    assert expected["gvi_score"].notna().all()
+
+    # Interrupted after the first batch of scores was journaled
+    journal = ScoreJournal(output_file, score_parameters(), resume=True)
+    journal.connection.execute("DELETE FROM scores WHERE image_id >= '010'")
+    journal.connection.commit()
+    journal.close()
+    scored = []
+    monkeypatch.setattr(
+        src.assign_gvi_to_points,
+        "get_gvi_score",
+        lambda image_path, scale: (
+            scored.append(image_path) or get_gvi_score(image_path, scale)
+        ),
+    )
+
+    result = runner.invoke(app, args + ["--resume"])
+    assert result.exit_code == 0
+    assert scored == image_paths[10:]
+    assert gpd.read_file(output_file).equals(expected)
+
+    # Scores journaled at another scale are not reused
+    scored.clear()
+    result = runner.invoke(app, args + ["--resume", "--scale", "8"])
+    assert result.exit_code == 0
+    assert scored == image_paths
+    result = runner.invoke(app, args + ["--resume"])
+    assert result.exit_code == 0
+    assert len(scored) == 2 * len(image_paths)
+    assert gpd.read_file(output_file).equals(expected)
+
+
+def test_get_gvi_score(image_paths):
+    for image_path in image_paths:
+        assert get_gvi_score(image_path) == get_gvi_score_float(image_path)
+
+
+def test_get_gvi_score_noise(tmp_path):
+    rng = np.random.default_rng(0)
+    for i in range(10):
+        image_path = str(tmp_path / f"{i}.png")
+        cv2.imwrite(image_path, rng.integers(0, 256, (64, 128, 3), dtype=np.uint8))
+        assert get_gvi_score(image_path) == get_gvi_score_float(image_path)
+
+
+def test_get_gvi_score_blurred_noise(tmp_path):
+    # Blurred noise has a narrow ExG range, where Otsu bins are a few ulps wide
+    rng = np.random.default_rng(2)
+    for i, sigma in enumerate(np.linspace(0.5, 10, 40)):
+        image_path = str(tmp_path / f"{i}.png")
+        noise = rng.integers(0, 256, (128, 256, 3), dtype=np.uint8)
+        cv2.imwrite(image_path, cv2.GaussianBlur(noise, (0, 0), sigma))
+        assert get_gvi_score(image_path) == get_gvi_score_float(image_path)
+
+
+def test_get_gvi_score_single_color(tmp_path):
+    image_path = str(tmp_path / "green.png")
+    cv2.imwrite(image_path, np.full((8, 16, 3), (34, 139, 34), dtype=np.uint8))
+    assert get_gvi_score(image_path) == get_gvi_score_float(image_path) == 0
+
+
+@pytest.mark.parametrize("scale", [2, 4, 8])
+def test_get_gvi_score_scale(tmp_path, scale):
+    image_path = str(tmp_path / "panorama.jpeg")
+    write_geotagged_jpeg(
+        image_path, 0, 0, green_fraction=0.4, width=1024, height=512, canopy=True
+    )
+    assert get_gvi_score(image_path, scale=scale) == pytest.approx(
+        get_gvi_score(image_path), abs=1
+    )
+    with pytest.raises(ValueError):
+        get_gvi_score(image_path, scale=3)
+
+
+def test_only_points_images(tmp_path, image_paths, monkeypatch):
+    elsewhere = tmp_path / "elsewhere"
+    elsewhere.mkdir()
+    write_geotagged_jpeg(elsewhere / "other.jpeg", 0, 0, width=64, height=32)
+    points = gpd.GeoDataFrame(
+        {
+            "image_id": ["003", "001", "003", None, "missing", "other"],
+            "image_path": [
+                image_paths[3],
+                "None",
+                image_paths[3],
+                "None",
+                str(tmp_path / "missing.jpeg"),
+                str(elsewhere / "other.jpeg"),
+            ],
+        },
+        geometry=gpd.points_from_xy(range(6), range(6)),
+        crs="EPSG:4326",
+    )
+    points_file = tmp_path / "points.gpkg"
+    points.to_file(points_file)
+    output_file = tmp_path / "gvi.gpkg"
+    scored = []
+    monkeypatch.setattr(
+        src.assign_gvi_to_points,
+        "get_gvi_score",
+        lambda image_path, scale: (
+            scored.append(image_path) or get_gvi_score(image_path, scale)
+        ),
+    )
+
+    result = runner.invoke(
+        app, [str(tmp_path), str(points_file), str(output_file), "--no-score-cache"]
+    )
+    assert result.exit_code == 0
+    assert scored == [image_paths[1], image_paths[3], str(elsewhere / "other.jpeg")]
+    gvi = gpd.read_file(output_file)
+    assert gvi["gvi_score"].notna().tolist() == [True, True, True, False, False, True]
+    assert gvi["gvi_score"][0] == gvi["gvi_score"][2]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_score_cache(tmp_path, image_paths, workers):
+    cache = ScoreCache(tmp_path / "cache.sqlite")
+    expected = list(score_images(image_paths[:10], workers=workers, cache=cache))
+    assert (cache.hits, cache.misses) == (0, 10)
+
+    # A copy of an image has the same content, so the same score
+    copy = tmp_path / "copy.jpeg"
+    copy.write_bytes(Path(image_paths[0]).read_bytes())
+    paths = image_paths[:10] + [str(copy)] + image_paths[10:]
+    scores = list(score_images(paths, workers=workers, cache=cache))
+    assert scores == list(score_images(paths))
+    assert scores[:11] == expected + expected[:1]
+    assert (cache.hits, cache.misses) == (11, 20)
+
+    # Other parameters are scored again
+    list(score_images(image_paths[:5], workers=workers, scale=2, cache=cache))
+    assert (cache.hits, cache.misses) == (11, 25)
+
+
+def test_score_cache_eviction(tmp_path):
+    # Room for two and a half scores
+    cache = ScoreCache(
+        tmp_path / "cache.sqlite", max_size_mb=2.5 * (2 * 2 + ENTRY_OVERHEAD) / 1e6
+    )
+    cache.put([("a", "p", 1.0)])
+    time.sleep(0.01)
+    cache.put([("b", "p", 2.0)])
+    time.sleep(0.01)
+    assert cache.get("a", "p") == 1.0
+    # Scores are evicted as soon as the cache is full
+    cache.put([("c", "p", 3.0)])
+    assert cache.evicted == 1
+    assert cache.size == 2 * (2 * 2 + ENTRY_OVERHEAD)
+    assert cache.get("b", "p") is None
+    assert cache.get("a", "p") == 1.0
+    assert cache.get("c", "p") == 3.0
+    # Replaced scores do not take more room
+    cache.put([("c", "p", 3.0)])
+    assert cache.evicted == 1
+    assert cache.evict() == 0
+    cache.close()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_score_results(image_paths, workers):
+    results = [
+        {"image_path": Path(image_paths[0]), "error": None},
+        {"image_path": None, "error": None},
+        {"image_path": None, "image_content": Path(image_paths[1]).read_bytes()},
+        {"image_path": None, "image_content": b"not an image", "error": None},
+    ]
+    scored = list(score_results(results, workers=workers, scale=2))
+
+    assert [r["gvi_score"] for r in scored] == [
+        get_gvi_score(image_paths[0], scale=2),
+        None,
+        get_gvi_score(image_paths[1], scale=2),
+        None,
+    ]
+    assert scored[3]["error"] == "ValueError"
+    assert all("image_content" not in r for r in scored)
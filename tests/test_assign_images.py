@@ -1,5 +1,8 @@
+import geopandas as gpd
+import pytest
 from typer.testing import CliRunner
 
+from benchmarks.synthetic import write_geotagged_jpeg
 from src.assign_images import app
 
 runner = CliRunner(mix_stderr=False)
@@ -11,3 +14,35 @@ def test_help():
     print(result.output)
     assert result.exit_code == 0
     assert "Assigns Images to Points" in result.output
+
+
+@pytest.mark.parametrize("score", [False, True])
+def test_local(tmp_path, score):
+    images_path = tmp_path / "images"
+    images_path.mkdir()
+    locations = [(41.9437 + i * 0.0005, -85.6325) for i in range(10)]
+    for i, location in enumerate(locations):
+        write_geotagged_jpeg(images_path / f"{i}.jpg", *location, width=32, height=16)
+    # A point close to each image, and one far from all of them
+    points = gpd.GeoDataFrame(
+        geometry=gpd.points_from_xy(
+            [longitude for _, longitude in locations] + [-85.0],
+            [latitude + 2e-5 for latitude, _ in locations] + [41.0],
+        ),
+        crs="EPSG:4326",
+    )
+    points_file = tmp_path / "points.gpkg"
+    points.to_file(points_file)
+
+    args = [str(points_file), "LOCAL", str(images_path)]
+    result = runner.invoke(app, args + (["--score"] if score else []))
+    assert result.exit_code == 0, result.output
+
+    gdf = gpd.read_file(tmp_path / "points_images.gpkg")
+    assert gdf["image_id"][:10].tolist() == [str(i) for i in range(10)]
+    assert gdf["image_id"].isna().tolist() == [False] * 10 + [True]
+    assert (gdf["residual"][:10] < 10).all()
+    assert gdf["image_path"].iloc[-1] == "None"
+    assert ("gvi_score" in gdf) == score
+    if score:
+        assert gdf["gvi_score"][:10].notna().all()
@@ -0,0 +1,37 @@
+import json
+
+from typer.testing import CliRunner
+
+from benchmarks.suite import app
+
+runner = CliRunner(mix_stderr=False)
+
+STAGES = {
+    "create_points",
+    "assign_images_local",
+    "assign_images_mapillary",
+    "assign_gvi_to_points",
+}
+
+
+def test_run_and_compare(tmp_path):
+    results_file = tmp_path / "results.json"
+    result = runner.invoke(
+        app, ["run", str(results_file), "--scale", "3", "--repeat", "1"]
+    )
+    assert result.exit_code == 0, result.output
+    results = json.loads(results_file.read_text())
+    assert {result["stage"] for result in results["results"]} == STAGES
+    assert all(result["seconds"] > 0 for result in results["results"])
+    assert "commit" in results["environment"]
+
+    # Doubling the times of a run is reported as a regression
+    for result in results["results"]:
+        result["seconds"] *= 2
+    slower_file = tmp_path / "slower.json"
+    slower_file.write_text(json.dumps(results))
+    result = runner.invoke(app, ["compare", str(results_file), str(results_file)])
+    assert result.exit_code == 0
+    result = runner.invoke(app, ["compare", str(results_file), str(slower_file)])
+    assert result.exit_code == 1
+    assert "REGRESSION" in result.output
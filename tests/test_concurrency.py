@@ -0,0 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+from src.concurrency import bounded_map
+
+
+def test_bounded_map():
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+
+    def square(x):
+        nonlocal in_flight, max_in_flight
+        with lock:
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+        time.sleep(0.001 * (x % 3))
+        with lock:
+            in_flight -= 1
+        return x * x
+
+    consumed = []
+
+    def items():
+        for x in range(50):
+            consumed.append(x)
+            yield x
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = bounded_map(executor, square, items(), 4)
+        assert next(results) == 0
+        # Only a bounded number of items are taken from the input ahead of time
+        assert len(consumed) <= 5
+        assert list(results) == [x * x for x in range(1, 50)]
+    assert max_in_flight <= 4
@@ -13,7 +13,9 @@ from src.create_points import (
     app,
     create_points,
     filter_by_highway_type,
+    highway_type_where_clause,
     interpolate_along_line,
+    interpolate_along_lines,
 )
 
 runner = CliRunner(mix_stderr=False)
@@ -36,6 +38,17 @@ def test_filter_by_highway_type_error():
         filter_by_highway_type(bad_df, [])
 
 
+def test_no_highway_types():
+    df = gpd.GeoDataFrame({"highway": DEFAULT_HIGHWAY_VALUES_TO_KEEP})
+    with pytest.raises(ValueError, match="highway type"):
+        filter_by_highway_type(df, [])
+    with pytest.raises(ValueError, match="highway type"):
+        highway_type_where_clause([])
+    assert highway_type_where_clause(["primary", "o'neil"]) == (
+        "\"highway\" IN ('primary', 'o''neil')"
+    )
+
+
 def test_filter_by_highway_type():
     highway_vals = np.random.choice(DEFAULT_HIGHWAY_VALUES_TO_KEEP, size=10).tolist()
     drop_highway_vals = ["drop_value_1", "drop_value_2", "drop_value_3"]
@@ -52,6 +65,19 @@ def test_interpolate_along_line():
     assert len(new_coords.geoms) == int(test_line.length / test_dist)
 
 
+def test_interpolate_along_lines():
+    test_lines = np.array([LineString(np.random.rand(3, 2)) for _ in range(10)])
+    test_dist = 0.05
+    line_index, points = interpolate_along_lines(test_lines, test_dist)
+    expected = [interpolate_along_line(line, test_dist) for line in test_lines]
+    assert line_index.tolist() == [
+        i for i, multipoint in enumerate(expected) for _ in multipoint.geoms
+    ]
+    assert [point.coords[0] for point in points] == [
+        point.coords[0] for multipoint in expected for point in multipoint.geoms
+    ]
+
+
 @pytest.mark.parametrize("invalid_value", [None, geometry.Point((1, 1))])
 def test_create_points_error(invalid_value):
     test_df = gpd.read_file("tests/assets/test_gdf.shp").head()
@@ -106,3 +132,24 @@ def test_main(mini_dist, drop_null, highway_types):
     if drop_null:
         assert not output_gdf.geometry.isnull().values.any()
     shutil.rmtree("tests/tmp")
+
+
+@pytest.mark.parametrize("batch_size", [3, 1000])
+def test_main_batch_size(batch_size):
+    Path("tests/tmp").mkdir(exist_ok=True)
+    in_filepath = "tests/assets/test_gdf.shp"
+    out_filepath = "tests/tmp/test_gdf_out.gpkg"
+    batch_out_filepath = "tests/tmp/test_gdf_batch_out.gpkg"
+
+    runner.invoke(app, [in_filepath, out_filepath])
+    result = runner.invoke(
+        app, [in_filepath, batch_out_filepath, "--batch-size", batch_size]
+    )
+    assert result.exit_code == 0
+    output_gdf = gpd.read_file(out_filepath)
+    batch_output_gdf = gpd.read_file(batch_out_filepath)
+
+    assert batch_output_gdf.crs == "EPSG:4326"
+    assert batch_output_gdf["osm_id"].tolist() == output_gdf["osm_id"].tolist()
+    assert batch_output_gdf.geom_equals_exact(output_gdf.geometry, 0).all()
+    shutil.rmtree("tests/tmp")
@@ -0,0 +1,133 @@
+from pathlib import Path
+import pickle
+
+import geopandas as gpd
+import pytest
+from typer.testing import CliRunner
+
+from benchmarks.synthetic import write_geotagged_jpeg
+import src.assign_gvi_to_points
+from src.assign_gvi_to_points import get_gvi_score, score_images
+from src.images.image_store import PackedImageStore
+from src.images.local_images import LocalImages
+import src.pack_images
+from src.score_cache import ScoreCache
+
+runner = CliRunner(mix_stderr=False)
+
+
+@pytest.fixture
+def image_paths(tmp_path):
+    """Writes geotagged panoramas with increasing amounts of green."""
+    images_path = tmp_path / "images"
+    images_path.mkdir()
+    paths = []
+    for i in range(10):
+        path = images_path / f"{i:03d}.jpeg"
+        write_geotagged_jpeg(
+            path, 41.9437 + i * 0.0005, -85.6325, i / 10, width=64, height=32
+        )
+        paths.append(path)
+    return paths
+
+
+def test_put_get(tmp_path, image_paths):
+    store = PackedImageStore(tmp_path / "store")
+    store.put_many((path.stem, path.read_bytes()) for path in image_paths[:5])
+    store.put(image_paths[5].stem, image_paths[5].read_bytes())
+    store.put("no_gps", b"not an image")
+
+    assert len(store) == 7
+    assert "003" in store and "missing" not in store
+    for path in image_paths[:6]:
+        assert store.get(path.stem) == path.read_bytes()
+    with pytest.raises(KeyError):
+        store.get("missing")
+    locations, errors = store.locations()
+    assert list(locations) == [path.stem for path in image_paths[:6]]
+    assert locations["001"] == pytest.approx((41.9442, -85.6325))
+    assert list(errors) == ["no_gps"]
+    assert len(store.packs()) == 1
+    store.close()
+
+    # Images are kept once the store is closed
+    store = PackedImageStore(tmp_path / "store")
+    assert store.get("005") == image_paths[5].read_bytes()
+    assert pickle.loads(pickle.dumps(store)).get("005") == store.get("005")
+    store.close()
+
+
+def test_writers(tmp_path, image_paths):
+    pack_size = 3 * max(path.stat().st_size for path in image_paths)
+    first = PackedImageStore(tmp_path, pack_size=pack_size)
+    second = PackedImageStore(tmp_path, pack_size=pack_size)
+    for i, path in enumerate(image_paths):
+        (first if i % 2 == 0 else second).put(path.stem, path.read_bytes())
+        # Images written by one writer are read by the other
+        assert (second if i % 2 == 0 else first).get(path.stem) == path.read_bytes()
+
+    # Each writer appends to packs of its own, and starts a new one when full
+    assert len(first.packs()) >= 4
+    assert all(pack.stat().st_size <= pack_size for pack in first.packs())
+    for path in image_paths:
+        assert first.get(path.stem) == path.read_bytes()
+    first.close()
+    second.close()
+
+
+def test_pack_images(tmp_path, image_paths):
+    images_path = tmp_path / "images"
+    contents = {path.stem: path.read_bytes() for path in image_paths}
+    expected = [get_gvi_score(str(path)) for path in image_paths[:3]]
+    assert src.pack_images.main(images_path, delete=True, pack_size=1 << 20) == 10
+    assert list(images_path.glob("*.jpeg")) == []
+
+    # Points are assigned images of the store
+    source = LocalImages(images_path, 10)
+    results = [
+        source.get_image_from_coordinates(41.9437 + i * 0.0005 + 2e-5, -85.6325)
+        for i in range(10)
+    ]
+    assert [r["image_id"] for r in results] == list(contents)
+    assert all(r["image_path"] is None for r in results)
+
+    # Images are scored from the store as from their files
+    for path in image_paths[:3]:
+        path.write_bytes(contents[path.stem])
+    store = PackedImageStore(images_path)
+    cache = ScoreCache(tmp_path / "cache.sqlite")
+    scores = list(score_images(["000", "001", "002"], cache=cache, store=store))
+    assert scores == expected
+    # Cache keys are the same for packed images and their files
+    assert list(score_images([str(path) for path in image_paths[:3]], cache=cache)) == (
+        expected
+    )
+    assert (cache.hits, cache.misses) == (3, 3)
+    assert list(score_images(["000", "001", "002"], workers=2, store=store)) == (
+        expected
+    )
+    store.close()
+
+
+def test_assign_gvi_to_points(tmp_path, image_paths):
+    images_path = tmp_path / "images"
+    expected = {path.stem: get_gvi_score(str(path)) for path in image_paths}
+    src.pack_images.main(images_path, tmp_path / "store")
+    points = gpd.GeoDataFrame(
+        {"image_id": ["003", "001", None, "missing"], "image_path": ["None"] * 4},
+        geometry=gpd.points_from_xy(range(4), range(4)),
+        crs="EPSG:4326",
+    )
+    points_file = tmp_path / "points.gpkg"
+    points.to_file(points_file)
+
+    output_file = tmp_path / "gvi.gpkg"
+    result = runner.invoke(
+        src.assign_gvi_to_points.app,
+        [str(tmp_path / "store"), str(points_file), str(output_file)],
+    )
+    assert result.exit_code == 0, result.output
+    gvi = gpd.read_file(output_file)
+    assert gvi["gvi_score"][:2].tolist() == [expected["003"], expected["001"]]
+    assert gvi["gvi_score"][2:].isna().all()
+    assert Path(tmp_path, "store", PackedImageStore.filename).is_file()
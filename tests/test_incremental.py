@@ -0,0 +1,85 @@
+import geopandas as gpd
+import shapely
+
+from src.incremental import (
+    diff_roads,
+    manifest_path,
+    merge_points,
+    read_manifest,
+    road_hashes,
+    write_manifest,
+)
+
+
+def roads(*lines):
+    return gpd.GeoDataFrame(
+        {
+            "osm_id": [osm_id for osm_id, _, _ in lines],
+            "highway": [highway for _, highway, _ in lines],
+        },
+        geometry=[shapely.LineString(coords) for _, _, coords in lines],
+        crs="EPSG:4326",
+    )
+
+
+def test_road_hashes():
+    before = road_hashes(
+        roads(
+            (1, "primary", [(0, 0), (1, 1)]),
+            (2, "primary", [(0, 1), (1, 2)]),
+            (2, "primary", [(1, 2), (2, 3)]),
+            (3, "residential", [(5, 5), (6, 6)]),
+        )
+    )
+    after = road_hashes(
+        roads(
+            # Reversed, so its points are sampled from the other end
+            (1, "primary", [(1, 1), (0, 0)]),
+            (2, "primary", [(0, 1), (1, 2)]),
+            (2, "primary", [(1, 2), (2, 3)]),
+            (4, "residential", [(5, 5), (6, 6)]),
+        )
+    )
+    assert set(before) == {"1", "2", "3"}
+    assert before["2"] == after["2"]
+    assert before["1"] != after["1"]
+    assert diff_roads(before, after) == ({"1", "4"}, {"3"})
+
+    retyped = road_hashes(roads((1, "secondary", [(0, 0), (1, 1)])))
+    assert retyped["1"] != before["1"]
+
+
+def test_manifest(tmp_path):
+    output_file = tmp_path / "gvi.gpkg"
+    options = {"create_points": {"mini_dist": 20.0}}
+    write_manifest(output_file, {"1": "a"}, options)
+    assert manifest_path(output_file).is_file()
+    # Without the output it describes, a manifest is not used
+    assert read_manifest(output_file, options) is None
+    output_file.touch()
+    assert read_manifest(output_file, options) == {"1": "a"}
+    assert read_manifest(output_file, {"create_points": {"mini_dist": 30.0}}) is None
+
+
+def test_merge_points():
+    points = gpd.GeoDataFrame(
+        {"osm_id": [3, 3, 1], "n": [0, 1, 0]},
+        geometry=gpd.points_from_xy([0, 1, 2], [0, 0, 0]),
+        crs="EPSG:4326",
+    )
+    added = gpd.GeoDataFrame(
+        {"osm_id": [2, 2], "n": [0, 1]},
+        geometry=gpd.points_from_xy([3, 4], [0, 0]),
+        crs="EPSG:4326",
+    )
+    merged = merge_points(
+        points,
+        added,
+        roads(
+            (1, "primary", [(0, 0), (1, 1)]),
+            (2, "primary", [(0, 1), (1, 2)]),
+            (3, "primary", [(0, 2), (1, 3)]),
+        ),
+    )
+    assert merged["osm_id"].tolist() == [1, 2, 2, 3, 3]
+    assert merged["n"].tolist() == [0, 0, 1, 0, 1]
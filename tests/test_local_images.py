@@ -0,0 +1,203 @@
+from geopy import Point
+from geopy.distance import ELLIPSOIDS, distance
+import numpy as np
+from PIL import Image
+from PIL.ExifTags import GPS, IFD
+import pytest
+
+from benchmarks.synthetic import write_geotagged_jpeg
+from src.images.exif import GpsIndex, read_gps_coordinates
+from src.images.local_images import LocalImages
+
+CENTER = (41.9437, -85.6325)
+
+
+@pytest.fixture
+def image_locations(tmp_path):
+    """Writes geotagged images scattered within ~50 meters of CENTER."""
+    rng = np.random.default_rng(42)
+    locations = {}
+    for i in range(40):
+        latitude = CENTER[0] + rng.uniform(-0.0005, 0.0005)
+        longitude = CENTER[1] + rng.uniform(-0.0005, 0.0005)
+        path = tmp_path / f"image_{i:03d}.jpg"
+        write_geotagged_jpeg(path, latitude, longitude, width=16, height=8)
+        locations[path] = (latitude, longitude)
+    return locations
+
+
+def greedy_reference(images, points, max_distance):
+    """Brute force nearest unassigned image search with geopy, as done before the
+    spatial index was introduced."""
+    assigned = set()
+    image_ids = []
+    for latitude, longitude in points:
+        closest = None
+        closest_distance = max_distance
+        for path in sorted(images):
+            if path in assigned:
+                continue
+            residual = distance(
+                Point(latitude, longitude),
+                Point(*images[path]),
+                ellipsoid=ELLIPSOIDS["WGS-84"],
+            ).m
+            if residual < closest_distance:
+                closest = path
+                closest_distance = residual
+        if closest is not None:
+            assigned.add(closest)
+        image_ids.append(closest.stem if closest is not None else None)
+    return image_ids
+
+
+def test_local_images_no_images(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        LocalImages(tmp_path, 10)
+
+
+@pytest.mark.parametrize("max_distance", [5, 10, 30])
+def test_get_image_from_coordinates(tmp_path, image_locations, max_distance):
+    source = LocalImages(tmp_path, max_distance)
+    rng = np.random.default_rng(0)
+    points = [
+        (
+            CENTER[0] + rng.uniform(-0.0006, 0.0006),
+            CENTER[1] + rng.uniform(-0.0006, 0.0006),
+        )
+        for _ in range(60)
+    ]
+    # The reference uses the EXIF coordinates as read back by the image source
+    images = {
+        path: (latitude, longitude)
+        for path, latitude, longitude in zip(
+            source.image_paths, source.index.latitudes, source.index.longitudes
+        )
+    }
+
+    results = [source.get_image_from_coordinates(*point) for point in points]
+
+    assert [r["image_id"] for r in results] == greedy_reference(
+        images, points, max_distance
+    )
+    for r in results:
+        if r["image_id"] is not None:
+            assert r["residual"] < max_distance
+            assert r["image_path"].is_file()
+
+
+def test_dms_coordinates(tmp_path, image_locations):
+    source = LocalImages(tmp_path, 10)
+    for path, latitude, longitude in zip(
+        source.image_paths, source.index.latitudes, source.index.longitudes
+    ):
+        assert latitude == pytest.approx(image_locations[path][0], abs=1e-7)
+        assert longitude == pytest.approx(image_locations[path][1], abs=1e-7)
+
+
+def test_read_gps_coordinates(tmp_path):
+    path = tmp_path / "image.jpg"
+    write_geotagged_jpeg(path, -33.8688, 151.2093, width=16, height=8)
+    assert read_gps_coordinates(path) == pytest.approx((-33.8688, 151.2093), abs=1e-7)
+
+    Image.new("RGB", (16, 8)).save(path)
+    with pytest.raises(ValueError):
+        read_gps_coordinates(path)
+
+    path.write_bytes(b"not a jpeg")
+    with pytest.raises(ValueError):
+        read_gps_coordinates(path)
+
+
+def test_local_images_errors(tmp_path, image_locations):
+    Image.new("RGB", (16, 8)).save(tmp_path / "no_exif.jpg")
+    exif = Image.Exif()
+    exif.get_ifd(IFD.GPSInfo)[GPS.GPSLatitudeRef] = "N"
+    Image.new("RGB", (16, 8)).save(tmp_path / "no_gps.jpg", exif=exif)
+    (tmp_path / "corrupt.jpg").write_bytes(b"")
+
+    source = LocalImages(tmp_path, 10, workers=4)
+
+    assert set(source.errors) == {
+        tmp_path / "no_exif.jpg",
+        tmp_path / "no_gps.jpg",
+        tmp_path / "corrupt.jpg",
+    }
+    assert source.image_paths == sorted(image_locations)
+
+
+def test_gps_index(tmp_path, image_locations):
+    image_paths = sorted(image_locations)
+    read = []
+
+    def read_coordinates(path):
+        read.append(path)
+        return read_gps_coordinates(path)
+
+    gps_index = GpsIndex(tmp_path)
+    expected, errors = gps_index.update(image_paths, read_coordinates=read_coordinates)
+    assert sorted(read) == image_paths
+    assert list(expected) == image_paths
+    assert errors == {}
+    gps_index.close()
+
+    # Unchanged images are served from the index
+    read.clear()
+    gps_index = GpsIndex(tmp_path)
+    locations, _ = gps_index.update(image_paths, read_coordinates=read_coordinates)
+    assert locations == expected
+    assert read == []
+
+    # Only new or modified images are read, removed images are dropped
+    write_geotagged_jpeg(image_paths[0], *CENTER, width=16, height=8, seed=1)
+    new_path = tmp_path / "new.jpg"
+    write_geotagged_jpeg(new_path, *CENTER, width=16, height=8)
+    image_paths = image_paths[:-1] + [new_path]
+    locations, _ = gps_index.update(image_paths, read_coordinates=read_coordinates)
+    assert sorted(read) == sorted([image_paths[0], new_path])
+    assert locations[image_paths[0]] == pytest.approx(CENTER)
+    query = "SELECT COUNT(*) FROM images"
+    assert gps_index.connection.execute(query).fetchone() == (len(image_paths),)
+    gps_index.close()
+
+    # Rebuilding reads every image again
+    read.clear()
+    gps_index = GpsIndex(tmp_path, rebuild=True)
+    gps_index.update(image_paths, read_coordinates=read_coordinates)
+    assert sorted(read) == sorted(image_paths)
+    gps_index.close()
+
+
+@pytest.mark.parametrize("max_distance", [5, 10, 30])
+def test_get_images_for_points(tmp_path, image_locations, max_distance):
+    rng = np.random.default_rng(1)
+    points = np.column_stack(
+        [
+            CENTER[0] + rng.uniform(-0.0006, 0.0006, 100),
+            CENTER[1] + rng.uniform(-0.0006, 0.0006, 100),
+        ]
+    )
+    source = LocalImages(tmp_path, max_distance)
+    expected = [source.get_image_from_coordinates(*point) for point in points]
+
+    columns = LocalImages(tmp_path, max_distance).get_images_for_points(points)
+
+    for column, values in columns.items():
+        assert len(values) == len(points)
+        if column == "residual":
+            assert values == pytest.approx([r[column] for r in expected])
+        else:
+            assert values == [r[column] for r in expected]
+
+
+def test_exclude_images(tmp_path, image_locations):
+    points = np.array(list(image_locations.values()))
+    excluded = [path.stem for path in list(image_locations)[::2]]
+    source = LocalImages(tmp_path, 5)
+    source.exclude_images(excluded + ["unknown"])
+
+    columns = source.get_images_for_points(points)
+
+    assigned = [image_id for image_id in columns["image_id"] if image_id is not None]
+    assert len(assigned) > 0
+    assert set(assigned).isdisjoint(excluded)
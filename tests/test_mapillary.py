@@ -0,0 +1,409 @@
+import tracemalloc
+import zlib
+
+import numpy as np
+import pytest
+import stamina
+
+from benchmarks.mock_mapillary import MockMapillaryServer
+from src import metrics
+from src.images.image_store import PackedImageStore
+import src.images.mapillary
+from src.images.mapillary import Mapillary
+from src.images.response_cache import ResponseCache, request_key
+
+CENTER = (41.9437, -85.6325)
+
+
+@pytest.fixture
+def server():
+    """Serves 200 images on a grid with 50 meter spacing around CENTER."""
+    rows, columns = np.meshgrid(np.arange(10), np.arange(20), indexing="ij")
+    latitudes = CENTER[0] + rows.ravel() * 50 / 111_111
+    longitudes = CENTER[1] + columns.ravel() * 50 / 82_600
+    ids = [f"{i:06d}" for i in range(len(latitudes))]
+    with MockMapillaryServer(ids, latitudes, longitudes, image_size=(16, 8)) as server:
+        yield server
+
+
+@pytest.fixture
+def points(server):
+    """Points within 2 meters of every other image, and a few far from any."""
+    rng = np.random.default_rng(0)
+    latitudes = server.latitudes[::2] + rng.uniform(-1, 1, 100) / 111_111
+    longitudes = server.longitudes[::2] + rng.uniform(-1, 1, 100) / 82_600
+    latitudes = np.concatenate([latitudes, CENTER[0] - np.arange(1, 6) * 0.001])
+    longitudes = np.concatenate([longitudes, CENTER[1] - np.arange(1, 6) * 0.001])
+    return latitudes, longitudes
+
+
+def assign(source, points):
+    return [
+        source.get_image_from_coordinates(latitude, longitude)
+        for latitude, longitude in zip(*points)
+    ]
+
+
+def test_get_image_from_coordinates(tmp_path, server, points):
+    source = Mapillary("token", tmp_path, 10, url=server.images_url)
+    results = assign(source, points)
+
+    assert [r["image_id"] for r in results[:-5]] == server.ids[::2].tolist()
+    assert [r["image_id"] for r in results[-5:]] == [None] * 5
+    for r in results[:-5]:
+        assert r["residual"] < 10
+        assert r["image_path"].is_file()
+    assert server.metadata_requests == len(points[0])
+
+
+def test_get_image_from_coordinates_assigned(tmp_path, server):
+    source = Mapillary("token", tmp_path, 10, url=server.images_url)
+    latitude, longitude = server.latitudes[0], server.longitudes[0]
+    results = source.get_image_from_coordinates(latitude, longitude)
+    assert results["image_id"] == server.ids[0]
+    # The only image in range is already assigned
+    assert source.get_image_from_coordinates(latitude, longitude)["image_id"] is None
+
+
+@pytest.mark.parametrize("page_limit", [2000, 7])
+def test_prefetch(tmp_path, server, points, monkeypatch, page_limit):
+    monkeypatch.setattr(src.images.mapillary, "PAGE_LIMIT", page_limit)
+    expected = assign(Mapillary("token", tmp_path, 10, url=server.images_url), points)
+    server.reset_counts()
+
+    source = Mapillary("token", tmp_path / "prefetch", 10, url=server.images_url)
+    assert source.prefetch(*points, tile_size=0.005) == len(server.ids)
+    results = assign(source, points)
+
+    assert [r["image_id"] for r in results] == [r["image_id"] for r in expected]
+    assert [r["residual"] for r in results] == pytest.approx(
+        [r["residual"] for r in expected], abs=1e-6
+    )
+    tiles = 6
+    assert server.metadata_requests == (
+        tiles if page_limit == 2000 else pytest.approx(len(server.ids) / 7, abs=tiles)
+    )
+    assert server.image_requests == len(server.ids) // 2
+
+
+def test_prefetch_split_tiles(tmp_path, server, points, monkeypatch):
+    # Searches only return their first page, of at most 7 images
+    monkeypatch.setattr(src.images.mapillary, "PAGE_LIMIT", 7)
+    server.paging = False
+    source = Mapillary("token", tmp_path, 10, url=server.images_url)
+    assert source.prefetch(*points, tile_size=0.005) == len(server.ids)
+    # Tiles are split until their images fit in a page
+    assert server.metadata_requests > 6
+
+
+def test_prefetch_no_points(tmp_path, server):
+    source = Mapillary("token", tmp_path, 10, url=server.images_url)
+    assert source.prefetch([], []) == 0
+    assert server.metadata_requests == 0
+
+
+@pytest.mark.parametrize("prefetch", [False, True])
+@pytest.mark.parametrize("concurrency", [1, 8])
+def test_get_images_from_coordinates(tmp_path, server, points, prefetch, concurrency):
+    # Two points per image, so that images are contended
+    points = tuple(np.repeat(coordinates, 2) for coordinates in points)
+    expected = assign(Mapillary("token", tmp_path, 10, url=server.images_url), points)
+
+    source = Mapillary(
+        "token",
+        tmp_path / "concurrent",
+        10,
+        url=server.images_url,
+        concurrency=concurrency,
+    )
+    if prefetch:
+        source.prefetch(*points)
+    results = list(source.get_images_from_coordinates(zip(*points)))
+
+    assert [r["image_id"] for r in results] == [r["image_id"] for r in expected]
+    image_ids = [r["image_id"] for r in results if r["image_id"] is not None]
+    assert len(image_ids) == len(set(image_ids))
+
+
+def test_get_images_from_coordinates_errors(tmp_path, server, points):
+    stamina.set_testing(True)
+    try:
+        source = Mapillary("token", tmp_path, 10, url=f"{server.url}/missing")
+        results = list(source.get_images_from_coordinates(zip(*points)))
+    finally:
+        stamina.set_testing(False)
+
+    assert len(results) == len(points[0])
+    assert all(r["error"] == "HTTPError" for r in results)
+
+
+def test_download_resume(tmp_path, server, points):
+    source = Mapillary("token", tmp_path, 10, url=server.images_url)
+    expected = assign(source, points)
+    image_paths = [r["image_path"] for r in expected if r["image_path"] is not None]
+
+    # Complete images are not downloaded again, incomplete ones are
+    image_paths[0].write_bytes(image_paths[0].read_bytes()[:100])
+    server.reset_counts()
+    source = Mapillary("token", tmp_path, 10, url=server.images_url)
+    results = assign(source, points)
+    assert server.image_requests == 1
+    assert [r["image_path"] for r in results] == [r["image_path"] for r in expected]
+    assert image_paths[0].read_bytes() == server.thumbnail(image_paths[0].stem)
+
+
+def test_download_incomplete(tmp_path, server, points):
+    server.truncated.add(server.ids[0])
+    stamina.set_testing(True)
+    try:
+        source = Mapillary("token", tmp_path, 10, url=server.images_url)
+        results = assign(source, points)
+    finally:
+        stamina.set_testing(False)
+
+    assert results[0]["image_id"] == server.ids[0]
+    assert results[0]["error"] == "IncompleteImage"
+    assert results[0]["image_path"] is None
+    # Neither the image nor its temporary file are left behind
+    assert not (tmp_path / f"{server.ids[0]}.jpeg").exists()
+    assert list(tmp_path.glob(".*.part")) == []
+    assert all(r["error"] is None for r in results[1:])
+
+
+def test_download_memory(tmp_path):
+    """Images are streamed to disk, a chunk at a time."""
+    with MockMapillaryServer(
+        ["0"], [CENTER[0]], [CENTER[1]], image_size=(4096, 2048)
+    ) as server:
+        size = len(server.thumbnail("0"))
+        source = Mapillary("token", tmp_path, 10, url=server.images_url)
+        tracemalloc.start()
+        try:
+            source.get_image_from_coordinates(*CENTER)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    assert (tmp_path / "0.jpeg").stat().st_size == size
+    assert peak < min(size / 4, 1 << 20)
+
+
+@pytest.mark.parametrize("retry_after", [True, False])
+def test_throttling(tmp_path, server, points, retry_after):
+    points = (points[0][:40], points[1][:40])
+    expected = assign(Mapillary("token", tmp_path, 10, url=server.images_url), points)
+
+    with MockMapillaryServer(
+        server.ids,
+        server.latitudes,
+        server.longitudes,
+        image_size=(16, 8),
+        rate_limit=(10, 0.25),
+        retry_after=retry_after,
+    ) as throttling:
+        source = Mapillary(
+            "token", tmp_path / "throttled", 10, url=throttling.images_url
+        )
+        results = list(source.get_images_from_coordinates(zip(*points)))
+
+    # Throttled requests are retried until they succeed, no point is lost
+    assert throttling.throttled_requests > 0
+    assert [r["image_id"] for r in results] == [r["image_id"] for r in expected]
+    assert all(r["error"] is None for r in results)
+    assert source.metadata_limiter.throttled > 0
+    assert source.metadata_limiter.lowest_limit < source.concurrency
+    assert source.image_limiter.requests >= sum(
+        r["image_path"] is not None for r in expected
+    )
+
+
+def test_response_cache(tmp_path, server, points):
+    cache = ResponseCache(tmp_path)
+    expected = assign(
+        Mapillary("token", tmp_path, 10, url=server.images_url, cache=cache), points
+    )
+    cache.close()
+    server.reset_counts()
+
+    # Same directory, so images are already downloaded too
+    cache = ResponseCache(tmp_path, offline=True)
+    source = Mapillary("other", tmp_path, 10, url=server.images_url, cache=cache)
+    results = list(source.get_images_from_coordinates(zip(*points)))
+
+    assert results == expected
+    assert server.metadata_requests == 0
+    assert server.image_requests == 0
+    assert cache.hits == len(points[0])
+
+
+def test_response_cache_offline_miss(tmp_path, server, points):
+    cache = ResponseCache(tmp_path, offline=True)
+    source = Mapillary("token", tmp_path, 10, url=server.images_url, cache=cache)
+    results = list(source.get_images_from_coordinates(zip(*points)))
+
+    assert all(r["error"] == "OfflineCacheMiss" for r in results)
+    assert server.metadata_requests == 0
+
+
+def test_response_cache_ttl(tmp_path, server, points):
+    source = Mapillary(
+        "token", tmp_path, 10, url=server.images_url, cache=ResponseCache(tmp_path)
+    )
+    source.prefetch(*points)
+    requests = server.metadata_requests
+
+    source.cache = ResponseCache(tmp_path, ttl_days=0)
+    source.prefetch(*points)
+    assert server.metadata_requests == 2 * requests
+
+
+def test_response_cache_eviction(tmp_path):
+    # Room for three of the responses
+    cache = ResponseCache(
+        tmp_path, max_size_mb=3.5 * len(zlib.compress(b'{"i":0}')) / 1e6
+    )
+    for i in range(3):
+        cache.put(str(i), {"i": i})
+    assert cache.get("0") == {"i": 0}
+    cache.put("3", {"i": 3})
+
+    assert cache.get("0") == {"i": 0}
+    assert cache.get("1") is None
+    assert cache.get("2") == {"i": 2}
+    assert cache.get("3") == {"i": 3}
+
+    # The size of the cache is kept without summing it on every response
+    size = len(zlib.compress(b'{"i":0}'))
+    assert cache.size == 3 * size
+    cache.put("3", {"i": 4})
+    assert cache.size == 3 * size
+    # and only evicted again once full
+    cache.put("4", {"i": 5})
+    assert cache.size == 3 * size
+    assert cache.get("0") is None
+    assert [cache.get(key) for key in "234"] == [{"i": 2}, {"i": 4}, {"i": 5}]
+    cache.close()
+    assert ResponseCache(tmp_path).size == 3 * size
+
+
+def test_request_key():
+    key = request_key(
+        "https://graph.mapillary.com/images?is_pano=true",
+        {"bbox": "-85.63,41.9437,-85.6,41.95", "access_token": "token", "limit": 7},
+    )
+    assert key == request_key(
+        "https://graph.mapillary.com/images",
+        {"limit": "7", "bbox": "-85.6300000001,41.9437,-85.6,41.95", "is_pano": "true"},
+    )
+    assert "token" not in key
+    assert key != request_key(
+        "https://graph.mapillary.com/images?is_pano=false",
+        {"bbox": "-85.63,41.9437,-85.6,41.95", "limit": 7},
+    )
+
+
+def test_with_content(tmp_path, server, points):
+    expected = assign(Mapillary("token", tmp_path, 10, url=server.images_url), points)
+
+    source = Mapillary(
+        "token",
+        tmp_path / "memory",
+        10,
+        url=server.images_url,
+        keep_images=False,
+        with_content=True,
+    )
+    results = list(source.get_images_from_coordinates(zip(*points)))
+
+    assert [r["image_id"] for r in results] == [r["image_id"] for r in expected]
+    for r, e in zip(results, expected):
+        assert r["image_path"] is None
+        if e["image_path"] is not None:
+            assert r["image_content"] == e["image_path"].read_bytes()
+    assert list((tmp_path / "memory").iterdir()) == []
+
+
+def test_packed(tmp_path, server, points):
+    expected = assign(Mapillary("token", tmp_path, 10, url=server.images_url), points)
+
+    store = PackedImageStore(tmp_path / "packed")
+    source = Mapillary(
+        "token", tmp_path / "packed", 10, url=server.images_url, store=store
+    )
+    results = assign(source, points)
+
+    assert [r["image_id"] for r in results] == [r["image_id"] for r in expected]
+    assert all(r["image_path"] is None for r in results)
+    assert list((tmp_path / "packed").glob("*.jpeg")) == []
+    for r in expected:
+        if r["image_path"] is not None:
+            assert store.get(r["image_id"]) == r["image_path"].read_bytes()
+
+    # Packed images are not downloaded again
+    server.reset_counts()
+    source = Mapillary(
+        "token", tmp_path / "packed", 10, url=server.images_url, store=store
+    )
+    assign(source, points)
+    assert server.image_requests == 0
+    store.close()
+
+
+@pytest.mark.parametrize("prefetch", [False, True])
+def test_exclude_images(tmp_path, server, points, prefetch):
+    source = Mapillary("token", tmp_path, 10, url=server.images_url)
+    excluded = server.ids[::4].tolist()
+    source.exclude_images(excluded)
+    if prefetch:
+        source.prefetch(*points)
+    results = source.get_images_for_points(np.column_stack(points))
+
+    assigned = [image_id for image_id in results["image_id"] if image_id is not None]
+    assert len(assigned) > 0
+    assert set(assigned).isdisjoint(excluded)
+
+
+@pytest.mark.parametrize("keep_images", [False, True])
+def test_metrics(tmp_path, server, points, keep_images):
+    source = Mapillary(
+        "token",
+        tmp_path,
+        10,
+        url=server.images_url,
+        keep_images=keep_images,
+        with_content=not keep_images,
+    )
+    metrics.enable()
+    try:
+        results = assign(source, points)
+        recorded = metrics.collect()
+    finally:
+        metrics.enable(False)
+    downloaded = [r for r in results if r["image_id"] is not None]
+    assert recorded["timers"]["mapillary.metadata"]["calls"] == len(points[0])
+    assert recorded["timers"]["mapillary.download"]["calls"] == len(downloaded)
+    assert recorded["counters"]["mapillary.download_bytes"] == sum(
+        len(server.thumbnail(r["image_id"])) for r in downloaded
+    )
+    assert recorded["counters"]["mapillary.metadata_bytes"] > 0
+
+
+@pytest.mark.parametrize("prefetch", [False, True])
+def test_get_images_for_points(tmp_path, server, points, prefetch):
+    points = np.column_stack([np.repeat(coordinates, 2) for coordinates in points])
+    expected = assign(
+        Mapillary("token", tmp_path, 10, url=server.images_url), tuple(points.T)
+    )
+
+    source = Mapillary("token", tmp_path / "batch", 10, url=server.images_url)
+    if prefetch:
+        source.prefetch(points[:, 0], points[:, 1])
+    columns = source.get_images_for_points(points)
+
+    assert columns["image_id"] == [r["image_id"] for r in expected]
+    assert columns["residual"] == pytest.approx(
+        [r["residual"] for r in expected], abs=1e-6
+    )
+    assert columns["error"] == [None] * len(points)
+    assert [path is not None and path.is_file() for path in columns["image_path"]] == [
+        r["image_path"] is not None for r in expected
+    ]
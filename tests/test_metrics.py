@@ -0,0 +1,130 @@
+import json
+import pstats
+
+import geopandas as gpd
+import pytest
+from typer.testing import CliRunner
+
+from benchmarks.synthetic import synthetic_roads, write_geotagged_jpeg
+from src import assign_gvi_to_points, assign_images, create_points, metrics
+from src.images.image_source import ImageSourceSelector
+
+runner = CliRunner(mix_stderr=False)
+
+
+@pytest.fixture(autouse=True)
+def disabled():
+    yield
+    metrics.enable(False)
+    metrics.reset()
+
+
+def test_disabled():
+    with metrics.timer("block"):
+        pass
+    metrics.count("items", 3)
+    assert metrics.snapshot() == {"timers": {}, "counters": {}}
+    assert metrics.collect() is None
+
+
+def test_timers_and_counters():
+    metrics.enable()
+
+    @metrics.timed("function")
+    def function(value):
+        return value
+
+    assert function(1) == 1
+    for _ in range(2):
+        with metrics.timer("block"):
+            metrics.count("items", 3)
+    recorded = metrics.collect()
+    assert recorded["timers"]["function"]["calls"] == 1
+    assert recorded["timers"]["block"]["calls"] == 2
+    assert recorded["counters"] == {"items": 6}
+    assert metrics.snapshot() == {"timers": {}, "counters": {}}
+
+    # As sent back by worker processes
+    results = list(metrics.merged([("a", recorded), ("b", recorded), ("c", None)]))
+    assert results == ["a", "b", "c"]
+    assert metrics.snapshot()["timers"]["block"]["calls"] == 4
+    assert metrics.snapshot()["counters"] == {"items": 12}
+
+
+def test_create_points(tmp_path):
+    roads_file = tmp_path / "roads.gpkg"
+    synthetic_roads(20).to_file(roads_file)
+    points_file = tmp_path / "points.gpkg"
+    metrics_file = tmp_path / "metrics.json"
+    profile_file = tmp_path / "create_points.prof"
+    result = runner.invoke(
+        create_points.app,
+        [
+            str(roads_file),
+            str(points_file),
+            "--metrics-out",
+            str(metrics_file),
+            "--profile",
+            str(profile_file),
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    recorded = json.loads(metrics_file.read_text())
+    assert recorded["stage"] == "create_points"
+    assert set(recorded["timers"]) == {
+        "read_file",
+        "reproject",
+        "interpolate",
+        "to_file",
+    }
+    assert recorded["counters"]["points"] == len(gpd.read_file(points_file))
+    assert recorded["wall_seconds"] >= recorded["timers"]["interpolate"]["seconds"]
+    assert pstats.Stats(str(profile_file)).total_calls > 0
+    assert not metrics.enabled()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_assign_and_score(tmp_path, workers):
+    images_path = tmp_path / "images"
+    images_path.mkdir()
+    for i in range(6):
+        write_geotagged_jpeg(
+            images_path / f"{i}.jpeg", 0, i * 0.001, width=64, height=32, seed=i
+        )
+    points_file = tmp_path / "points.gpkg"
+    gpd.GeoDataFrame(
+        geometry=gpd.points_from_xy([i * 0.001 for i in range(6)], [0] * 6),
+        crs="EPSG:4326",
+    ).to_file(points_file)
+
+    metrics_file = tmp_path / "assign_images.json"
+    assign_images.main(
+        points_file,
+        ImageSourceSelector.local,
+        images_path,
+        metrics_out=metrics_file,
+    )
+    recorded = json.loads(metrics_file.read_text())
+    assert recorded["timers"]["exif"]["calls"] == 6
+    assert recorded["counters"]["points"] == 6
+
+    metrics_file = tmp_path / "assign_gvi_to_points.json"
+    result = runner.invoke(
+        assign_gvi_to_points.app,
+        [
+            str(images_path),
+            str(tmp_path / "points_images.gpkg"),
+            str(tmp_path / "gvi.gpkg"),
+            "--workers",
+            str(workers),
+            "--no-score-cache",
+            "--metrics-out",
+            str(metrics_file),
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    recorded = json.loads(metrics_file.read_text())
+    # Decoding and scoring in worker processes are counted too
+    assert recorded["timers"]["gvi.decode"]["calls"] == 6
+    assert recorded["timers"]["gvi.compute"]["calls"] == 6
+    assert recorded["counters"] == {"gvi.images": 6, "gvi.pixels": 6 * 64 * 32}
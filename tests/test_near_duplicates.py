@@ -0,0 +1,112 @@
+import geopandas as gpd
+import pytest
+from shapely.geometry import Point
+
+from benchmarks.synthetic import write_geotagged_jpeg
+from src import assign_images
+from src.images.image_source import ImageSourceSelector
+from src.images.local_images import LocalImages
+from src.images.near_duplicates import (
+    frame_hash,
+    hash_distance,
+    near_duplicate_frames,
+)
+import src.pack_images
+
+START = (41.9437, -85.6325)
+# About 1 meter of latitude
+METER = 1 / 111_111
+
+
+@pytest.fixture
+def capture(tmp_path):
+    """Writes a stop-and-go capture, in file name order: 3 frames while moving 10
+    meters apart, 5 frames of the same view while stopped with GPS drifting by a
+    meter, and 3 more frames while moving. Returns the path of each frame and its
+    expected first frame, or None for the frames that are kept."""
+    images_path = tmp_path / "images"
+    images_path.mkdir()
+    frames = []
+    latitude = START[0]
+    for i in range(11):
+        stopped = 3 <= i < 8
+        path = images_path / f"GOPR{i:04d}.jpg"
+        write_geotagged_jpeg(
+            path,
+            latitude + (0.4 * (i % 3) * METER if stopped else 0),
+            START[1],
+            seed=3 if stopped else i,
+            canopy=True,
+        )
+        frames.append((path, "GOPR0003" if 3 < i < 8 else None))
+        if not 3 <= i < 7:
+            latitude += 10 * METER
+    return images_path, frames
+
+
+def test_frame_hash(capture):
+    _, frames = capture
+    hashes = [frame_hash(path) for path, _ in frames]
+    assert hash_distance(hashes[3], hashes[4]) == 0
+    assert hash_distance(hashes[0], hashes[1]) > 6
+    # Packed images are hashed from their content
+    assert frame_hash(frames[0][0].read_bytes()) == hashes[0]
+    assert frame_hash(b"not an image") is None
+
+
+def test_near_duplicate_frames(capture):
+    images_path, frames = capture
+    source = LocalImages(images_path, 10)
+    paths = [path for path, _ in frames]
+    hashed = []
+
+    def read_hash(path):
+        hashed.append(path)
+        return frame_hash(path)
+
+    duplicates = near_duplicate_frames(
+        paths,
+        source.index.latitudes,
+        source.index.longitudes,
+        read_hash=read_hash,
+    )
+    assert {path.stem: first.stem for path, first in duplicates.items()} == {
+        path.stem: first for path, first in frames if first is not None
+    }
+    # Frames taken while moving are not decoded
+    assert sorted(path.stem for path in hashed) == [f"GOPR{i:04d}" for i in range(3, 8)]
+    # Frames of different views at the same location are kept
+    assert near_duplicate_frames(paths, [START[0]] * 11, [START[1]] * 11) == {
+        paths[4]: paths[3],
+        paths[5]: paths[3],
+        paths[6]: paths[3],
+        paths[7]: paths[3],
+    }
+    assert near_duplicate_frames(paths[:1], [START[0]], [START[1]]) == {}
+
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_local_images_dedup(capture, packed):
+    images_path, frames = capture
+    if packed:
+        assert src.pack_images.main(images_path, delete=True) == len(frames)
+    expected = {path.stem: first for path, first in frames if first is not None}
+    source = LocalImages(images_path, 10, dedup=True)
+    assert source.duplicates == expected
+    assert sorted(source.image_ids) == sorted(
+        path.stem for path, first in frames if first is None
+    )
+    assert len(source.index) == len(frames) - len(expected)
+
+    # Points at the stop can only be assigned its first frame
+    points = gpd.GeoDataFrame(
+        geometry=[Point(START[1], START[0] + 30 * METER)] * 2, crs="EPSG:4326"
+    )
+    gdf = assign_images.assign_images_to_points(
+        points, ImageSourceSelector.local, images_path, max_distance=5, dedup=True
+    )
+    assert gdf["image_id"].tolist() == ["GOPR0003", None]
+    gdf = assign_images.assign_images_to_points(
+        points, ImageSourceSelector.local, images_path, max_distance=5
+    )
+    assert gdf["image_id"].notna().all()
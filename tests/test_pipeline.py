@@ -0,0 +1,231 @@
+import json
+
+import geopandas as gpd
+from loguru import logger
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+from typer.testing import CliRunner
+
+from benchmarks.synthetic import synthetic_roads, write_geotagged_jpeg
+from src import assign_gvi_to_points, assign_images, create_points
+from src.images.image_source import ImageSourceSelector
+from src.pipeline import app, result_options
+
+runner = CliRunner(mix_stderr=False)
+
+CONFIG = """
+[create_points]
+mini_dist = 30.0
+batch_size = 10
+
+[assign_images]
+max_distance = 5.0
+
+[assign_gvi_to_points]
+scale = 2
+"""
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    """Synthetic roads, and an image next to every other point sampled from them."""
+    roads_file = tmp_path / "roads.gpkg"
+    synthetic_roads(10, extent=0.005).to_file(roads_file)
+    points = create_points.points_from_roads(gpd.read_file(roads_file), mini_dist=30.0)
+    images_path = tmp_path / "images"
+    images_path.mkdir()
+    rng = np.random.default_rng(0)
+    for i, point in enumerate(points.geometry[::2]):
+        write_geotagged_jpeg(
+            images_path / f"{i}.jpeg",
+            point.y + 1 / 111_111,
+            point.x,
+            rng.uniform(0, 0.6),
+            width=64,
+            height=32,
+            seed=i,
+        )
+    config_file = tmp_path / "config.toml"
+    config_file.write_text(CONFIG)
+    return roads_file, images_path, config_file
+
+
+def test_pipeline(tmp_path, inputs):
+    roads_file, images_path, config_file = inputs
+    output_file = tmp_path / "gvi.gpkg"
+    points_file = tmp_path / "points.gpkg"
+    warnings = []
+    sink = logger.add(warnings.append, level="WARNING")
+    result = runner.invoke(
+        app,
+        [
+            str(roads_file),
+            "LOCAL",
+            str(images_path),
+            str(output_file),
+            "--config",
+            str(config_file),
+            "--points-file",
+            str(points_file),
+        ],
+    )
+    logger.remove(sink)
+    assert result.exit_code == 0, result.output
+    assert "batch_size of [create_points] is not used" in "".join(warnings)
+
+    # Same output as the steps run one after the other, with the same config
+    step_points_file = tmp_path / "steps" / "points.gpkg"
+    step_points_file.parent.mkdir()
+    create_points.main(roads_file, step_points_file, mini_dist=30.0)
+    images_file = assign_images.main(
+        step_points_file, ImageSourceSelector.local, images_path, max_distance=5.0
+    )
+    step_output_file = tmp_path / "steps" / "gvi.gpkg"
+    assign_gvi_to_points.main(images_path, images_file, step_output_file, scale=2)
+
+    expected = gpd.read_file(step_output_file)
+    output = gpd.read_file(output_file)
+    assert output["image_id"].tolist() == expected["image_id"].tolist()
+    pd.testing.assert_series_equal(output["gvi_score"], expected["gvi_score"])
+    assert output["gvi_score"].notna().sum() == len(list(images_path.glob("*.jpeg")))
+    assert len(gpd.read_file(points_file)) == len(output)
+    # Only the requested files are written
+    assert not (tmp_path / "gvi_images.gpkg").exists()
+
+
+def test_unknown_option(tmp_path, inputs):
+    roads_file, images_path, config_file = inputs
+    config_file.write_text("[assign_images]\nmax_distanse = 5.0\n")
+    result = runner.invoke(
+        app,
+        [
+            str(roads_file),
+            "LOCAL",
+            str(images_path),
+            str(tmp_path / "gvi.gpkg"),
+            "--config",
+            str(config_file),
+        ],
+    )
+    assert result.exit_code != 0
+    assert "max_distanse" in result.stderr
+
+
+def test_incremental(tmp_path, inputs):
+    roads_file, images_path, config_file = inputs
+    output_file = tmp_path / "incremental" / "gvi.gpkg"
+    output_file.parent.mkdir()
+    metrics_file = tmp_path / "metrics.json"
+
+    def run(roads_file, output_file, *args):
+        result = runner.invoke(
+            app,
+            [
+                str(roads_file),
+                "LOCAL",
+                str(images_path),
+                str(output_file),
+                "--config",
+                str(config_file),
+                "--metrics-out",
+                str(metrics_file),
+                *args,
+            ],
+        )
+        assert result.exit_code == 0, result.output
+        return json.loads(metrics_file.read_text())["counters"]
+
+    assert run(roads_file, output_file, "--incremental")["roads_processed"] == 10
+    assert run(roads_file, output_file, "--incremental")["roads_processed"] == 0
+
+    # One road moved, one removed and one added, away from the other roads so that
+    # they do not compete for the same images
+    roads = gpd.read_file(roads_file)
+    osm_ids = roads["osm_id"].tolist()
+    roads.loc[0, "geometry"] = shapely.affinity.translate(roads.geometry[0], xoff=0.01)
+    roads = roads.drop(index=1)
+    added = roads.iloc[[2]].copy()
+    added["osm_id"] = "new"
+    added["geometry"] = shapely.affinity.translate(added.geometry.iloc[0], yoff=0.01)
+    roads = gpd.GeoDataFrame(pd.concat([roads, added]), crs=roads.crs)
+    new_roads_file = tmp_path / "new_roads.gpkg"
+    roads.to_file(new_roads_file)
+
+    def step_files(directory):
+        return [
+            "--points-file",
+            str(directory / "points.gpkg"),
+            "--images-file",
+            str(directory / "images.gpkg"),
+        ]
+
+    counters = run(
+        new_roads_file,
+        output_file,
+        "--incremental",
+        *step_files(output_file.parent),
+    )
+    assert counters["roads_reused"] == 8
+    assert counters["roads_processed"] == 2
+
+    # Same output, and intermediate points, as a full run
+    full_output_file = tmp_path / "full" / "gvi.gpkg"
+    full_output_file.parent.mkdir()
+    run(new_roads_file, full_output_file, *step_files(full_output_file.parent))
+    for name in ["gvi.gpkg", "points.gpkg", "images.gpkg"]:
+        output = gpd.read_file(output_file.parent / name)
+        expected = gpd.read_file(full_output_file.parent / name)
+        assert osm_ids[1] not in output["osm_id"].tolist()
+        pd.testing.assert_frame_equal(
+            output.drop(columns="geometry"), expected.drop(columns="geometry")
+        )
+        assert output.geometry.geom_equals_exact(expected.geometry, 1e-9).all()
+    output = gpd.read_file(output_file)
+
+    # Without changed roads, the intermediate points are those of the output
+    (output_file.parent / "points.gpkg").unlink()
+    (output_file.parent / "images.gpkg").unlink()
+    counters = run(
+        new_roads_file,
+        output_file,
+        "--incremental",
+        *step_files(output_file.parent),
+    )
+    assert counters["roads_processed"] == 0
+    assert len(gpd.read_file(output_file.parent / "points.gpkg")) == len(output)
+    assert "gvi_score" not in gpd.read_file(output_file.parent / "images.gpkg")
+
+    # Points of changed roads are not assigned the images of the kept points
+    roads.loc[2, "geometry"] = shapely.affinity.translate(
+        roads.geometry[2], xoff=0.00001
+    )
+    roads.to_file(new_roads_file)
+    before = output.set_index("osm_id")
+    assert run(new_roads_file, output_file, "--incremental")["roads_processed"] == 1
+    output = gpd.read_file(output_file)
+    assert output["image_id"].dropna().is_unique
+    kept = output[output["osm_id"] != roads["osm_id"][2]].set_index("osm_id")
+    assert kept["image_id"].equals(before.loc[kept.index.unique(), "image_id"])
+
+    # Changing an option changing the output processes every road again
+    config_file.write_text(CONFIG.replace("max_distance = 5.0", "max_distance = 6.0"))
+    assert run(new_roads_file, output_file, "--incremental")["roads_processed"] == 10
+
+
+def test_result_options():
+    stage_functions = {
+        "create_points": create_points.points_from_roads,
+        "assign_images": assign_images.assign_images_to_points,
+        "assign_gvi_to_points": assign_gvi_to_points.assign_gvi_scores,
+    }
+    options = {stage: {} for stage in stage_functions}
+    defaults = result_options(stage_functions, options)
+    assert defaults["assign_images"]["prefetch"] is False
+    assert defaults["assign_gvi_to_points"] == {"scale": 1}
+
+    # Options that change which images are matched invalidate incremental runs
+    options["assign_images"] = {"prefetch": True, "workers": 2}
+    values = result_options(stage_functions, options)
+    assert values["assign_images"] == dict(defaults["assign_images"], prefetch=True)
@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+import time
+
+import pytest
+import requests
+
+from src.images.rate_limiter import RateLimiter, quota_usage, retry_after
+
+
+def response(status=200, **headers):
+    result = requests.Response()
+    result.status_code = status
+    result.headers.update(
+        {key.replace("_", "-"): value for key, value in headers.items()}
+    )
+    return result
+
+
+def test_retry_after():
+    assert retry_after(response()) is None
+    assert retry_after(response(429, Retry_After="2")) == 2
+    assert retry_after(
+        response(429, Retry_After=formatdate(time.time() + 30, usegmt=True))
+    ) == pytest.approx(30, abs=2)
+    assert (
+        retry_after(response(X_RateLimit_Remaining="3", X_RateLimit_Reset="9")) is None
+    )
+    assert retry_after(response(X_RateLimit_Remaining="0", X_RateLimit_Reset="9")) == 9
+    assert retry_after(
+        response(X_RateLimit_Remaining="0", X_RateLimit_Reset=str(time.time() + 5))
+    ) == pytest.approx(5, abs=1)
+    assert retry_after(response(429, Retry_After="soon")) is None
+
+
+def test_quota_usage():
+    assert quota_usage(response()) is None
+    assert (
+        quota_usage(response(X_App_Usage='{"call_count": 28, "total_time": 5}')) == 28
+    )
+    assert (
+        quota_usage(
+            response(
+                X_Business_Use_Case_Usage='{"1": [{"type": "x", "call_count": 95}]}'
+            )
+        )
+        == 95
+    )
+    assert quota_usage(response(X_App_Usage="not json")) is None
+
+
+def test_rate():
+    limiter = RateLimiter("test", rate=100)
+    start = time.monotonic()
+    for _ in range(150):
+        with limiter.request():
+            limiter.observe(response())
+    # A second of requests is made at once, the others at the rate
+    assert time.monotonic() - start == pytest.approx(0.5, abs=0.2)
+    assert limiter.requests == 150
+
+
+def test_concurrency():
+    limiter = RateLimiter("test", max_concurrency=8)
+    in_flight = []
+
+    def request(status):
+        with limiter.request():
+            in_flight.append((limiter.in_flight, int(limiter.limit)))
+            time.sleep(0.01)
+            limiter.observe(response(status))
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(request, [200] * 32))
+    assert max(count for count, _ in in_flight) == 8
+
+    # A throttled response halves the requests in flight, and pauses them
+    request(429)
+    assert limiter.limit == 4
+    assert (limiter.throttled, limiter.decreases, limiter.lowest_limit) == (1, 1, 4)
+    in_flight.clear()
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(executor.map(request, [200] * 32))
+    assert all(count <= limit for count, limit in in_flight)
+    assert max(count for count, _ in in_flight[:4]) <= 4
+    assert limiter.waited > 0
+
+    # Successful responses increase it again
+    assert 4 < limiter.limit <= 8
+    assert "1 Throttled" in limiter.summary()
+
+
+def test_retry_after_pause():
+    limiter = RateLimiter("test")
+    with limiter.request():
+        limiter.observe(response(429, Retry_After="0.3"))
+    start = time.monotonic()
+    with limiter.request():
+        pass
+    assert time.monotonic() - start >= 0.3
+
+
+def test_quota_decrease():
+    limiter = RateLimiter("test", max_concurrency=8)
+    with limiter.request():
+        limiter.observe(response(X_App_Usage='{"call_count": 95}'))
+    assert limiter.limit == 4
+    assert limiter.throttled == 0
@@ -0,0 +1,105 @@
+import json
+import subprocess
+import sys
+
+import geopandas as gpd
+import pytest
+
+from benchmarks.synthetic import write_geotagged_jpeg
+from src.shards import claim_shards, mark_done, merge_shards, split_points
+
+TILE_SIZE = 0.001
+
+
+def write_points(path, latitudes, longitudes):
+    gpd.GeoDataFrame(
+        geometry=gpd.points_from_xy(longitudes, latitudes), crs="EPSG:4326"
+    ).to_file(path)
+
+
+def test_split(tmp_path):
+    # Two points in the first tile, one of them close to the second tile
+    latitudes = [0.0005, 0.00099, 0.0015]
+    write_points(tmp_path / "points.gpkg", latitudes, [0.0005] * 3)
+    names = split_points(
+        tmp_path / "points.gpkg", tmp_path / "shards", tile_size=TILE_SIZE, margin=5
+    )
+    assert names == ["shard_0_0", "shard_0_1"]
+    manifest = json.loads((tmp_path / "shards" / "manifest.json").read_text())
+    assert manifest["shards"] == names
+
+    first = gpd.read_file(tmp_path / "shards" / "shard_0_0.gpkg")
+    assert first["point_id"].tolist() == [0, 1]
+    assert first["shard_core"].astype(bool).tolist() == [True, True]
+    second = gpd.read_file(tmp_path / "shards" / "shard_0_1.gpkg")
+    assert second["point_id"].tolist() == [1, 2]
+    assert second["shard_core"].astype(bool).tolist() == [False, True]
+
+
+def test_claim(tmp_path):
+    write_points(tmp_path / "points.gpkg", [0.0005, 0.0015], [0.0005] * 2)
+    split_points(tmp_path / "points.gpkg", tmp_path, tile_size=TILE_SIZE)
+    first_worker = claim_shards(tmp_path)
+    assert next(first_worker) == "shard_0_0"
+    # Another worker only gets the shards that are not claimed yet
+    assert list(claim_shards(tmp_path)) == ["shard_0_1"]
+    assert list(first_worker) == []
+
+
+def test_merge_duplicates(tmp_path):
+    write_points(tmp_path / "points.gpkg", [0.00098, 0.00101], [0.0005] * 2)
+    names = split_points(tmp_path / "points.gpkg", tmp_path, tile_size=TILE_SIZE)
+    with pytest.raises(Exception, match="not done"):
+        merge_shards(tmp_path, tmp_path / "merged.gpkg")
+
+    # Each shard assigned the same image to its own core point
+    for name, residuals in zip(names, ([3.0, 1.0], [3.0, 1.0])):
+        shard = gpd.read_file(tmp_path / f"{name}.gpkg")
+        shard["image_id"] = "42"
+        shard["image_lat"] = 0.001
+        shard["image_lon"] = 0.0005
+        shard["residual"] = residuals
+        shard["image_path"] = "42.jpeg"
+        shard["error"] = None
+        shard["gvi_score"] = 10.0
+        shard.to_file(tmp_path / f"{name}_images.gpkg")
+        mark_done(tmp_path, name)
+
+    gdf = merge_shards(tmp_path, tmp_path / "merged.gpkg")
+    assert "point_id" not in gdf and "shard_core" not in gdf
+    # The image is kept for the second point, which is the closest
+    assert gdf["image_id"].isna().tolist() == [True, False]
+    assert gdf["error"].tolist() == ["DuplicateImage", None]
+    assert gdf["gvi_score"].isna().tolist() == [True, False]
+    assert len(gpd.read_file(tmp_path / "merged.gpkg")) == 2
+
+
+def test_workers(tmp_path):
+    images_path = tmp_path / "images"
+    images_path.mkdir()
+    # Images every 25 meters, across four tiles
+    locations = [(0.0001 + i * 0.000225, 0.0005) for i in range(18)]
+    for i, location in enumerate(locations):
+        write_geotagged_jpeg(images_path / f"{i}.jpg", *location, width=32, height=16)
+    write_points(
+        tmp_path / "points.gpkg",
+        [latitude + 2e-5 for latitude, _ in locations],
+        [longitude for _, longitude in locations],
+    )
+    shards_dir = tmp_path / "shards"
+    names = split_points(tmp_path / "points.gpkg", shards_dir, tile_size=TILE_SIZE)
+    assert len(names) == 4
+
+    command = [sys.executable, "-m", "src.shards", "work", str(shards_dir), "LOCAL"]
+    workers = [
+        subprocess.Popen(command + [str(images_path)], stderr=subprocess.PIPE)
+        for _ in range(3)
+    ]
+    for worker in workers:
+        _, stderr = worker.communicate(timeout=300)
+        assert worker.returncode == 0, stderr.decode()
+    assert sorted(path.name for path in (shards_dir / "done").iterdir()) == names
+
+    gdf = merge_shards(shards_dir, tmp_path / "merged.gpkg")
+    assert gdf["image_id"].tolist() == [str(i) for i in range(18)]
+    assert gdf["gvi_score"].notna().all()
@@ -0,0 +1,33 @@
+from src.sidecar import open_sidecar
+
+SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS items (key TEXT PRIMARY KEY, value REAL)",
+    "CREATE INDEX IF NOT EXISTS items_value ON items (value)",
+]
+
+
+def test_open_sidecar(tmp_path):
+    path = tmp_path / "sidecar.sqlite"
+    connection = open_sidecar(path, SCHEMA, 1)
+    with connection:
+        connection.execute("INSERT INTO items VALUES ('a', 1.0)")
+    connection.close()
+
+    # Tables are kept while the schema version is the same
+    connection = open_sidecar(path, SCHEMA, 1)
+    assert connection.execute("SELECT * FROM items").fetchall() == [("a", 1.0)]
+    connection.close()
+
+    # and dropped, with tables of older schemas, when it changes
+    connection = open_sidecar(path, SCHEMA[:1], 2, wal=True)
+    assert connection.execute("SELECT * FROM items").fetchall() == []
+    assert connection.execute("PRAGMA user_version").fetchone()[0] == 2
+    assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    connection.execute("CREATE TABLE other (key TEXT)")
+    connection.close()
+    connection = open_sidecar(path, SCHEMA, 3)
+    tables = connection.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'"
+    ).fetchall()
+    assert tables == [("items",)]
+    connection.close()
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from src.images.spatial_index import WGS84_GEOD, SpatialImageIndex
+
+
+def greedy_reference(latitudes, longitudes, points, max_distance):
+    """Brute force nearest unassigned image search over all the images."""
+    assigned = np.zeros(len(latitudes), dtype=bool)
+    images = []
+    for latitude, longitude in points:
+        _, _, distances = WGS84_GEOD.inv(
+            np.full(len(latitudes), longitude),
+            np.full(len(latitudes), latitude),
+            longitudes,
+            latitudes,
+        )
+        distances[assigned] = np.inf
+        closest = int(np.argmin(distances))
+        if distances[closest] < max_distance:
+            assigned[closest] = True
+            images.append(closest)
+        else:
+            images.append(-1)
+    return images
+
+
+@pytest.mark.parametrize("max_distance", [10, 1000])
+def test_continent_wide(max_distance):
+    # Images from the Aleutians to Greenland, far outside any single UTM zone
+    rng = np.random.default_rng(0)
+    latitudes = rng.uniform(10, 70, 200)
+    longitudes = rng.uniform(-170, -50, 200)
+    latitudes[:2] = 10
+    longitudes[:2] = [-170, -60]
+    # Points near images, in random directions and at distances around max_distance
+    chosen = rng.integers(0, len(latitudes), 300)
+    chosen[0] = 0
+    point_longitudes, point_latitudes, _ = WGS84_GEOD.fwd(
+        longitudes[chosen],
+        latitudes[chosen],
+        rng.uniform(-180, 180, len(chosen)),
+        rng.uniform(0, 1.5 * max_distance, len(chosen)),
+    )
+    point_longitudes[0], point_latitudes[0], _ = WGS84_GEOD.fwd(
+        -170, 10, 30, 0.8 * max_distance
+    )
+    points = list(zip(point_latitudes, point_longitudes))
+    expected = greedy_reference(latitudes, longitudes, points, max_distance)
+    assert expected[0] == 0
+
+    index = SpatialImageIndex(latitudes, longitudes)
+    images = []
+    for latitude, longitude in points:
+        image, residual = index.nearest(latitude, longitude, max_distance)
+        if image is not None:
+            assert residual < max_distance
+            index.assign(image)
+        images.append(-1 if image is None else image)
+    assert images == expected
+
+    index = SpatialImageIndex(latitudes, longitudes)
+    images, residuals = index.nearest_many(
+        point_latitudes, point_longitudes, max_distance
+    )
+    assert images.tolist() == expected
+    assert (residuals[images >= 0] < max_distance).all()
+    assert np.isnan(residuals[images < 0]).all()
+
+
+def test_empty():
+    index = SpatialImageIndex([], [])
+    assert index.nearest(10, -170, 10) == (None, None)
+    images, residuals = index.nearest_many([10], [-170], 10)
+    assert images.tolist() == [-1]
+    assert np.isnan(residuals).all()